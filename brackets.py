@@ -0,0 +1,232 @@
+#-*- encoding: utf-8
+"""
+Index of brackets outside strings and comments for matching and navigation.
+"""
+
+import re
+
+OPENING = "([{"
+CLOSING = ")]}"
+PAIRS = {"(": ")", "[": "]", "{": "}", ")": "(", "]": "[", "}": "{"}
+
+# Comment and string syntax by file extension: (line comment, block comment, string delimiters)
+HASH = ("#", None, ['"""', "'''", '"', "'"])
+SLASH = ("//", ("/*", "*/"), ['"', "'", "`"])
+SYNTAXES = {
+    "py": HASH, "sh": HASH, "rb": HASH, "pl": HASH, "yml": HASH, "yaml": HASH, "toml": HASH,
+    "c": SLASH, "h": SLASH, "cpp": SLASH, "hpp": SLASH, "cs": SLASH, "java": SLASH,
+    "js": SLASH, "ts": SLASH, "go": SLASH, "rs": SLASH, "php": SLASH, "css": SLASH,
+    "scss": SLASH, "less": SLASH, "swift": SLASH, "kt": SLASH, "json": SLASH,
+}
+PLAIN = (None, None, [])
+
+MAX_SCAN_LINES = 2000   # Lines searched for the pair enclosing the cursor when highlighting
+
+class Syntax:
+    """Tokenizer for finding brackets in one line at a time."""
+    def __init__(self, line_comment, block_comment, strings):
+        self.block_comment = block_comment
+        tokens = list(OPENING + CLOSING) + strings
+        if line_comment:
+            tokens.append(line_comment)
+        if block_comment:
+            tokens.append(block_comment[0])
+        self.line_comment = line_comment
+        self.pattern = re.compile("|".join(re.escape(token) for token in tokens))
+        # Patterns that match the rest of a string up to and including the closing delimiter
+        self.string_ends = {}
+        for delim in strings:
+            self.string_ends[delim] = re.compile(r"(?:\\.|[^\\])*?" + re.escape(delim))
+
+    def scan(self, text, state):
+        """Find the brackets on a line.
+
+        state is None or the string delimiter or block comment end that the
+        line starts inside of. Returns (brackets, state at the end of the line),
+        where brackets is a list of (index, bracket).
+        """
+        brackets = []
+        pos = 0
+        length = len(text)
+        while pos < length:
+            if state != None:
+                if self.block_comment and state == self.block_comment[1]:
+                    end = text.find(state, pos)
+                    if end == -1:
+                        return brackets, state
+                    pos = end + len(state)
+                else:
+                    match = self.string_ends[state].match(text, pos)
+                    if not match:
+                        # Only strings with longer or escaped line ends continue on the next line
+                        if len(state) > 1 or text.endswith("\\"):
+                            return brackets, state
+                        return brackets, None
+                    pos = match.end()
+                state = None
+                continue
+            match = self.pattern.search(text, pos)
+            if not match:
+                break
+            token = match.group(0)
+            pos = match.end()
+            if len(token) == 1 and token in PAIRS:
+                brackets.append((match.start(), token))
+            elif token == self.line_comment:
+                break
+            elif self.block_comment and token == self.block_comment[0]:
+                state = self.block_comment[1]
+            else:
+                state = token
+        return brackets, state
+
+class BracketIndex:
+    """Brackets on each line, scanned lazily and kept up to date after edits.
+
+    Lines are scanned from the top as far as needed. For each line the
+    state it began in (inside a string or comment or not), its brackets and
+    the state it ended in are stored. An edit only drops the edited lines.
+    Scanning again reuses lines that begin in the same state as before and
+    stops once it's past the edits.
+    """
+    def __init__(self, viewer):
+        self.viewer = viewer
+        self.extension = None
+        self.syntax = None
+        self.lines_reset()
+
+    def lines_reset(self):
+        """Forget everything."""
+        self.entries = []       # (start state, brackets, end state) of scanned lines, None if edited
+        self.valid = 0          # Lines before this are up to date
+        self.edit_end = 0       # Lines from here on haven't been edited since they were scanned
+
+    def lines_changed(self, y, removed, added):
+        """Lines y...y+removed were replaced with added new lines."""
+        self.valid = min(self.valid, y)
+        if y >= len(self.entries):
+            return
+        self.entries[y:y+removed] = [None] * added
+        if self.edit_end > y:
+            self.edit_end = max(self.edit_end + added - removed, y + added)
+        else:
+            self.edit_end = y + added
+
+    def check_syntax(self):
+        ext = self.viewer.file_extension
+        if ext != self.extension or self.syntax == None:
+            self.extension = ext
+            self.syntax = Syntax(*SYNTAXES.get(ext, PLAIN))
+            self.lines_reset()
+
+    def scan_to(self, y):
+        """Make sure the brackets of lines up to y are up to date."""
+        self.check_syntax()
+        lines = self.viewer.lines
+        entries = self.entries
+        y = min(y, len(lines)-1)
+        state = entries[self.valid-1][2] if self.valid > 0 else None
+        while self.valid <= y:
+            i = self.valid
+            entry = entries[i] if i < len(entries) else None
+            if entry != None and entry[0] == state:
+                if i >= self.edit_end:
+                    # Past the edits everything is still valid
+                    self.valid = len(entries)
+                    state = entries[-1][2]
+                    continue
+            else:
+                brackets, end = self.syntax.scan(lines[i].data, state)
+                entry = (state, brackets, end)
+                if i < len(entries):
+                    entries[i] = entry
+                else:
+                    entries.append(entry)
+            state = entry[2]
+            self.valid += 1
+        self.edit_end = max(self.edit_end, self.valid)
+
+    def line_brackets(self, y):
+        """Return the (index, bracket) pairs on line y."""
+        self.scan_to(y)
+        return self.entries[y][1]
+
+    def bracket_at(self, x, y):
+        """Return the bracket at character x on line y, or None."""
+        for bx, bracket in self.line_brackets(y):
+            if bx == x:
+                return bracket
+        return None
+
+    def find_match(self, x, y, limit=None):
+        """Return the position of the bracket matching the one at (x, y), or None."""
+        bracket = self.bracket_at(x, y)
+        if bracket == None:
+            return None
+        if bracket in OPENING:
+            return self.search_forward(x, y, bracket, limit)
+        return self.search_backward(x, y, bracket, limit)
+
+    def search_forward(self, x, y, opening, limit=None):
+        """Find the bracket closing the opening one at (x, y)."""
+        closing = PAIRS[opening]
+        depth = 0
+        last = len(self.viewer.lines)-1
+        if limit != None:
+            last = min(last, y + limit)
+        start = y
+        while y <= last:
+            for bx, bracket in self.line_brackets(y):
+                if y == start and bx <= x:
+                    continue
+                if bracket == opening:
+                    depth += 1
+                elif bracket == closing:
+                    if depth == 0:
+                        return (bx, y)
+                    depth -= 1
+            y += 1
+        return None
+
+    def search_backward(self, x, y, closing, limit=None):
+        """Find the bracket opening the closing one at (x, y)."""
+        found = self.enclosing(x, y, limit, closing)
+        if found and self.bracket_at(*found) == PAIRS[closing]:
+            return found
+        return None
+
+    def enclosing(self, x, y, limit=None, closing=None):
+        """Return the position of the nearest unclosed opening bracket before (x, y).
+
+        With closing given, only brackets of that kind are counted.
+        """
+        self.scan_to(y)
+        first = 0
+        if limit != None:
+            first = max(0, y - limit)
+        depth = {}
+        start = y
+        while y >= first:
+            for bx, bracket in reversed(self.entries[y][1]):
+                if y == start and bx >= x:
+                    continue
+                if closing != None and bracket != closing and bracket != PAIRS[closing]:
+                    continue
+                if bracket in CLOSING:
+                    depth[bracket] = depth.get(bracket, 0) + 1
+                elif depth.get(PAIRS[bracket], 0):
+                    depth[PAIRS[bracket]] -= 1
+                else:
+                    return (bx, y)
+            y -= 1
+        return None
+
+    def enclosing_pair(self, x, y, limit=MAX_SCAN_LINES):
+        """Return the positions of the bracket pair enclosing (x, y), or None."""
+        opening = self.enclosing(x, y, limit)
+        if opening == None:
+            return None
+        closing = self.search_forward(opening[0], opening[1], self.bracket_at(*opening), limit)
+        if closing == None:
+            return None
+        return (opening, closing)
@@ -0,0 +1,114 @@
+#-*- encoding: utf-8
+"""
+Random access to the contents of gzip files.
+"""
+
+import zlib
+import bisect
+import threading
+
+GZIP_WBITS = 16 + zlib.MAX_WBITS    # Expect a gzip header and trailer
+READ_SIZE = 256 * 1024              # Compressed bytes decompressed at a time
+CHECKPOINT_SPACING = 4 * 1024 * 1024 # Uncompressed bytes between checkpoints
+CACHED_SPANS = 4                    # Decompressed spans kept in memory
+
+def decompress(d, chunk):
+    """Decompress a chunk, continuing into the gzip members after the first one.
+
+    Returns the decompressor to use for the next chunk and the data.
+    """
+    parts = []
+    while True:
+        parts.append(d.decompress(chunk))
+        if not d.eof or not d.unused_data:
+            break
+        chunk = d.unused_data
+        if not chunk.strip(b"\0"):
+            break # Padding at the end
+        d = zlib.decompressobj(GZIP_WBITS)
+    return d, b"".join(parts)
+
+class GzipIndex:
+    """Checkpoints for reading any part of a gzip file without decompressing all of it.
+
+    build() decompresses the whole file once, keeping a copy of the
+    decompressor and the compressed offset it had reached about every
+    CHECKPOINT_SPACING bytes of output. Reading resumes from the closest
+    checkpoint before the wanted data, so at most one span between two
+    checkpoints is decompressed. The last few spans are cached, since
+    scrolling reads the same parts over and over.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.size = 0           # Uncompressed size, known after build()
+        self.offsets = []       # Uncompressed offset of each checkpoint
+        self.checkpoints = []   # (compressed offset, decompressor) of each checkpoint
+        self.cache = {}         # Checkpoint index -> decompressed span
+        self.lock = threading.Lock()
+
+    def build(self, on_data=None):
+        """Decompress the file once to find the checkpoints, passing the data to on_data."""
+        f = open(self.path, "rb")
+        try:
+            d = zlib.decompressobj(GZIP_WBITS)
+            in_pos = 0
+            out_pos = 0
+            while True:
+                if not self.offsets or out_pos - self.offsets[-1] >= CHECKPOINT_SPACING:
+                    self.offsets.append(out_pos)
+                    self.checkpoints.append((in_pos, d.copy()))
+                chunk = f.read(READ_SIZE)
+                if not chunk:
+                    break
+                in_pos += len(chunk)
+                d, data = decompress(d, chunk)
+                out_pos += len(data)
+                if on_data and data:
+                    on_data(data)
+            if not d.eof:
+                raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+        finally:
+            f.close()
+        self.size = out_pos
+        self.offsets.append(out_pos)
+        self.checkpoints.append((in_pos, None))
+
+    def span(self, i):
+        """Return the decompressed data between checkpoints i and i+1."""
+        with self.lock:
+            if i in self.cache:
+                return self.cache[i]
+            start, saved = self.checkpoints[i]
+            end = self.checkpoints[i+1][0]
+            d = saved.copy()
+            parts = []
+            f = open(self.path, "rb")
+            try:
+                f.seek(start)
+                while start < end:
+                    chunk = f.read(min(READ_SIZE, end-start))
+                    if not chunk:
+                        break
+                    start += len(chunk)
+                    d, data = decompress(d, chunk)
+                    parts.append(data)
+            finally:
+                f.close()
+            if len(self.cache) >= CACHED_SPANS:
+                del self.cache[next(iter(self.cache))]
+            data = b"".join(parts)
+            self.cache[i] = data
+            return data
+
+    def read(self, offset, size):
+        """Return size uncompressed bytes starting at offset."""
+        parts = []
+        end = min(offset+size, self.size)
+        i = bisect.bisect_right(self.offsets, offset) - 1
+        while offset < end and i < len(self.offsets)-1:
+            data = self.span(i)
+            start = self.offsets[i]
+            parts.append(data[offset-start:end-start])
+            offset = start + len(data)
+            i += 1
+        return b"".join(parts)
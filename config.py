@@ -16,8 +16,23 @@ class Config:
         self.defaults = {
             "app": {
                 "remember_open_files": False,
+                "remember_undo_history": False,
                 "debug": False,
-                "escdelay": 50
+                "escdelay": 50,
+                "update_interval": 0.2, # Seconds between background updates
+                "watch_files": True,    # Reload files changed by other programs
+                "watch_interval": 1.0,
+                "follow_redraw_interval": 0.5,      # Max redraw rate of followed files
+                "follow_max_read": 4*1024*1024,     # Bytes read per update when following
+                "search_ignore": [".git", ".hg", ".svn", "__pycache__", "node_modules", "*.pyc"],
+                "search_max_size": 16*1024*1024,    # Larger files are skipped when searching files
+                "index_max_files": 200000,          # Files indexed for opening files by name
+                "journal_edits": True,              # Keep a journal of unsaved edits to recover after a crash
+                "journal_interval": 1.0,            # Seconds between writing journals to disk
+                "compressed_index_size": 16*1024*1024, # Larger gzip files are shown read only, decompressed in parts
+                "read_only_size": 64*1024*1024,     # Larger files are memory mapped and shown read only
+                "load_threads": 4,                  # Threads loading the files given on the command line
+                "load_pool_size": 8*1024*1024,      # Larger files are read and decoded in worker processes
             },
             "editor": {
                 "auto_indent_newline": True,
@@ -28,12 +43,17 @@ class Config:
                 "punctuation": " (){}[]'\"=+-/*.:,;_", # for jumping between words
                 "line_end_char": "",
                 "white_space_char": "\u25E6",
+                "fold_char": "\u2026", # Shown after folded lines
                 "show_white_space": False,
                 "show_line_nums": True,
+                "soft_wrap": False,
                 "show_line_colors": True,
                 "show_highlighting": False,
+                "highlight_brackets": True, # Highlight the brackets around the cursor
                 "use_mouse": False,
                 "regex_find": False,
+                "transform_pool_lines": 2000000, # Use worker processes for transforms this big
+                "outline_thread_lines": 20000, # Find symbols in a background thread in files this big
             },
             "display": {
                 "show_top_bar": True,
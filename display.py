@@ -0,0 +1,103 @@
+#-*- encoding: utf-8
+"""
+Display width of text in terminal cells.
+"""
+
+import bisect
+import unicodedata
+import functools
+
+@functools.lru_cache(maxsize=8192)
+def char_width(c):
+    """Return the number of terminal cells a (non tab) character takes."""
+    if unicodedata.combining(c):
+        return 0
+    category = unicodedata.category(c)
+    if category in ("Mn", "Me", "Cf"):
+        return 0 # Marks and format characters like zero width joiner
+    if unicodedata.east_asian_width(c) in ("W", "F"):
+        return 2
+    return 1
+
+def is_simple(text):
+    """Check if every character of text takes exactly one cell."""
+    return text.isascii() and not "\t" in text
+
+def column_map(text, tab_width, start=0):
+    """Return the display column where each character begins, when text begins at column start.
+
+    The list has one extra item for the end of the text. None is returned
+    when columns are equal to character indices.
+    """
+    if is_simple(text):
+        return None
+    cols = [0] * (len(text)+1)
+    col = start
+    i = 0
+    for c in text:
+        cols[i] = col
+        if c == "\t":
+            col += tab_width - col % tab_width
+        elif c < "\x7f":
+            col += 1
+        else:
+            col += char_width(c)
+        i += 1
+    cols[i] = col
+    return cols
+
+def row_starts(text, cols, width):
+    """Return the character indices where each row begins when wrapped to width.
+
+    Wide characters are never split between rows and the last row leaves
+    room for a cursor at the end. None is returned for simple text.
+    """
+    if cols == None:
+        return None
+    n = len(text)
+    starts = [0]
+    row_col = 0
+    while True:
+        i = bisect.bisect_right(cols, row_col + width) - 1
+        if i >= n:
+            if cols[n] - row_col >= width:
+                starts.append(n)
+            break
+        if i <= starts[-1]:
+            i = starts[-1] + 1 # A single character wider than a row
+        starts.append(i)
+        row_col = cols[i]
+    return starts
+
+def char_at_column(cols, col, length):
+    """Return the index of the character shown at display column col."""
+    if cols == None:
+        return max(0, min(col, length))
+    if col >= cols[-1]:
+        return length
+    return max(0, bisect.bisect_right(cols, col) - 1)
+
+def slice_columns(text, cols, start, width):
+    """Return the part of text that's shown between columns start and start+width.
+
+    Tabs are expanded to spaces and wide characters that don't fit
+    entirely are replaced with spaces.
+    """
+    if cols == None:
+        return text[start:start+width]
+    n = len(text)
+    end = start + width
+    i = bisect.bisect_left(cols, start, 0, n)
+    parts = []
+    if i < n and cols[i] > start:
+        parts.append(" " * min(cols[i] - start, width)) # Partly scrolled out character
+    while i < n and cols[i+1] <= end:
+        c = text[i]
+        if c == "\t":
+            parts.append(" " * (cols[i+1] - cols[i]))
+        elif "\ud800" <= c <= "\udfff":
+            parts.append("?") # Undecodable byte stored as a lone surrogate
+        else:
+            parts.append(c)
+        i += 1
+    return "".join(parts)
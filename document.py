@@ -0,0 +1,40 @@
+#-*- encoding: utf-8
+"""
+Text shared by the views of a file.
+"""
+
+from line import *
+
+class Document:
+    """Lines and undo history shared by one or more views.
+
+    Each view keeps its own cursors, scroll position and screen layout.
+    Edits made through any view are announced to all views, so they can
+    move their cursors and redraw what changed, and to the indexes that
+    only depend on the text, which are kept once per document.
+    """
+    def __init__(self):
+        self.lines = [Line()]
+        self.revision = 0           # Incremented on every change to the lines
+        self.read_only = False      # True when the lines can't be changed, see Viewer.set_lines
+        self.views = []             # Viewers showing the document
+        self.listeners = []         # Indexes shared by the views, notified when lines change
+        self.history = []           # Editor states for undo/redo
+        self.current_state = 0
+        self.last_action = None
+
+    def lines_changed(self, y, removed, added, source):
+        """Lines y...y+removed were replaced with added lines through the view source."""
+        self.revision += 1
+        for view in self.views:
+            view.view_lines_changed(y, removed, added, source)
+        for listener in self.listeners:
+            listener.lines_changed(y, removed, added)
+
+    def lines_reset(self, source):
+        """Any or all lines may have been changed through the view source."""
+        self.revision += 1
+        for view in self.views:
+            view.view_lines_reset(source)
+        for listener in self.listeners:
+            listener.lines_reset()
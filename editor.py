@@ -8,11 +8,49 @@ import re
 import sys
 import time
 import curses
+import bisect
+import difflib
+import concurrent.futures
 
+import search
+from completion import *
 from line import *
 from cursor import *
 from helpers import *
 from viewer import *
+from lazylines import *
+
+TRANSFORM_CHUNK = 5000 # Lines given to a transform function at once
+DIFF_LIMIT = 20000 # Maximum number of changed lines to diff when updating the contents
+SPLICE_LIMIT = 16 # More separate line ranges than this are replaced and announced as one change
+
+# Keys handled by Editor.handle_input that change the text
+EDIT_KEY_CODES = [552, 547, 269, 270, 331, curses.KEY_BACKSPACE, curses.KEY_DC, curses.KEY_ENTER, 353, "\t", "\n"]
+EDIT_KEY_NAMES = ["^C", "^W", "^V", "^P", "^@"]
+
+def changed_range(old, new):
+    """Return (start, old_end, new_end) of the part that differs between two lists of strings."""
+    start = 0
+    limit = min(len(old), len(new))
+    while start < limit and old[start] == new[start]:
+        start += 1
+    end = 0
+    limit -= start
+    while end < limit and old[-1-end] == new[-1-end]:
+        end += 1
+    return start, len(old)-end, len(new)-end
+
+def transform_chunk(func, lines):
+    """Run a line transform, in a worker process."""
+    return func(lines)
+
+def transform_in_pool(func, chunks):
+    """Transform chunks of lines in a process pool. Returns None on failure."""
+    try:
+        with concurrent.futures.ProcessPoolExecutor() as pool:
+            return list(pool.map(transform_chunk, [func]*len(chunks), chunks))
+    except Exception:
+        return None
 
 class State:
     """Store editor state for undo/redo."""
@@ -27,18 +65,90 @@ class State:
 
     def store(self, editor):
         self.cursors = [cursor.tuple() for cursor in editor.cursors]
-        self.lines = [line.data for line in editor.lines]
+        self.lines = None
+        if not editor.document.read_only:
+            self.lines = [line.data for line in editor.lines]
         self.y_scroll = editor.y_scroll
         self.x_scroll = editor.x_scroll
         self.last_find = editor.last_find
 
     def restore(self, editor):
         editor.cursors = [Cursor(cursor) for cursor in self.cursors]
-        editor.lines = [Line(line) for line in self.lines]
+        if self.lines != None:
+            editor.lines = [Line(line) for line in self.lines]
         editor.y_scroll = self.y_scroll
         editor.x_scroll = self.x_scroll
         editor.last_find = self.last_find
 
+class Transaction:
+    """Group edits into one undo step with a single render.
+
+    Used as a context manager through Editor.transaction(). Edits queued
+    with set_line, insert_lines and delete_lines use the line numbers from
+    when the transaction began and are applied together when it ends.
+    Editor methods called meanwhile take effect immediately, but rendering
+    and storing undo states waits until the end. If an exception is raised
+    everything is rolled back.
+    """
+    def __init__(self, editor, action="transaction"):
+        self.editor = editor
+        self.action = action
+        self.edits = []         # Queued (y1, y2, lines) replacements
+        self.state = None       # Editor state to roll back to
+
+    def set_line(self, y, text):
+        """Replace the text of line y."""
+        self.edits.append((y, y+1, [text]))
+
+    def insert_lines(self, y, lines):
+        """Insert lines (strings) before line y."""
+        self.edits.append((y, y, list(lines)))
+
+    def delete_lines(self, y, n=1):
+        """Delete n lines starting at line y."""
+        self.edits.append((y, y+n, []))
+
+    def apply(self):
+        """Apply the queued edits from the bottom up."""
+        edits = sorted(self.edits, key=lambda edit: (edit[0], edit[1]), reverse=True)
+        limit = len(self.editor.lines)
+        for y1, y2, lines in edits:
+            if y1 < 0 or y2 > limit:
+                raise IndexError("Edit of lines " + str(y1) + "-" + str(y2) + " is out of range")
+            limit = y1 # Edits can't overlap
+        self.editor.replace_ranges([(y1, y2, [Line(line) for line in lines]) for y1, y2, lines in edits])
+        self.edits = []
+
+    def __enter__(self):
+        editor = self.editor
+        if not editor.transaction_depth:
+            editor.store_action_state(self.action)
+        self.state = State(editor)
+        self.revision = editor.revision
+        editor.transaction_depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        editor = self.editor
+        failed = exc_type != None
+        try:
+            if not failed:
+                self.apply()
+        except:
+            failed = True
+            raise
+        finally:
+            if failed:
+                self.state.restore(editor)
+                editor.lines_reset()
+            editor.transaction_depth -= 1
+            if not editor.transaction_depth:
+                editor.move_cursors()
+                if not failed and editor.revision != self.revision:
+                    editor.last_action = self.action
+                    editor.store_state()
+        return False
+
 class Editor(Viewer):
     """Extends Viewer with editing capabilities."""
     def __init__(self, app, window):
@@ -48,19 +158,214 @@ class Editor(Viewer):
         self.history = [State()]       # History of editor states for undo/redo
         self.current_state = 0         # Current state index of the editor
         self.last_action = None        # Last editor action that was used (for undo/redo)
-
-    def set_data(self, data):
+        self.jump_regexes = None       # Compiled patterns for jumping between words
+        self.transaction_depth = 0     # Number of nested transactions in progress
+        self.completion = None         # State of the last completion for cycling through them
+        self.word_index = WordIndex(self)
+        self.document.listeners.append(self.word_index)
+
+    # The undo history belongs to the document, so it's shared by all views of it
+    @property
+    def history(self):
+        return self.document.history
+
+    @history.setter
+    def history(self, history):
+        self.document.history = history
+
+    @property
+    def current_state(self):
+        return self.document.current_state
+
+    @current_state.setter
+    def current_state(self, index):
+        self.document.current_state = index
+
+    @property
+    def last_action(self):
+        return self.document.last_action
+
+    @last_action.setter
+    def last_action(self, action):
+        self.document.last_action = action
+
+    def use_document(self, other):
+        Viewer.use_document(self, other)
+        self.word_index = other.word_index
+
+    def new_view(self, window):
+        """Create another editor showing the same document."""
+        view = Editor(self.app, window)
+        view.set_config(self.config)
+        view.use_document(self)
+        return view
+
+    def set_data(self, data, lines=None):
         """Set the editor text contents."""
-        Viewer.set_data(self, data)
-        if len(self.buffer) > 1:
+        Viewer.set_data(self, data, lines)
+        if len(self.buffer) > 1 and self.history:
             self.store_state()
         else:
             state = State()
             state.store(self)
-            self.history[0] = state
+            self.history[:1] = [state] # Empty after showing read only lines
+
+    def set_lines(self, lines):
+        """Show read only lines, without undo history."""
+        Viewer.set_lines(self, lines)
+        self.history = []
+        self.current_state = 0
+
+    def update_data(self, data):
+        """Replace the contents with data, only touching the lines that differ.
+
+        Cursors and scroll positions are moved along with the lines around
+        them and the change is stored as a single undo step.
+        """
+        return self.update_lines(data.split("\n"))
+
+    def update_lines(self, new):
+        """Replace the contents with a list of line strings like update_data."""
+        old = [line.data for line in self.lines]
+        if old == new:
+            return False
+        # Skip the common beginning and end before diffing the rest
+        start, old_end, new_end = changed_range(old, new)
+        if max(old_end, new_end) - start > DIFF_LIMIT:
+            # Diffing is too slow, replace everything in between at once
+            self.replace_lines(start, old_end, [Line(line) for line in new[start:new_end]])
+        else:
+            matcher = difflib.SequenceMatcher(None, old[start:old_end], new[start:new_end], False)
+            edits = []
+            for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+                if tag != "equal":
+                    edits.append((start+i1, start+i2, [Line(line) for line in new[start+j1:start+j2]]))
+            self.replace_ranges(edits)
+        self.move_cursors(noupdate = True)
+        self.last_action = "update_data"
+        self.store_state()
+        return True
+
+    def replace_lines(self, y1, y2, lines):
+        """Replace lines y1...y2 (exclusive) with new lines and move cursors accordingly."""
+        self.replace_ranges([(y1, y2, lines)])
+
+    def insert_lines(self, y, lines):
+        """Insert new lines before line y and move cursors accordingly."""
+        self.replace_ranges([(y, y, lines)])
+
+    def delete_ranges(self, ranges):
+        """Delete line ranges given as (start, end) pairs. Returns the deleted lines in order."""
+        ranges = sorted(ranges)
+        deleted = []
+        for start, end in ranges:
+            deleted += self.lines[start:end]
+        self.replace_ranges([(start, end, []) for start, end in ranges])
+        return deleted
+
+    def replace_ranges(self, edits):
+        """Replace several line ranges at once and move cursors accordingly.
+
+        edits is a list of (y1, y2, lines) that don't overlap, with line
+        numbers from before any of them are made. Cursors and scrolling are
+        moved once for all of them instead of once per line or range.
+        """
+        edits = sorted([edit for edit in edits if edit[0] != edit[1] or edit[2]], key=lambda edit: (edit[0], edit[1]))
+        if not edits:
+            return
+        if len(edits) > SPLICE_LIMIT:
+            # Rebuild the span they cover in one go
+            first = edits[0][0]
+            last = edits[-1][1]
+            span = []
+            y = first
+            for y1, y2, lines in edits:
+                span += self.lines[y:y1]
+                span += lines
+                y = y2
+            self.lines[first:last] = span
+            self.lines_changed(first, last-first, len(span))
+        else:
+            # Patch from the bottom up so the earlier line numbers stay valid
+            for y1, y2, lines in reversed(edits):
+                self.lines[y1:y2] = lines
+                self.lines_changed(y1, y2-y1, len(lines))
+
+        starts = [edit[0] for edit in edits]
+        shifts = [0]    # shifts[i] is how much edits before the i:th one move lines
+        for y1, y2, lines in edits:
+            shifts.append(shifts[-1] + len(lines) - (y2-y1))
+
+        def new_line(y):
+            i = bisect.bisect_right(starts, y) - 1
+            if i < 0:
+                return y
+            y1, y2, lines = edits[i]
+            if y >= y2:
+                return y + shifts[i+1]
+            if y - y1 >= len(lines):
+                # The line is gone, keep it in the new range
+                y = y1 + max(0, len(lines)-1)
+            return y + shifts[i]
+
+        for cursor in self.cursors:
+            cursor.y = new_line(cursor.y)
+        self.y_scroll = new_line(self.y_scroll)
+        if not self.lines:
+            self.lines = [Line()]
+            self.lines_changed(0, 0, 1)
+
+    def transform_lines(self, func, line_nums=None, action="transform"):
+        """Transform lines with func as a single undoable step.
+
+        func gets a list of line strings and returns a list of the same
+        length. It's called on chunks of TRANSFORM_CHUNK lines, in worker
+        processes if there are enough lines. line_nums defaults to all lines.
+        """
+        if line_nums == None:
+            line_nums = range(len(self.lines))
+        line_nums = list(line_nums)
+        chunks = [line_nums[i:i+TRANSFORM_CHUNK] for i in range(0, len(line_nums), TRANSFORM_CHUNK)]
+        texts = [[self.lines[y].data for y in chunk] for chunk in chunks]
+        results = None
+        if len(line_nums) >= self.config["transform_pool_lines"]:
+            results = transform_in_pool(func, texts)
+            if results == None:
+                self.log("Transform pool failed, running in process.")
+        if results == None:
+            results = [func(chunk_texts) for chunk_texts in texts]
+
+        changed = 0
+        for chunk, old, new in zip(chunks, texts, results):
+            if len(new) != len(old):
+                raise ValueError("Transform returned " + str(len(new)) + " lines instead of " + str(len(old)))
+            for y, old_text, new_text in zip(chunk, old, new):
+                if new_text != old_text:
+                    self.lines[y].data = new_text
+                    changed += 1
+                    if changed <= TRANSFORM_CHUNK:
+                        self.lines_changed(y)
+        if changed > TRANSFORM_CHUNK:
+            self.lines_reset() # Cheaper than notifying line by line
+        self.move_cursors()
+        self.last_action = action
+        self.store_state()
+        return changed
+
+    def transaction(self, action="transaction"):
+        """Return a Transaction for grouping edits into one undo step."""
+        return Transaction(self, action)
+
+    def render(self):
+        """Render the editor, unless a transaction is in progress."""
+        if self.transaction_depth:
+            return # Rendered when the transaction ends
+        Viewer.render(self)
 
     def store_action_state(self, action, state = None):
         """Store the editor state if a new action is taken."""
+        if self.transaction_depth:
+            return
         if self.last_action != action:
             self.last_action = action
             self.store_state(state)
@@ -71,6 +376,10 @@ class Editor(Viewer):
 
     def store_state(self, state = None, action = None):
         """Store the current editor state for undo/redo."""
+        if self.transaction_depth:
+            return # Stored when the transaction ends
+        if self.document.read_only:
+            return # Nothing to undo
         if state == None:
             state = State()
             state.store(self)
@@ -98,7 +407,12 @@ class Editor(Viewer):
         #    self.current_state = self.current_state-1
 
         state = self.history[index]
+        old = [line.data for line in self.lines]
         state.restore(self)
+        # Only announce the lines that differ so indexes and journals stay incremental
+        start, old_end, new_end = changed_range(old, state.lines)
+        if old_end > start or new_end > start:
+            self.lines_changed(start, old_end-start, new_end-start)
         self.current_state = index
         self.refresh()
 
@@ -142,49 +456,45 @@ class Editor(Viewer):
         """Move cursors down."""
         self.move_cursors((0 ,1))
 
+    def jump_patterns(self):
+        """Get regexes matching a non space character and a punctuation character."""
+        chars = self.config["punctuation"]
+        if self.jump_regexes == None or self.jump_regexes[0] != chars:
+            punctuation = re.compile("[" + re.escape(chars) + "]")
+            self.jump_regexes = (chars, re.compile("[^ ]"), punctuation)
+        return self.jump_regexes[1:]
+
     def jump_left(self):
         """Jump one 'word' to the left."""
-        chars = self.config["punctuation"]
+        non_space, punctuation = self.jump_patterns()
         for cursor in self.cursors:
             line = self.lines[cursor.y]
             if cursor.x == 0:
                 continue
-            if cursor.x <= len(line):
-                cur_chr = line[cursor.x-1]
+            cursor.x = min(cursor.x, len(line))
+            # Stop after the previous non space (when on a space) or punctuation character
+            if line[cursor.x-1] == " ":
+                i = line.rsearch(non_space, cursor.x-1)
             else:
-                cur_chr = line[cursor.x]
-            while cursor.x > 0:
-                next = cursor.x-2
-                if next < 0: next = 0
-                if cur_chr == " ":
-                    cursor.x -= 1
-                    if line[next] != " ":
-                        break
-                else:
-                    cursor.x -= 1
-                    if line[next] in chars:
-                        break
+                i = line.rsearch(punctuation, cursor.x-1)
+            cursor.x = i+1
         self.move_cursors()
 
     def jump_right(self):
         """Jump one 'word' to the right."""
-        chars = self.config["punctuation"]
+        non_space, punctuation = self.jump_patterns()
         for cursor in self.cursors:
             line = self.lines[cursor.y]
-            if cursor.x == len(line):
+            if cursor.x >= len(line):
                 continue
-            cur_chr = line[cursor.x]
-            while cursor.x < len(line):
-                next = cursor.x+1
-                if next == len(line):next-=1
-                if cur_chr == " ":
-                    cursor.x += 1
-                    if line[next] != " ":
-                        break
-                else:
-                    cursor.x += 1
-                    if line[next] in chars:
-                        break
+            # Stop at the next non space (when on a space) or punctuation character
+            if line[cursor.x] == " ":
+                i = line.search(non_space, cursor.x+1)
+            else:
+                i = line.search(punctuation, cursor.x+1)
+            if i == -1:
+                i = len(line)
+            cursor.x = i
         self.move_cursors()
 
     def jump_up(self):
@@ -247,12 +557,47 @@ class Editor(Viewer):
     def page_up(self):
         """Move half a page up."""
         amount = int(self.size()[1]/2)
-        self.move_cursors((0 ,amount), noupdate = True)
+        self.move_page(amount)
 
     def page_down(self):
         """Move half a page down."""
         amount = int(self.size()[1]/2)
-        self.move_cursors((0 ,amount * -1), noupdate = True)
+        self.move_page(amount * -1)
+
+    def move_page(self, amount):
+        """Move cursors by amount screen rows."""
+        if not self.soft_wrap() and not self.folds.any():
+            self.move_cursors((0 ,amount), noupdate = True)
+            return
+        for cursor in self.cursors:
+            cursor.y = self.row_line(max(0, self.line_row(cursor.y) + amount))
+        self.move_cursors(noupdate = True)
+
+    def toggle_fold(self):
+        """Fold or unfold the indented block at the main cursor."""
+        if self.folds.toggle(self.cursor().y) == None:
+            return False
+        self.leave_folds()
+        return True
+
+    def fold_all(self):
+        """Fold all outermost indented blocks."""
+        self.folds.fold_all()
+        self.leave_folds()
+
+    def unfold_all(self):
+        """Unfold everything."""
+        self.folds.unfold_all()
+        self.move_cursors()
+
+    def leave_folds(self):
+        """Move cursors on folded lines to the fold headers."""
+        for cursor in self.cursors:
+            header = self.folds.fold_start(cursor.y)
+            if header != None:
+                cursor.y = header
+                cursor.x = len(self.lines[header])
+        self.move_cursors()
 
     def home(self):
         """Move to start of line or text on that line."""
@@ -278,11 +623,11 @@ class Editor(Viewer):
                 data = self.lines[cursor.y]
                 self.lines.pop(cursor.y)
                 self.lines[cursor.y] = Line(data+self.lines[cursor.y])
+                self.lines_changed(cursor.y, 2, 1)
                 self.move_x_cursors(cursor.y, cursor.x, -1)
             else:
-                start = line[:cursor.x]
-                end = line[cursor.x+1:]
-                self.lines[cursor.y] = Line(start+end)
+                line.delete(cursor.x, 1)
+                self.lines_changed(cursor.y)
                 self.move_x_cursors(cursor.y, cursor.x, -1)
         self.move_cursors()
         # Add a restore point if previous action != delete
@@ -303,6 +648,7 @@ class Editor(Viewer):
                 prev_line = self.lines[line_no-1]
                 length = len(prev_line) # Get the length of previous line
                 self.lines[cursor.y-1] += curr_line # Add the current line to the previous one
+                self.lines_changed(line_no-1, 2, 1)
                 line_cursors = self.get_cursors_on_line(line_no) # Get all cursors on current line
                 for line_cursor in line_cursors: # Move the cursors
                     line_cursor.y -= 1 # One line up
@@ -314,11 +660,9 @@ class Editor(Viewer):
             # Handle all other cases
             else:
                 # TODO: tab backspace
-                curr_line = self.lines[line_no]
-                # Slice one character out of the line
-                start = curr_line[:cursor.x-1]
-                end = curr_line[cursor.x:]
-                self.lines[line_no] = Line(start+end) # Store the new line
+                # Remove one character from the line
+                self.lines[line_no].delete(cursor.x-1, 1)
+                self.lines_changed(line_no)
                 cursor.x -= 1 # Move the operating curser back one
                 self.move_x_cursors(line_no, cursor.x, -1) # Do the same to the rest
         # Ensure we keep the view scrolled
@@ -347,6 +691,7 @@ class Editor(Viewer):
             if self.config["auto_indent_newline"]:
                 wspace = self.whitespace(self.lines[cursor.y])*" "
             self.lines.insert(cursor.y+1, Line(wspace+end))
+            self.lines_changed(cursor.y, 1, 2)
             self.move_y_cursors(cursor.y, 1)
             cursor.x = len(wspace)
             cursor.y += 1
@@ -362,18 +707,13 @@ class Editor(Viewer):
         if len(self.buffer) == len(self.cursors):
             curs = sorted(self.cursors, key = lambda c: (c[1], c[0]))
             for cursor in curs:
-                line = self.lines[cursor.y]
                 buf = buffer[0]
-                line = line[:cursor.x]+buf+line[cursor.x:]
-                self.lines[cursor.y] = Line(line)
+                self.lines[cursor.y].insert(cursor.x, str(buf))
+                self.lines_changed(cursor.y)
                 buffer.pop(0)
                 self.move_x_cursors(cursor.y, cursor.x-1, len(buf))
         else:
-            for buf in self.buffer:
-                y = cur[1]
-                if y < 0: y = 0
-                self.lines.insert(y, Line(buf))
-                self.move_y_cursors(cur[1]-1, 1)
+            self.insert_lines(max(0, cur.y), [Line(buf) for buf in self.buffer])
         self.move_cursors()
         # Add a restore point if previous action != insert
         self.store_action_state("insert")
@@ -393,42 +733,47 @@ class Editor(Viewer):
             self.app.set_status(start)
             if starts(line[w:], comment):
                 self.lines[cursor.y] = Line(start + line.lstrip()[len(comment):])
+                self.lines_changed(cursor.y)
                 self.move_x_cursors(cursor.y, w, 0-len(comment))
             else:
                 self.lines[cursor.y] = Line(start + comment + line.lstrip())
+                self.lines_changed(cursor.y)
                 self.move_x_cursors(cursor.y, w, len(comment))
         self.move_cursors()
         self.store_action_state("comment")
 
+    def line_blocks(self):
+        """Return the runs of consecutive lines with cursors on them as (start, end) pairs."""
+        blocks = []
+        for y in self.get_lines_with_cursors():
+            if blocks and blocks[-1][1] == y:
+                blocks[-1][1] = y+1
+            else:
+                blocks.append([y, y+1])
+        return [tuple(block) for block in blocks]
+
     def push_up(self):
         """Move current lines up by one line."""
-        used_y = []
-        curs = sorted(self.cursors, key = lambda c: (c[1], c[0]))
-        for cursor in curs:
-            if cursor.y in used_y: continue
-            used_y.append(cursor.y)
-            if cursor.y == 0: break
-            old = self.lines[cursor.y-1]
-            self.lines[cursor.y-1] = Line(self.lines[cursor.y])
-            self.lines[cursor.y] = Line(old)
-            cursor.y -= 1
+        blocks = self.line_blocks()
+        if blocks[0][0] > 0:
+            # Each block swaps places with the line above it
+            edits = [(start-1, end, self.lines[start:end] + [self.lines[start-1]]) for start, end in blocks]
+            self.replace_ranges(edits)
+            for cursor in self.cursors:
+                cursor.y -= 1
         self.move_cursors()
         # Add a restore point if previous action != push_up
         self.store_action_state("push_up")
-            
-        
+
     def push_down(self):
         """Move current lines down by one line."""
-        used_y = []
-        curs = reversed(sorted(self.cursors, key = lambda c: (c[1], c[0])))
-        for cursor in curs:
-            if cursor.y in used_y: continue
-            if cursor.y >= len(self.lines)-1:break
-            used_y.append(cursor.y)
-            old = self.lines[cursor.y+1]
-            self.lines[cursor.y+1] = Line(self.lines[cursor.y])
-            self.lines[cursor.y] = Line(old)
-            cursor.y += 1
+        blocks = self.line_blocks()
+        if blocks[-1][1] < len(self.lines):
+            # Each block swaps places with the line below it
+            edits = [(start, end+1, [self.lines[end]] + self.lines[start:end]) for start, end in blocks]
+            self.replace_ranges(edits)
+            for cursor in self.cursors:
+                cursor.y += 1
         self.move_cursors()
         # Add a restore point if previous action != push_down
         self.store_action_state("push_down")
@@ -452,47 +797,96 @@ class Editor(Viewer):
                 linenums.append(cursor.y)
                 cursor.x = 0
                 self.lines[cursor.y] = Line(line[self.config["tab_width"]:])
+                self.lines_changed(cursor.y)
         # Add a restore point if previous action != untab
         self.store_action_state("untab")
 
     def cut(self):
         """Cut lines to buffer."""
-        # Store cut lines in buffer
-        cut_buffer = []
-        # Get all lines with cursors on them
-        line_nums = self.get_lines_with_cursors()
-        # Sort from last to first (invert order)
-        line_nums = line_nums[::-1]
-        i = 0
-        while i < len(line_nums): # Iterate from last to first
-            # Make sure we don't completely remove the last line
-            if len(self.lines) == 1:
-                cut_buffer.append(self.lines[0])
-                self.lines[0] = Line()
-                break
-            line_no = line_nums[i] # Get the current line
-            line = self.lines.pop(line_no) # Get and remove the line
-            cut_buffer.append(line) # Put it in our temporary buffer
-            self.move_y_cursors(line_no, -1) # Move all cursors below the current line up
-            i += 1
+        # Lines are removed in as few ranges as possible
+        self.buffer = self.delete_ranges(self.line_blocks())
         self.move_cursors() # Make sure cursors are in valid places
-        # Reverse the buffer to get correct order and store it
-        self.buffer = cut_buffer[::-1]
         self.store_action_state("cut")
 
     def type(self, letter):
         """Insert a character."""
         for cursor in self.cursors:
-            line = self.lines[cursor.y]
-            start = line[:cursor.x]
-            end = line[cursor.x:]
-            self.lines[cursor.y] = Line(start + letter + end)
+            self.lines[cursor.y].insert(cursor.x, letter)
+            self.lines_changed(cursor.y)
             self.move_x_cursors(cursor.y, cursor.x, 1)
             cursor.x += 1
         self.move_cursors()
         # Add a restore point if previous action != type
         self.store_action_state("type")
 
+    def jump_to_bracket(self):
+        """Jump to the bracket matching the one at the cursor, or to the opening bracket around it."""
+        cursor = self.cursor()
+        pos = None
+        for x in [cursor.x, cursor.x-1]:
+            if x >= 0 and self.brackets.bracket_at(x, cursor.y):
+                pos = self.brackets.find_match(x, cursor.y)
+                break
+        else:
+            pos = self.brackets.enclosing(cursor.x, cursor.y)
+        if pos == None:
+            self.app.set_status("No matching bracket")
+            return False
+        self.cursors = [Cursor(pos[0], pos[1])]
+        self.scroll_to_line(pos[1])
+        self.move_cursors()
+        return True
+
+    def complete(self):
+        """Complete the word before the cursors with words from open files.
+
+        Completing again right after replaces the completion with the next one.
+        """
+        state = self.completion
+        if state and state[3] == self.revision and state[4] == [cursor.tuple() for cursor in self.cursors]:
+            prefix, words, i = state[:3]
+            self.delete_before_cursors(len(words[i]) - len(prefix))
+            i = (i + 1) % len(words)
+        else:
+            cursor = self.cursor()
+            match = PREFIX_PATTERN.search(self.lines[cursor.y].slice(max(0, cursor.x-100), cursor.x))
+            if not match:
+                return False
+            prefix = match.group(0)
+            indexes = [self.word_index]
+            for f in self.app.files:
+                if f.loaded and f.editor != self and not f.read_only:
+                    indexes.append(f.editor.word_index)
+            words = complete(prefix, indexes)
+            if not words:
+                self.app.set_status("No completions for '" + prefix + "'")
+                return False
+            i = 0
+        self.insert_at_cursors(words[i][len(prefix):])
+        self.move_cursors()
+        self.store_action_state("complete")
+        self.completion = (prefix, words, i, self.revision, [cursor.tuple() for cursor in self.cursors])
+        others = words[i+1:] + words[:i]
+        self.app.set_status(words[i] + ("  (next: " + " ".join(others) + ")" if others else ""))
+        return True
+
+    def insert_at_cursors(self, text):
+        """Insert text at each cursor."""
+        for cursor in self.cursors:
+            self.lines[cursor.y].insert(cursor.x, text)
+            self.lines_changed(cursor.y)
+            self.move_x_cursors(cursor.y, cursor.x, len(text))
+            cursor.x += len(text)
+
+    def delete_before_cursors(self, n):
+        """Delete n characters before each cursor (within the line)."""
+        for cursor in self.cursors:
+            count = min(n, cursor.x)
+            cursor.x -= count
+            self.lines[cursor.y].delete(cursor.x, count)
+            self.lines_changed(cursor.y)
+            self.move_x_cursors(cursor.y, cursor.x, -count)
+
     def go_to_pos(self, line_no, col = 0):
         """Move primary cursor to line_no, col=0."""
         if line_no < 0:
@@ -514,6 +908,32 @@ class Editor(Viewer):
         if not what:
             return
         last_cursor = self.get_last_cursor()
+        if isinstance(self.lines, IndexedLines):
+            new_cursors = self.find_indexed(what, last_cursor, findall)
+        else:
+            new_cursors = self.find_in_lines(what, last_cursor, findall)
+
+        if not new_cursors:
+            self.app.set_status("Can't find '" + what + "'")
+            #self.last_find = ""
+            return
+        else:
+            # If we only have one cursor, and it's not
+            # where the first occurance is, just remove it
+            if len(self.cursors) == 1 and self.cursors[0].tuple() != new_cursors[0].tuple():
+                self.cursors = []
+        self.last_find = what   # Only store string if it's really found
+
+        # Add the new cursors
+        for cursor in new_cursors:
+            self.cursors.append(cursor)
+
+        destination = self.get_last_cursor().y
+        self.scroll_to_line(destination)
+        self.store_action_state("find") # Store undo point
+
+    def find_in_lines(self, what, last_cursor, findall):
+        """Return cursors at the matches of what after last_cursor, line by line."""
         y = last_cursor.y
 
         found = False
@@ -550,24 +970,38 @@ class Editor(Viewer):
             if found and not findall: break
             y += 1
 
-        if not new_cursors:
-            self.app.set_status("Can't find '" + what + "'")
-            #self.last_find = ""
-            return
-        else:
-            # If we only have one cursor, and it's not
-            # where the first occurance is, just remove it
-            if len(self.cursors) == 1 and self.cursors[0].tuple() != new_cursors[0].tuple():
-                self.cursors = []
-        self.last_find = what   # Only store string if it's really found
-
-        # Add the new cursors
-        for cursor in new_cursors:
-            self.cursors.append(cursor)
+        return new_cursors
 
-        destination = self.get_last_cursor().y
-        self.scroll_to_line(destination)
-        self.store_action_state("find") # Store undo point
+    def find_indexed(self, what, last_cursor, findall):
+        """Return cursors at the matches of what after last_cursor, searching the bytes of a large file."""
+        new_cursors = []
+        for x, y in self.lines.find(what, self.config["regex_find"], last_cursor.x, last_cursor.y):
+            new = Cursor(x, y)
+            if not self.cursor_exists(new):
+                new_cursors.append(new)
+                if not findall:
+                    break
+        return new_cursors
+
+    def replace(self, what, replacement, regex=None):
+        """Replace all occurances of what as a single undo step. Returns the number of replacements."""
+        if self.document.read_only:
+            return 0
+        if regex == None:
+            regex = self.config["regex_find"]
+        pattern = search.compile_pattern(what, regex)
+        template = search.replace_template(replacement, regex)
+        count = 0
+        with self.transaction("replace"):
+            y = 0
+            for line in self.lines:
+                new, n = pattern.subn(template, line.data)
+                if n:
+                    line.data = new
+                    self.lines_changed(y)
+                    count += n
+                y += 1
+        return count
 
     def find_next(self):
         """Find next occurance."""
@@ -595,20 +1029,26 @@ class Editor(Viewer):
 
     def duplicate_line(self):
         """Copy current line and add it below as a new line."""
-        curs = sorted(self.cursors, key = lambda c: (c.y, c.x))
-        for cursor in curs:
-            line = Line(self.lines[cursor.y])
-            self.lines.insert(cursor.y+1, line)
-            self.move_y_cursors(cursor.y, 1)
+        edits = [(y+1, y+1, [Line(self.lines[y])]) for y in self.get_lines_with_cursors()]
+        self.replace_ranges(edits)
         self.move_cursors()
         self.store_action_state("duplicate_line")
 
+    def is_edit_key(self, key, name):
+        """Check if a key changes the text."""
+        if name in EDIT_KEY_NAMES or key in EDIT_KEY_CODES:
+            return True
+        return isinstance(key, str) and key.isprintable()
+
     def handle_input(self, event):
         """Handle input."""
         if event.type == "mouse":
             return False
         key = event.key_code
         name = event.key_name
+        if self.document.read_only and self.is_edit_key(key, name):
+            self.app.set_status("The file is read only.")
+            return True
         if key == curses.KEY_RIGHT: self.arrow_right()        # Arrow Right
         elif key == curses.KEY_LEFT: self.arrow_left()        # Arrow Left
         elif key == curses.KEY_UP: self.arrow_up()            # Arrow Up
@@ -627,7 +1067,9 @@ class Editor(Viewer):
         elif key == 270: self.redo()                          # F6
         elif key == 273: self.toggle_line_nums()              # F9
         elif key == 274: self.toggle_line_ends()              # F10
+        elif key == 271: self.toggle_soft_wrap()              # F7
         elif key == 275: self.toggle_highlight()              # F11
+        elif key == 276: self.toggle_fold()                   # F12
         elif key == 563: self.new_cursor_up()                 # Alt + up
         elif key == 522: self.new_cursor_down()               # Alt + down
         elif key == 542: self.new_cursor_left()               # Alt + left
@@ -641,6 +1083,8 @@ class Editor(Viewer):
         elif name == "^P": self.comment()                     # Ctrl + P
         elif name == "^D": self.find_next()                   # Ctrl + D
         elif name == "^A": self.find_all()                    # Ctrl + A
+        elif name == "^@": self.complete()                    # Ctrl + Space
+        elif name == "^B": self.jump_to_bracket()             # Ctrl + B
         elif key == 544: self.jump_left()                     # Ctrl + Left
         elif key == 559: self.jump_right()                    # Ctrl + Right
         elif key == 565: self.jump_up()                       # Ctrl + Up
@@ -6,16 +6,37 @@ File object for storing an opened file and editor.
 import os
 import time
 
+import textio
+from helpers import *
+from compressed import *
+from lazylines import *
+
 class File:
     def __init__(self, parent = None):
         self.parent = parent
         self.name = ""
         self.fpath = ""
         self.data = None
-        self.read_only = False
+        self.data_revision = None   # Editor revision that matches self.data
+        self.encoding = None        # Detected when loading if not set
+        self.compression = None     # "gzip", "bz2" or "xz" for compressed files, detected when loading
+        self.read_only = False      # Shown without undo history or editing, decided when loading
+        self.force_read_only = False # Set before loading to make the file read only whatever its size
         self.last_save = None
         self.opened = time.time()
-        self.editor = None
+        self.editor = None          # The view being edited
+        self.views = []             # Editors showing the file, the same document in each
+        self.split = None           # How views are laid out: None, "horizontal" or "vertical"
+        self.loaded = True          # False until a lazily restored file is loaded
+        self.session_entry = None   # Saved state to apply once a lazy file is loaded
+        self.on_load = None
+        self.disk_stat = None       # (mtime, size) of the file when last read or written
+        self.follow = False         # Follow (tail) mode for growing files
+        self.follow_offset = 0      # Byte offset up to which the file has been read
+        self.follow_decoder = None
+        self.follow_edits = False   # Whether the buffer has unsaved edits besides appended data
+        self.follow_revision = None # Editor revision after the data was last appended
+        self.journal = None         # Journal of unsaved edits, see journal.py
 
     def _path(self):
         return os.path.join(self.fpath, self.name)
@@ -45,48 +66,294 @@ class File:
         self.data = data
         if self.editor:
             self.editor.set_data(data)
+            self.data_revision = self.editor.revision
                 
     def set_editor(self, editor):
         self.editor = editor
+        self.views = [editor]
         ext = self.name.split(".")
         if len(ext) > 1:
             editor.set_file_extension(ext[-1])
 
+    def add_view(self, window, split):
+        """Show the file in another editor sharing the same document."""
+        view = self.editor.new_view(window)
+        self.views.append(view)
+        self.split = split
+        return view
+
+    def close_views(self):
+        """Remove all views except the one being edited."""
+        for view in self.views:
+            if view != self.editor:
+                view.close_view()
+        self.views = [self.editor]
+        self.split = None
+
+    def next_view(self):
+        """Switch to editing the next view."""
+        i = self.views.index(self.editor)
+        self.editor = self.views[(i+1) % len(self.views)]
+        return self.editor
+
+    def set_lazy(self, entry, on_load):
+        """Postpone loading until the file is needed."""
+        self.loaded = False
+        self.session_entry = entry
+        self.on_load = on_load
+
+    def ensure_loaded(self):
+        """Load a lazily restored file on first use."""
+        if self.loaded:
+            return True
+        self.loaded = True
+        result = self.load()
+        if result and self.on_load:
+            self.on_load(self, self.session_entry)
+        self.on_load = None
+        self.session_entry = None
+        return result
+
     def set_saved(self, m):
          self.last_save = time.time()
 
+    def stat(self):
+        """Return (mtime, size) of the file on disk or None."""
+        try:
+            st = os.stat(self._path())
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def default_encoding(self):
+        """Return the configured fallback encoding."""
+        if self.parent:
+            return self.parent.config["editor"]["default_encoding"]
+        return "utf-8"
+
     def save(self):
         path = self._path()
         data = self.editor.get_data()
+        encoding = self.encoding or textio.normalize_encoding(self.default_encoding()) or "utf-8"
         try:
-            f = open(self._path(), "w")
-            f.write(data)
-            f.close()
+            # Written next to the file and moved over it, so a failed save leaves it as it was
+            textio.write_text_atomic(os.path.realpath(path), data, encoding, self.compression)
         except:
+            self.log(get_error_info())
             return False
+        self.encoding = encoding
         self.data = data
+        self.data_revision = self.editor.revision
         self.last_save = time.time()
+        self.disk_stat = self.stat()
+        if self.follow and self.disk_stat:
+            # Follow what's appended after the saved contents
+            self.follow_edits = False
+            self.follow_revision = self.editor.revision
+            self.follow_offset = self.disk_stat[1]
+            self.follow_decoder = textio.get_decoder(self.encoding)
         return True
 
-    def load(self, read=True):
-        if not read:
-            return True
-        path = self._path()
+    def read(self, pool=None):
+        """Read the file contents from disk. Returns False on failure.
+
+        Files of at least load_pool_size bytes are read and decoded in the
+        process pool if one is given.
+        """
         try:
-            f = open(self._path())
-            data = f.read()
-            f.close()
+            stat = self.stat()
+            compression = textio.detect_compression(self._path())
+            args = (self._path(), self.encoding, self.default_encoding(), compression)
+            result = None
+            if pool and stat and stat[1] >= self.parent.config["app"]["load_pool_size"]:
+                try:
+                    result = pool.submit(textio.read_text, *args).result()
+                except Exception:
+                    self.log("Load pool failed, reading in process.")
+            if result == None:
+                result = textio.read_text(*args)
+            data, encoding = result
         except Exception as inst:
             self.log(type(inst))    # the exception instance
             self.log(inst.args)     # arguments stored in .args
             self.log(inst)          # __str__ allows args to be printed directly,
             return False
-        self.data = data
-        self.editor.set_data(data)
+        self.disk_stat = stat
+        self.compression = compression
+        self.encoding = encoding
+        return data
+
+    def read_indexed(self):
+        """Index a large or read only file to read the parts of it that are shown.
+
+        Uncompressed files are memory mapped and big gzip files are
+        decompressed in parts. Returns read only IndexedLines or None if the
+        file should be read as usual.
+        """
+        path = self._path()
+        if not self.parent or self.follow:
+            return None
+        config = self.parent.config["app"]
+        try:
+            size = os.path.getsize(path)
+            compression = textio.detect_compression(path)
+            if compression == "gzip" and size >= config["compressed_index_size"]:
+                source = GzipIndex(path)
+            elif compression == None and size and (self.force_read_only or size >= config["read_only_size"]):
+                source = MappedFile(path)
+            else:
+                return None
+            stat = self.stat()
+            lines = IndexedLines(source, self.encoding, self.default_encoding()).build()
+        except:
+            self.log(get_error_info())
+            return None
+        self.disk_stat = stat
+        self.compression = compression
+        self.encoding = lines.encoding
+        return lines
+
+    def load(self, read=True):
+        if not read:
+            return True
+        return self.show_contents(self.read_contents())
+
+    def read_contents(self, pool=None):
+        """Read the file and split it into lines without touching the editor.
+
+        Safe to run in a loader thread, see LoadJob. Returns what
+        show_contents() expects or False on failure.
+        """
+        lines = self.read_indexed()
+        if lines != None:
+            return lines
+        data = self.read(pool)
+        if data is False:
+            return False
+        if self.force_read_only:
+            return data, tuple(ReadOnlyLine(line) for line in data.split("\n"))
+        return data, [Line(line) for line in data.split("\n")]
+
+    def show_contents(self, contents):
+        """Show what read_contents() returned in the editor."""
+        if contents is False:
+            return False
+        if isinstance(contents, IndexedLines):
+            self.data = None
+            self.read_only = True
+            self.editor.set_lines(contents)
+        else:
+            self.data, lines = contents
+            # Files that were too big may have been truncated, read only is decided again
+            self.read_only = self.force_read_only
+            if self.read_only:
+                self.editor.set_lines(lines)
+            else:
+                self.editor.set_data(self.data, lines)
+        self.data_revision = self.editor.revision
+        return True
+
+    def set_follow(self, follow):
+        """Start or stop following data appended to the file.
+
+        Returns False if the file can't be followed, or if it changed on
+        disk since it was read and can't be reloaded without losing edits.
+        """
+        if follow:
+            if not self.disk_stat or self.compression or self.read_only:
+                return False
+            stat = self.stat()
+            if not stat:
+                return False
+            if stat != self.disk_stat:
+                # Changed since it was read, follow what's on disk now
+                if self.has_edits() or not self.load() or self.read_only:
+                    return False
+            self.follow_edits = self.has_edits()
+            self.follow_revision = self.editor.revision
+            self.follow_offset = self.disk_stat[1]
+            self.follow_decoder = textio.get_decoder(self.encoding or "utf-8")
+        else:
+            if not self.follow_edited():
+                # The buffer still mirrors the file on disk
+                self.data = self.editor.get_data()
+                self.data_revision = self.editor.revision
+            self.follow_decoder = None
+            self.follow_edits = False
+        self.follow = follow
+        return True
+
+    def follow_edited(self):
+        """Check if the buffer has been edited while following, other than by appending data."""
+        if self.editor.revision != self.follow_revision:
+            self.follow_edits = True
+        return self.follow_edits
+
+    def read_appended(self, max_bytes):
+        """Read at most max_bytes of data appended since the last read.
+
+        Returns the decoded text or False if the file was truncated.
+        """
+        stat = self.stat()
+        if not stat or stat[1] < self.follow_offset:
+            return False
+        if stat[1] == self.follow_offset:
+            return ""
+        try:
+            f = open(self._path(), "rb")
+            f.seek(self.follow_offset)
+            raw = f.read(min(max_bytes, stat[1] - self.follow_offset))
+            f.close()
+        except:
+            self.log(get_error_info())
+            return ""
+        self.follow_offset += len(raw)
+        self.disk_stat = stat
+        return self.follow_decoder.decode(raw)
+
+    def update_follow(self, max_bytes):
+        """Append new data from a followed file. Returns True if the buffer changed."""
+        text = self.read_appended(max_bytes)
+        if text is False:
+            if self.follow_edited():
+                # Reloading would lose the edits
+                self.set_follow(False)
+                return False
+            # Truncated, probably rotated. Start over.
+            if not self.load():
+                return False
+            self.set_follow(True)
+            self.editor.follow_end()
+            return True
+        if not text:
+            return False
+        self.follow_edited()
+        self.editor.append_data(text)
+        self.follow_revision = self.editor.revision
         return True
 
     def reload(self):
-        return self.load()
+        """Reload from disk, keeping cursors, scroll and undo history."""
+        if self.read_only:
+            return self.load()
+        data = self.read()
+        if data is False:
+            return False
+        self.data = data
+        self.editor.update_data(data)
+        self.data_revision = self.editor.revision
+        return True
         
     def is_changed(self):
+        if not self.loaded or self.read_only:
+            return False
+        if self.follow:
+            # Followed files are treated as views of the file on disk, apart from edits
+            return self.follow_edited()
+        return self.has_edits()
+
+    def has_edits(self):
+        """Check if the text differs from what was last read or saved."""
+        if self.editor.revision == self.data_revision:
+            return False # Not edited since loading or saving
         return self.editor.get_data() != self.data
@@ -0,0 +1,199 @@
+#-*- encoding: utf-8
+"""
+Index of the files in a directory tree for opening files by fuzzy matching.
+"""
+
+import os
+import re
+import time
+import heapq
+import fnmatch
+import threading
+
+class FileIndex:
+    """File paths below a directory, built and refreshed in a background thread.
+
+    Each directory is stored with its modification time. Refreshing only
+    stats the directories and lists the ones that changed, since adding,
+    removing or renaming a file changes the mtime of its directory.
+    """
+    def __init__(self, root, ignore=None, max_files=200000):
+        self.root = root
+        self.ignore = ignore or []
+        self.max_files = max_files
+        self.dirs = {}              # Relative dir path -> (mtime, file names, subdir names)
+        self.paths = []             # Relative paths of all files
+        self.lookup = (0, [], [], [], []) # Generation and lowercased paths, names, char masks and lengths
+        self.generation = 0         # Incremented whenever the paths change
+        self.last_refresh = 0
+        self.lock = threading.Lock()
+        self.thread = None
+        self.cache = (None, None, None) # Generation, query and candidates of the last match
+
+    def ignored(self, name):
+        return any(fnmatch.fnmatch(name, pattern) for pattern in self.ignore)
+
+    def scan(self, rel):
+        """List a directory. Returns (mtime, file names, subdir names) or None."""
+        path = os.path.join(self.root, rel)
+        files = []
+        subdirs = []
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            for entry in os.scandir(path):
+                if self.ignored(entry.name):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+                    elif entry.is_file():
+                        files.append(entry.name)
+                except OSError:
+                    pass
+        except OSError:
+            return None
+        files.sort()
+        subdirs.sort()
+        return (mtime, files, subdirs)
+
+    def add_tree(self, rel, dirs, count):
+        """Scan rel and all directories below it into dirs. Returns the new file count."""
+        pending = [rel]
+        while pending and count < self.max_files:
+            rel = pending.pop()
+            entry = self.scan(rel)
+            if entry == None:
+                continue
+            dirs[rel] = entry
+            count += len(entry[1])
+            pending.extend(reversed([os.path.join(rel, name) for name in entry[2]]))
+        return count
+
+    def remove_tree(self, rel, dirs):
+        """Remove rel and the directories below it from dirs."""
+        entry = dirs.pop(rel, None)
+        if entry:
+            for name in entry[2]:
+                self.remove_tree(os.path.join(rel, name), dirs)
+
+    def update(self):
+        """Bring the index up to date. Returns True if anything changed."""
+        dirs = dict(self.dirs)
+        changed = False
+        if not dirs:
+            self.add_tree("", dirs, 0)
+            changed = True
+        else:
+            count = len(self.paths)
+            for rel, entry in list(self.dirs.items()):
+                if not rel in dirs:
+                    continue # Removed along with its parent
+                try:
+                    mtime = os.stat(os.path.join(self.root, rel)).st_mtime_ns
+                except OSError:
+                    self.remove_tree(rel, dirs)
+                    changed = True
+                    continue
+                if mtime == entry[0]:
+                    continue
+                new = self.scan(rel)
+                if new == None:
+                    self.remove_tree(rel, dirs)
+                    changed = True
+                    continue
+                dirs[rel] = new
+                changed = True
+                for name in set(entry[2]) - set(new[2]):
+                    self.remove_tree(os.path.join(rel, name), dirs)
+                for name in set(new[2]) - set(entry[2]):
+                    count = self.add_tree(os.path.join(rel, name), dirs, count)
+        if changed:
+            paths = []
+            for rel in sorted(dirs):
+                paths.extend([os.path.join(rel, name) for name in dirs[rel][1]])
+            lower = [path.lower() for path in paths]
+            names = [path[path.rfind(os.sep)+1:] for path in lower]
+            masks = [char_mask(path) for path in lower]
+            lengths = [len(path) for path in paths]
+            with self.lock:
+                self.dirs = dirs
+                self.paths = paths
+                self.generation += 1
+                self.lookup = (self.generation, lower, names, masks, lengths)
+        self.last_refresh = time.time()
+        return changed
+
+    def refresh(self, interval=0):
+        """Update the index in a background thread unless it was updated within interval seconds."""
+        if self.thread and self.thread.is_alive():
+            return False
+        if time.time() - self.last_refresh < interval:
+            return False
+        self.thread = threading.Thread(target=self.update)
+        self.thread.daemon = True
+        self.thread.start()
+        return True
+
+    def is_ready(self):
+        """Check if the index has been built."""
+        return self.generation > 0
+
+    def candidates(self, query, lookup):
+        """Return the indices of paths containing the characters of query in order."""
+        generation, lower, masks = lookup[0], lookup[1], lookup[3]
+        last_generation, last_query, last = self.cache
+        if last_generation == generation and last_query and query.startswith(last_query):
+            found = last # Typing narrows down the previous results
+        else:
+            found = range(len(lower))
+        # Cheap check for the characters first, then their order
+        wanted = char_mask(query)
+        found = [i for i in found if masks[i] & wanted == wanted]
+        if len(query) > 1:
+            search = fuzzy_pattern(query).search
+            found = [i for i in found if search(lower[i])]
+        self.cache = (generation, query, found)
+        return found
+
+    def match(self, query, limit=20):
+        """Return the best matching paths for query, best first.
+
+        File names beginning with the query come first, then names that
+        contain it, paths that contain it, names that fuzzy match and the
+        rest. Shorter paths are preferred within each group.
+        """
+        with self.lock:
+            paths, lookup = self.paths, self.lookup
+        query = query.strip().lower()
+        if not query:
+            return paths[:limit]
+        generation, lower, names, masks, lengths = lookup
+        found = self.candidates(query, lookup)
+        in_name = fuzzy_pattern(query).search
+        groups = [
+            lambda i: names[i].startswith(query),
+            lambda i: query in names[i],
+            lambda i: query in lower[i],
+            lambda i: in_name(names[i]),
+            lambda i: True,
+        ]
+        best = []
+        seen = set()
+        for belongs in groups:
+            group = [i for i in found if not i in seen and belongs(i)]
+            best.extend(heapq.nsmallest(limit-len(best), group, key=lengths.__getitem__))
+            if len(best) >= limit:
+                break
+            seen.update(group)
+        return [paths[i] for i in best]
+
+def char_mask(text):
+    """Return a bit mask of the characters in text."""
+    mask = 0
+    for c in set(text):
+        mask |= 1 << (ord(c) & 63)
+    return mask
+
+def fuzzy_pattern(query):
+    """Return a regex that matches text containing the characters of query in order."""
+    return re.compile(".*?".join(re.escape(c) for c in query))
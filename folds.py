@@ -0,0 +1,342 @@
+#-*- encoding: utf-8
+"""
+Index of indentation blocks and the folds that hide them.
+"""
+
+from rowindex import CountTree
+
+def indent_level(text, tab_width):
+    """Return the indentation width of a line, or None if it's blank."""
+    stripped = text.lstrip(" \t")
+    if not stripped:
+        return None
+    return len(text[:len(text)-len(stripped)].expandtabs(tab_width))
+
+class FoldList:
+    """Folds that don't overlap, each with the folds nested in it.
+
+    Each fold is stored as the number of lines between it and the fold
+    before it and the number of lines it spans, in a CountTree. Finding
+    the fold at a line is a search of the prefix sums, and moving all
+    folds below an edit only changes the gap before the first of them.
+    The folds nested in a fold are another FoldList with lines counted
+    from its header, so they stay stored while the fold hides them.
+    """
+    def __init__(self, folds=()):
+        self.spans = CountTree()
+        self.inner = []         # FoldList of the folds in each fold, or None
+        self.splice(0, 0, folds)
+
+    def __len__(self):
+        return len(self.inner)
+
+    def header(self, i):
+        return self.spans.prefix(2*i+1)
+
+    def end(self, i):
+        return self.spans.prefix(2*i+2)
+
+    def fold(self, i):
+        """Return the header, end and inner folds of fold i."""
+        header = self.header(i)
+        return header, header + self.spans[2*i+1], self.inner[i]
+
+    def folds(self, offset=0):
+        """Return all folds as (header, end, inner) with offset added to the lines."""
+        folds = []
+        last = offset
+        values = iter(self.spans)
+        for inner in self.inner:
+            header = last + next(values)
+            last = header + next(values)
+            folds.append((header, last, inner))
+        return folds
+
+    def find(self, y):
+        """Return the index of the first fold ending after line y, and the header of the fold containing y or None."""
+        i = self.spans.find(y)
+        if i % 2:
+            return i // 2, self.spans.prefix(i)
+        return i // 2, None
+
+    def after(self, y):
+        """Return the index of the first fold starting at or after line y."""
+        if y <= 0:
+            return 0
+        return (self.spans.find(y-1) + 1) // 2
+
+    def splice(self, start, stop, folds, delta=0):
+        """Replace folds start...stop with folds, a list of (header, end, inner), and move the folds after them by delta lines."""
+        last = self.end(start-1) if start > 0 else 0
+        values = []
+        for header, end, inner in folds:
+            values += [header - last, end - header]
+            last = end
+        count = 2 * (stop-start)
+        if stop < len(self):
+            values.append(self.header(stop) + delta - last)
+            count += 1
+        self.spans.replace(2*start, count, values)
+        self.inner[start:stop] = [inner for header, end, inner in folds]
+
+    def shift(self, y, removed, added):
+        """Lines y...y+removed were replaced with added new lines, move the folds after them.
+
+        Folds the edit cut through are dropped. Returns the ranges of
+        lines they hid, as (start, end).
+        """
+        if not self.inner:
+            return []
+        delta = added - removed
+        start = self.find(y)[0]
+        stop = self.after(y+removed)
+        folds = []
+        dropped = []
+        for i in range(start, stop):
+            header, end, inner = self.fold(i)
+            if header < y and y+removed <= end and end+delta > header+1:
+                if inner:
+                    inner.shift(y-header, removed, added)
+                folds.append((header, end+delta, inner))
+            else:
+                dropped.append((header+1, max(end+delta, y+added)))
+        self.splice(start, stop, folds, delta)
+        return dropped
+
+class FoldIndex:
+    """Folded indentation blocks, kept up to date as lines change.
+
+    A block is a line followed by the lines indented more than it. The
+    indentation of each line is stored so edits only measure the changed
+    lines. The outermost folds are in a FoldList, where checking if a line
+    is hidden and moving folds after an edit are searches and updates of
+    a Fenwick tree. Folds inside them are kept nested and come back when
+    the outer fold is unfolded. Hidden lines take no rows in the viewer's
+    RowIndex, which maps between lines and screen rows.
+    """
+    def __init__(self, viewer):
+        self.viewer = viewer
+        self.levels = None      # Indentation of each line, None until first used
+        self.folds = FoldList()
+
+    def level(self, y):
+        return indent_level(self.viewer.lines[y].data, self.viewer.config["tab_width"])
+
+    def validate(self):
+        if self.levels == None or len(self.levels) != len(self.viewer.lines):
+            self.levels = [self.level(y) for y in range(len(self.viewer.lines))]
+
+    def lines_reset(self):
+        """Measure everything again and drop folds that aren't blocks anymore."""
+        self.levels = None
+        if not self.folds:
+            return
+        headers = self.headers()
+        folds = []
+        stack = []      # The folds containing the current one
+        for header in headers:
+            if header >= len(self.viewer.lines):
+                break
+            end = self.block_end(header)
+            if end == None:
+                continue
+            while stack and stack[-1][1] <= header:
+                stack.pop()
+            if stack and stack[-1][1] < end:
+                continue # Overlaps the fold it was in
+            fold = (header, end, [])
+            if stack:
+                stack[-1][2].append(fold)
+            else:
+                folds.append(fold)
+            stack.append(fold)
+        self.folds = FoldList(self.nest(folds, 0))
+
+    def nest(self, folds, offset):
+        """Return (header, end, children) folds as FoldList entries with offset taken from the lines."""
+        return [(header-offset, end-offset, FoldList(self.nest(inner, header)) if inner else None)
+                for header, end, inner in folds]
+
+    def headers(self):
+        """Return the sorted header lines of all folds, nested ones too."""
+        headers = []
+        stack = list(reversed(self.folds.folds()))
+        while stack:
+            header, end, inner = stack.pop()
+            headers.append(header)
+            if inner:
+                stack.extend(reversed(inner.folds(header)))
+        return headers
+
+    def lines_changed(self, y, removed, added):
+        """Lines y...y+removed were replaced with added new lines."""
+        if self.levels != None:
+            self.levels[y:y+removed] = [self.level(i) for i in range(y, y+added)]
+        if not self.folds:
+            return
+        if removed != added:
+            for start, end in self.folds.shift(y, removed, added):
+                self.remeasure(start, end)
+        # The row index measured the new lines before the folds were updated
+        self.remeasure(y, y+added)
+
+    def remeasure(self, start, end):
+        self.viewer.row_index.remeasure(start, min(end, len(self.viewer.lines)))
+
+    def block_end(self, y):
+        """Return the line after the block starting at line y, or None if nothing is indented under it."""
+        self.validate()
+        levels = self.levels
+        level = levels[y]
+        if level == None:
+            return None
+        last = y
+        i = y+1
+        while i < len(levels):
+            if levels[i] != None:
+                if levels[i] <= level:
+                    break
+                last = i
+            i += 1
+        if last == y:
+            return None
+        return last+1
+
+    def block_start(self, y):
+        """Return the header of the innermost block containing line y, or None."""
+        self.validate()
+        levels = self.levels
+        level = levels[y]
+        while level == None and y > 0:
+            y -= 1
+            level = levels[y]
+        if level == None:
+            return None
+        while y > 0:
+            y -= 1
+            if levels[y] != None and levels[y] < level:
+                return y
+        return None
+
+    def any(self):
+        """Check if anything is folded."""
+        return len(self.folds) > 0
+
+    def count(self):
+        """Return the number of outermost folds."""
+        return len(self.folds)
+
+    def is_folded(self, y):
+        """Check if line y is the header of a visible fold."""
+        return self.folds.find(y)[1] == y
+
+    def fold_start(self, y):
+        """Return the header of the fold hiding line y, or None if it's visible."""
+        header = self.folds.find(y)[1]
+        if header != None and header < y:
+            return header
+        return None
+
+    def hidden(self, y):
+        """Check if line y is hidden in a fold."""
+        return self.fold_start(y) != None
+
+    def next_visible(self, y):
+        """Return the first visible line after line y."""
+        i, header = self.folds.find(y)
+        if header == y:
+            return self.folds.end(i)
+        return y+1
+
+    def prev_visible(self, y):
+        """Return the last visible line before line y."""
+        header = self.fold_start(y-1)
+        if header != None:
+            return header
+        return y-1
+
+    def step(self, y, delta):
+        """Move delta visible lines from line y, stopping at the first and last visible line."""
+        if not self.folds:
+            return y + delta
+        while delta > 0:
+            after = self.next_visible(y)
+            if after >= len(self.viewer.lines):
+                break
+            y = after
+            delta -= 1
+        while delta < 0 and y > 0:
+            y = self.prev_visible(y)
+            delta += 1
+        return y
+
+    def fold(self, y):
+        """Fold the block starting at line y. Returns True if it was folded."""
+        end = self.block_end(y)
+        if end == None or self.hidden(y) or self.is_folded(y):
+            return False
+        # Folds inside the new one are kept nested in it
+        start = self.folds.after(y)
+        stop = self.folds.after(end)
+        inner = []
+        last = end
+        for header, fold_end, folds in [self.folds.fold(i) for i in range(start, stop)]:
+            if fold_end <= end:
+                inner.append((header-y, fold_end-y, folds))
+            else:
+                last = fold_end # Dropped, it reaches past the block
+        self.folds.splice(start, stop, [(y, end, FoldList(inner) if inner else None)])
+        self.remeasure(y+1, last)
+        return True
+
+    def unfold(self, y):
+        """Unfold the fold with its header on line y. Returns True if there was one."""
+        i, header = self.folds.find(y)
+        if header != y:
+            return False
+        header, end, inner = self.folds.fold(i)
+        # The folds nested in it are visible again
+        self.folds.splice(i, i+1, inner.folds(header) if inner else [])
+        self.remeasure(y+1, end)
+        return True
+
+    def toggle(self, y):
+        """Unfold line y or fold the block it starts or is in. Returns the header line or None."""
+        if self.unfold(y):
+            return y
+        if self.block_end(y) == None:
+            y = self.block_start(y)
+            if y == None:
+                return None
+        if self.fold(y):
+            return y
+        return None
+
+    def reveal(self, y):
+        """Unfold the folds hiding line y."""
+        header = self.fold_start(y)
+        while header != None:
+            self.unfold(header)
+            header = self.fold_start(y)
+
+    def fold_all(self):
+        """Fold all outermost blocks. Returns the number of folds."""
+        self.validate()
+        folds = []
+        y = 0
+        while y < len(self.levels):
+            end = self.block_end(y)
+            if end == None:
+                y += 1
+                continue
+            folds.append((y, end, None))
+            y = end
+        self.folds = FoldList(folds)
+        self.viewer.row_index.lines_reset()
+        return len(folds)
+
+    def unfold_all(self):
+        """Remove all folds."""
+        if self.folds:
+            self.folds = FoldList()
+            self.viewer.row_index.lines_reset()
@@ -50,13 +50,27 @@ the complete reference.
  * Ctrl + G
    > Go to line number or file (type the beginning of a filename to switch to it). 
    > You can also use 'filena:42' to go to line 42 in filename.py etc.
+   > On a line of file search results it goes to that match.
 
  * Ctrl + F
    > Search for a string or regular expression (configurable)
 
+ * Ctrl + R
+   > Replace a string or regular expression in the current file
+
+ * Ctrl + T
+   > Search all open files and the files in the current directory. Results are listed in a new file.
+   > The 'replacefiles' command replaces text in them after showing the matches.
+
  * Ctrl + D
    > Search for next occurance or find the word the cursor is on. Adds a new cursor at each new occurance.
 
+ * Ctrl + Space
+   > Complete the word before the cursor with words from open files. Press again for the next completion.
+
+ * Ctrl + B
+   > Jump to the matching bracket or the bracket enclosing the cursor.
+
  * Alt + Arrow Key
    > Add new curor in arrow direction
 
@@ -78,8 +92,14 @@ the complete reference.
  * F2
    > Reload current file
 
+ * F3
+   > Split the view of the file horizontally, then vertically, then back to one view
+
+ * F4
+   > Switch between the split views
+
  * Ctrl + O
-   > Open file
+   > Open file. Files in the current directory are matched as you type, use Up and Down to pick one.
 
  * Ctrl + Page Up
    > Switch to next file
@@ -96,6 +116,9 @@ the complete reference.
  * F6
    > Redo
 
+ * F7
+   > Toggle soft wrapping of long lines
+
  * F8
    > Toggle mouse mode
 
@@ -105,4 +128,7 @@ the complete reference.
  * F11
    > Toggle full screen
 
+ * F12
+   > Fold or unfold the indented block at the cursor. The 'fold' command folds or unfolds everything.
+
 """
\ No newline at end of file
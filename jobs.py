@@ -0,0 +1,278 @@
+#-*- encoding: utf-8
+"""
+Background jobs, like piping text through external commands.
+"""
+
+import os
+import codecs
+import threading
+import subprocess
+import concurrent.futures
+
+import textio
+from helpers import get_error_info
+
+WRITE_SIZE = 64 * 1024      # Characters written to a filter at a time
+READ_SIZE = 64 * 1024       # Bytes read from a filter at a time
+STDERR_KEEP = 4 * 1024      # Bytes of error output kept for the status message
+
+class FilterJob:
+    """Pipe lines through a shell command without blocking the UI.
+
+    A writer thread feeds the lines to the process while a reader thread
+    decodes its output into lines as it arrives. The app polls done() and
+    calls finish() to get the result once the process has exited.
+    """
+    def __init__(self, command, lines, encoding="utf-8"):
+        self.command = command
+        self.lines = lines          # Input lines (strings)
+        self.encoding = encoding
+        self.output = []            # Output lines
+        self.errors = b""           # Tail of the error output
+        self.failure = None         # Exception from a worker thread
+        self.cancelled = False
+        self.process = None
+        self.threads = []
+
+    def start(self):
+        """Start the process and the threads feeding and reading it."""
+        self.process = subprocess.Popen(self.command, shell=True,
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE)
+        for target in [self.write_input, self.read_output, self.read_errors]:
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def write_input(self):
+        """Write the lines to the process in batches."""
+        encoder = codecs.getincrementalencoder(self.encoding)(textio.ERRORS)
+        stdin = self.process.stdin
+        try:
+            batch = []
+            size = 0
+            for line in self.lines:
+                batch.append(line)
+                size += len(line) + 1
+                if size >= WRITE_SIZE:
+                    batch.append("")
+                    stdin.write(encoder.encode("\n".join(batch)))
+                    batch = []
+                    size = 0
+            if batch:
+                batch.append("")
+                stdin.write(encoder.encode("\n".join(batch)))
+            stdin.write(encoder.encode("", True))
+        except BrokenPipeError:
+            pass # The command doesn't need all of its input
+        except Exception as e:
+            self.failure = e
+        finally:
+            try:
+                stdin.close()
+            except BrokenPipeError:
+                pass
+
+    def read_output(self):
+        """Decode the output into lines as it arrives."""
+        decoder = textio.get_decoder(self.encoding)
+        fd = self.process.stdout.fileno()
+        partial = ""
+        try:
+            while True:
+                chunk = os.read(fd, READ_SIZE)
+                text = partial + decoder.decode(chunk, not chunk)
+                lines = text.split("\n")
+                partial = lines.pop()
+                self.output.extend(lines)
+                if not chunk:
+                    break
+            if partial:
+                self.output.append(partial) # No newline at the end
+        except Exception as e:
+            self.failure = e
+        finally:
+            self.process.stdout.close()
+
+    def read_errors(self):
+        """Keep the end of the error output."""
+        stderr = self.process.stderr
+        while True:
+            chunk = stderr.read1(READ_SIZE)
+            if not chunk:
+                break
+            self.errors = (self.errors + chunk)[-STDERR_KEEP:]
+        stderr.close()
+
+    def done(self):
+        """Check if the process has exited and all output has been read."""
+        if self.process.poll() == None:
+            return False
+        return not any(thread.is_alive() for thread in self.threads)
+
+    def cancel(self):
+        """Kill the process."""
+        self.cancelled = True
+        if self.process.poll() == None:
+            self.process.kill()
+
+    def finish(self):
+        """Return the output lines or None if the command failed."""
+        for thread in self.threads:
+            thread.join()
+        if self.cancelled or self.failure or self.process.returncode != 0:
+            return None
+        return self.output
+
+    def error_message(self):
+        """Return a short description of why the job failed."""
+        if self.cancelled:
+            return "cancelled"
+        if self.failure:
+            return str(self.failure)
+        errors = self.errors.decode(self.encoding, "replace").strip().split("\n")[-1]
+        return "exit status " + str(self.process.returncode) + (": " + errors if errors else "")
+
+class EditorFilter:
+    """Replace the contents of an editor with the output of a FilterJob."""
+    def __init__(self, app, editor, command):
+        self.app = app
+        self.editor = editor
+        self.line_nums = None       # Lines to replace, None for all of them
+        self.final_newline = False  # Whether the text ends with a newline
+        self.revision = editor.revision
+        if len(editor.cursors) > 1:
+            self.line_nums = editor.get_lines_with_cursors()
+            lines = [editor.lines[y].data for y in self.line_nums]
+        else:
+            lines = [line.data for line in editor.lines]
+            if len(lines) > 1 and lines[-1] == "":
+                # Each line is sent with a newline, don't add an extra empty line
+                lines.pop()
+                self.final_newline = True
+        encoding = app.config["editor"]["default_encoding"]
+        self.job = FilterJob(command, lines, textio.normalize_encoding(encoding) or "utf-8")
+
+    def start(self):
+        self.job.start()
+
+    def update(self):
+        return False
+
+    def done(self):
+        return self.job.done()
+
+    def cancel(self):
+        self.job.cancel()
+
+    def finish(self):
+        """Apply the output to the editor. Returns True if it was changed."""
+        command = self.job.command
+        output = self.job.finish()
+        if output == None:
+            self.app.set_status("Filter '" + command + "' failed: " + self.job.error_message())
+            return False
+        if self.editor.document.read_only:
+            self.app.set_status("The file is read only, output of '" + command + "' discarded.")
+            return False
+        if self.editor.revision != self.revision:
+            self.app.set_status("Buffer was edited while '" + command + "' ran, output discarded.")
+            return False
+        if self.line_nums != None and len(output) != len(self.line_nums):
+            self.app.set_status("Filter '" + command + "' returned " + str(len(output)) + \
+                                " lines for " + str(len(self.line_nums)) + ", output discarded.")
+            return False
+        with self.editor.transaction("filter") as transaction:
+            if self.line_nums == None:
+                if self.final_newline or not output:
+                    output.append("")
+                self.editor.update_lines(output)
+            else:
+                for y, text in zip(self.line_nums, output):
+                    transaction.set_line(y, text)
+        self.app.set_status("Filtered through '" + command + "'")
+        return True
+
+class LoadJob:
+    """Load files in parallel, adding each one to the file list when it's ready.
+
+    Loader threads read, decode and split the files into lines while the
+    UI keeps running. Files of at least load_pool_size bytes are read and
+    decoded in worker processes, so one big file doesn't hold up the
+    threads working on the others. update() adds the files in the order
+    they finish.
+    """
+    def __init__(self, app, files):
+        self.app = app
+        self.files = files          # Files with editors, not in the file list yet
+        self.futures = {}           # File -> Future of its read_contents()
+        self.threads = None
+        self.pool = None            # Process pool for big files, if there are any
+
+    def start(self):
+        """Start reading all files."""
+        config = self.app.config["app"]
+        self.threads = concurrent.futures.ThreadPoolExecutor(config["load_threads"])
+        if any(self.size(f) >= config["load_pool_size"] for f in self.files):
+            try:
+                self.pool = concurrent.futures.ProcessPoolExecutor()
+            except Exception:
+                self.pool = None
+        for f in self.files:
+            self.futures[f] = self.threads.submit(f.read_contents, self.pool)
+
+    def size(self, f):
+        try:
+            return os.path.getsize(f.path())
+        except OSError:
+            return 0
+
+    def wait(self, f):
+        """Wait until f has been read and add it, so it can be shown right away."""
+        if f in self.futures:
+            self.add(f, self.futures.pop(f))
+
+    def add(self, f, future):
+        """Show the contents of a file and add it to the file list."""
+        try:
+            contents = future.result()
+        except:
+            self.app.log("Failed to load '" + f.path() + "'!")
+            self.app.log(get_error_info())
+            contents = False
+        if self.app.file_is_open(f.path()):
+            return False # Opened meanwhile, by recovering a journal for example
+        if not f.show_contents(contents):
+            # Start a new file at the path instead, like when it doesn't exist
+            path = f.path()
+            f = self.app.default_file()
+            f.set_path(path)
+        self.app.files.append(f)
+        return True
+
+    def update(self):
+        """Add the files that have been read. Returns True if any were added."""
+        added = False
+        for f, future in list(self.futures.items()):
+            if future.done():
+                del self.futures[f]
+                self.add(f, future)
+                added = True
+        return added
+
+    def done(self):
+        return not self.futures
+
+    def cancel(self):
+        """Stop loading the files that haven't been read yet."""
+        for future in self.futures.values():
+            future.cancel()
+        self.futures = {}
+        self.finish()
+
+    def finish(self):
+        self.threads.shutdown(wait=False)
+        if self.pool:
+            self.pool.shutdown(wait=False)
@@ -0,0 +1,302 @@
+#-*- encoding: utf-8
+"""
+Journals of unsaved edits for recovering them after a crash.
+"""
+
+import os
+import json
+import time
+
+from helpers import *
+from line import *
+from file import *
+
+class Journal:
+    """Append-only record of the edits made to a file since it was loaded or saved.
+
+    It listens to the lines of the document and keeps the replaced line
+    ranges in memory until flush() writes them to the journal file and
+    fsyncs it. The first line of the file identifies the file on disk
+    the edits apply to. When the contents are reset as a whole (by a big
+    transform for example) the journal is rewritten with a copy of all
+    lines instead.
+    """
+    def __init__(self, recovery, f):
+        self.recovery = recovery
+        self.file = f
+        self.document = f.editor.document
+        self.path = None            # Journal file, created when there is something to write
+        self.base = None            # data_revision of the file the journal file applies to
+        self.records = []           # (revision, y, removed, lines) not written yet
+        self.snapshot = None        # Revision of a reset that requires rewriting everything
+        if f.editor.revision != f.data_revision:
+            # Edited before the journal was attached
+            self.snapshot = f.editor.revision
+        self.document.listeners.append(self)
+
+    def lines_changed(self, y, removed, added):
+        """Lines y...y+removed were replaced with added new lines."""
+        if self.snapshot != None:
+            return # Included in the snapshot
+        lines = [line.data for line in self.document.lines[y:y+added]]
+        self.records.append((self.document.revision, y, removed, lines))
+
+    def lines_reset(self):
+        """Any or all lines may have changed, write them all next time."""
+        self.records = []
+        self.snapshot = self.document.revision
+
+    def header(self):
+        f = self.file
+        stat = f.disk_stat
+        if f.data_revision == None:
+            stat = None # Nothing was read from disk, the edits apply to an empty file
+        return {"path": f.path() if f.name else "", "stat": stat, "pid": os.getpid(), "time": time.time()}
+
+    def flush(self):
+        """Write the edits made since the last flush to disk."""
+        f = self.file
+        base = f.data_revision
+        lines = self.document.lines
+        empty = base == None and len(lines) == 1 and not lines[0].data
+        if f.follow or f.read_only or self.document.revision == base or empty:
+            # Nothing unsaved to recover
+            self.discard()
+            return True
+        if base != self.base:
+            # Loaded or saved since the journal file was started
+            if base != None and self.snapshot != None and self.snapshot <= base:
+                self.snapshot = None
+            self.records = [record for record in self.records if base == None or record[0] > base]
+            self.remove_file()
+            self.base = base
+        if self.path == None or self.snapshot != None:
+            return self.rewrite()
+        if not self.records:
+            return True
+        return self.write(self.path, "a", self.records)
+
+    def rewrite(self):
+        """Start the journal file over with a header and all edits or lines."""
+        if self.path == None:
+            self.path = self.recovery.new_path()
+        records = []
+        if self.snapshot != None:
+            records.append((self.snapshot, "reset", [line.data for line in self.document.lines]))
+        else:
+            records = self.records
+        temp = self.path + ".tmp"
+        if not self.write(temp, "w", records, self.header()):
+            return False
+        os.replace(temp, self.path)
+        self.snapshot = None
+        return True
+
+    def write(self, path, mode, records, header=None):
+        """Write records to a journal file and fsync it."""
+        try:
+            f = open(path, mode, encoding="utf-8")
+            if header != None:
+                f.write(json.dumps(header) + "\n")
+            for record in records:
+                f.write(json.dumps(record[1:], separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+        except:
+            self.recovery.log("Failed to write journal!")
+            self.recovery.log(get_error_info())
+            return False
+        self.records = []
+        return True
+
+    def remove_file(self):
+        if self.path == None:
+            return
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+        self.path = None
+
+    def discard(self):
+        """Forget the edits and remove the journal file."""
+        self.records = []
+        self.snapshot = None
+        self.base = self.file.data_revision
+        self.remove_file()
+
+    def close(self):
+        """Stop listening to the file and remove the journal file."""
+        self.discard()
+        if self in self.document.listeners:
+            self.document.listeners.remove(self)
+
+class Recovery:
+    """Keeps a journal for each open file and recovers journals left by crashed runs.
+
+    Journals are named after the process that wrote them, so journals of
+    other running instances are left alone.
+    """
+    def __init__(self, app):
+        self.app = app
+        self.dirname = ".suplemon-recovery"
+        self.fpath = os.path.expanduser("~")
+        self.journals = []
+        self.count = 0
+        self.last_flush = 0
+
+    def log(self, s, log_type=LOG_ERROR):
+        self.app.log(s, log_type)
+
+    def enabled(self):
+        return self.app.config["app"]["journal_edits"]
+
+    def path(self):
+        return os.path.join(self.fpath, self.dirname)
+
+    def new_path(self):
+        """Return the path of a new journal file for this process."""
+        path = self.path()
+        if not os.path.isdir(path):
+            os.makedirs(path, mode=0o700)
+        self.count += 1
+        return os.path.join(path, str(os.getpid()) + "-" + str(self.count) + ".journal")
+
+    def update(self):
+        """Start journals for new files and write them on the configured interval."""
+        if not self.enabled():
+            return False
+        files = self.app.get_files()
+        for journal in self.journals[:]:
+            if not journal.file in files:
+                self.journals.remove(journal)
+                journal.close()
+        for f in files:
+            # Read only files can't have unsaved edits
+            if f.loaded and f.journal == None and not f.read_only:
+                f.journal = Journal(self, f)
+                self.journals.append(f.journal)
+        if time.time() - self.last_flush < self.app.config["app"]["journal_interval"]:
+            return False
+        self.last_flush = time.time()
+        for journal in self.journals:
+            journal.flush()
+        return False
+
+    def close(self):
+        """Remove the journals of this process when exiting normally."""
+        for journal in self.journals:
+            journal.close()
+        self.journals = []
+
+    def stale(self):
+        """Return the journal files left by processes that aren't running."""
+        path = self.path()
+        if not os.path.isdir(path):
+            return []
+        stale = []
+        for name in sorted(os.listdir(path)):
+            if not name.endswith(".journal"):
+                continue
+            try:
+                pid = int(name.split("-")[0])
+            except ValueError:
+                continue
+            if pid != os.getpid() and process_exists(pid):
+                continue
+            stale.append(os.path.join(path, name))
+        return stale
+
+    def read(self, path):
+        """Read a journal file. Returns the header and records or None."""
+        try:
+            f = open(path, encoding="utf-8")
+            header = json.loads(f.readline())
+            records = []
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break # Cut short by the crash
+            f.close()
+        except:
+            self.log("Failed to read journal '" + path + "'!")
+            self.log(get_error_info())
+            return None
+        return header, records
+
+    def recover(self):
+        """Offer to recover the journals left by crashed runs."""
+        if not self.enabled():
+            return False
+        recovered = False
+        for path in self.stale():
+            data = self.read(path)
+            if data and data[1] and self.recover_journal(*data):
+                recovered = True
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return recovered
+
+    def recover_journal(self, header, records):
+        """Ask whether to replay a journal and do it."""
+        app = self.app
+        name = header.get("path") or "untitled"
+        f = None
+        if header.get("path"):
+            f = app.file_is_open(header["path"])
+        if f:
+            f.ensure_loaded()
+            disk_stat = f.stat()
+        else:
+            f = File(app)
+            if header.get("path"):
+                f.set_path(header["path"])
+            disk_stat = f.name and f.stat()
+        stat = header.get("stat")
+        question = "Recover unsaved changes to '" + name + "'?"
+        if (list(disk_stat) if disk_stat else None) != stat:
+            question = "'" + name + "' changed on disk since, recover unsaved changes anyway?"
+        if not app.ui.query_bool(question):
+            return False
+        if not f in app.files:
+            f.set_editor(app.new_editor())
+            if stat != None and not f.load():
+                app.set_status("Failed to load '" + name + "'")
+                return False
+            app.files.append(f)
+        app.switch_to_file(app.files.index(f))
+        try:
+            replay(f.editor, records)
+        except:
+            self.log("Failed to replay journal of '" + name + "'!")
+            self.log(get_error_info())
+            app.set_status("Couldn't recover all changes to '" + name + "'")
+            return False
+        app.set_status("Recovered unsaved changes to '" + name + "'")
+        return True
+
+def replay(editor, records):
+    """Apply journal records to an editor as a single undoable step."""
+    with editor.transaction("recover"):
+        for record in records:
+            if record[0] == "reset":
+                editor.replace_lines(0, len(editor.lines), [Line(line) for line in record[1]])
+                continue
+            y, removed, lines = record
+            if y < 0 or y+removed > len(editor.lines):
+                raise IndexError("Journal edit of lines " + str(y) + "-" + str(y+removed) + " is out of range")
+            editor.replace_lines(y, y+removed, [Line(line) for line in lines])
+
+def process_exists(pid):
+    """Check if a process with the given id is running."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass # Exists but belongs to someone else
+    return True
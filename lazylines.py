@@ -0,0 +1,239 @@
+#-*- encoding: utf-8
+"""
+Read only lines that are decoded on demand from a large file.
+"""
+
+import os
+import re
+import mmap
+import bisect
+import codecs
+
+import textio
+from line import *
+
+BLOCK_SIZE = 64 * 1024      # Bytes of lines decoded at a time
+CACHED_BLOCKS = 16          # Decoded blocks kept in memory
+READ_SIZE = 1024 * 1024     # Bytes of a mapped file indexed at a time
+
+def splits_on_newline(encoding):
+    """Check if lines can be found by looking for newline bytes in an encoding."""
+    name = textio.normalize_encoding(encoding)
+    return name != None and not name.startswith("utf-16") and not name.startswith("utf-32") \
+        and codecs.encode("\n", name) == b"\n"
+
+def bytes_pattern(what, encoding):
+    """Compile a pattern finding the encoded text, or return None if it can't be encoded."""
+    try:
+        return re.compile(re.escape(what.encode(encoding)))
+    except UnicodeEncodeError:
+        return None
+
+class MappedFile:
+    """A byte source for IndexedLines that reads a file through a read only memory map."""
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        try:
+            self.size = os.fstat(self.file.fileno()).st_size
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except:
+            self.file.close()
+            raise
+
+    def build(self, on_data):
+        """Pass all data to on_data in parts."""
+        for offset in range(0, self.size, READ_SIZE):
+            on_data(self.map[offset:offset+READ_SIZE])
+
+    def read(self, offset, size):
+        """Return size bytes starting at offset."""
+        # Touching the map past the end of a truncated file would crash
+        end = min(offset+size, os.fstat(self.file.fileno()).st_size, self.size)
+        return self.map[offset:max(offset, end)]
+
+class ReadOnlyLine(Line):
+    """A line of IndexedLines. Changing it raises a TypeError."""
+    def __init__(self, data=""):
+        self.frozen = False
+        Line.__init__(self, data)
+        self.frozen = True
+
+    def set_data(self, data):
+        if self.frozen:
+            raise TypeError("The line is read only")
+        Line.data.fset(self, data)
+
+    data = property(Line.data.fget, set_data)
+
+    def insert(self, i, text):
+        raise TypeError("The line is read only")
+
+    def delete(self, i, n=1):
+        raise TypeError("The line is read only")
+
+class IndexedLines:
+    """A list-like sequence of Line objects read from a byte source on demand.
+
+    The source is anything with read(offset, size) and size. While the
+    data is streamed through add() once, it's divided into blocks of
+    about BLOCK_SIZE bytes that end at a newline, and the byte offset and
+    first line number of each block are stored. Getting a line finds its
+    block with a binary search and decodes the whole block, which is
+    cached. Only the blocks being looked at are kept as Line objects.
+    Neither the sequence nor the lines in it can be changed.
+    """
+    def __init__(self, source, encoding=None, default="utf-8"):
+        self.source = source
+        self.encoding = encoding
+        self.default = default
+        self.starts = [0]       # Byte offset of each block
+        self.first_lines = [0]  # Number of the first line of each block
+        self.pos = 0            # Bytes added so far
+        self.count = 0          # Newlines added so far
+        self.cache = {}         # Block index -> list of Line objects
+        self.bom = False        # Skip a UTF-8 byte order mark at the start
+
+    def add(self, data):
+        """Index the next part of the data."""
+        if not self.pos:
+            if not self.encoding:
+                self.encoding = textio.detect_encoding(data[:textio.SAMPLE_SIZE], self.default)
+            if textio.normalize_encoding(self.encoding) == "utf-8-sig":
+                self.encoding = "utf-8"
+                self.bom = True
+            if not splits_on_newline(self.encoding):
+                raise ValueError("Can't index lines of a file encoded in " + self.encoding)
+        offset = 0
+        while True:
+            # Cut the block at the first newline after BLOCK_SIZE bytes
+            cut = self.starts[-1] + BLOCK_SIZE - self.pos
+            if cut >= len(data):
+                break
+            cut = data.find(b"\n", max(cut, offset))
+            if cut < 0:
+                break
+            self.count += data.count(b"\n", offset, cut+1)
+            offset = cut+1
+            self.starts.append(self.pos + offset)
+            self.first_lines.append(self.count)
+        self.count += data.count(b"\n", offset)
+        self.pos += len(data)
+
+    def finish(self):
+        """Stop adding data."""
+        if not self.encoding:
+            self.encoding = textio.normalize_encoding(self.default) or "utf-8"
+        self.starts.append(self.pos)
+        self.first_lines.append(self.count+1)
+
+    def build(self):
+        """Index a source that has a build() method streaming its data."""
+        self.source.build(self.add)
+        self.finish()
+        return self
+
+    def block_bytes(self, i):
+        """Return the bytes of block i."""
+        data = self.source.read(self.starts[i], self.starts[i+1] - self.starts[i])
+        if i == 0 and self.bom and data.startswith(codecs.BOM_UTF8):
+            data = data[len(codecs.BOM_UTF8):]
+        return data
+
+    def block_texts(self, i):
+        """Return the decoded lines of block i as strings."""
+        if i in self.cache:
+            return [line.data for line in self.cache[i]]
+        text = self.block_bytes(i).decode(self.encoding, textio.ERRORS).replace("\r\n", "\n")
+        if i < len(self.starts)-2:
+            text = text[:-1] # The newline ending the block
+        return text.split("\n")
+
+    def block(self, i):
+        """Return the decoded lines of block i."""
+        if i in self.cache:
+            return self.cache[i]
+        lines = [ReadOnlyLine(part) for part in self.block_texts(i)]
+        missing = self.first_lines[i+1] - self.first_lines[i] - len(lines)
+        if missing > 0:
+            # The file was truncated after it was indexed
+            lines += [ReadOnlyLine() for n in range(missing)]
+        if len(self.cache) >= CACHED_BLOCKS:
+            del self.cache[next(iter(self.cache))]
+        self.cache[i] = lines
+        return lines
+
+    def block_of(self, y):
+        """Return the index of the block that contains line y."""
+        return bisect.bisect_right(self.first_lines, y) - 1
+
+    def find(self, what, regex=False, x=0, y=0):
+        """Return an iterator of the positions (x, y) of matches of what, starting from position (x, y).
+
+        Plain text is encoded and searched in the bytes of each block, so
+        lines are only decoded where there are matches. Regular expressions
+        are matched on each decoded line, the same way as in other files,
+        since anchors, character classes and line endings work differently
+        on bytes.
+        """
+        if regex:
+            try:
+                return self.find_in_lines(re.compile(what), x, y)
+            except re.error:
+                pass # Search for the text as is, like Editor.find_in_lines
+        return self.find_bytes(what, x, y)
+
+    def find_in_lines(self, pattern, x, y):
+        """Yield the positions of matches of a compiled pattern line by line."""
+        for i in range(self.block_of(y), len(self.starts)-1):
+            line = self.first_lines[i]
+            for text in self.block_texts(i):
+                if line >= y:
+                    offset = x if line == y else 0
+                    for match in pattern.finditer(text[offset:]):
+                        yield (match.start()+offset, line)
+                line += 1
+
+    def find_bytes(self, what, x, y):
+        """Yield the positions of what by searching the encoded text in the bytes of each block."""
+        pattern = bytes_pattern(what, self.encoding)
+        if pattern == None:
+            return
+        i = self.block_of(y)
+        data = self.block_bytes(i)
+        # Byte offset of the start position in the block
+        pos = 0
+        for n in range(y - self.first_lines[i]):
+            pos = data.find(b"\n", pos) + 1
+        pos += len(self[y].data[:x].encode(self.encoding, textio.ERRORS))
+        while True:
+            line = self.first_lines[i]
+            line_start = 0
+            for match in pattern.finditer(data, pos):
+                start = match.start()
+                line += data.count(b"\n", line_start, start)
+                line_start = data.rfind(b"\n", 0, start) + 1
+                x = len(data[line_start:start].decode(self.encoding, textio.ERRORS))
+                yield (x, line)
+            i += 1
+            if i >= len(self.starts)-1:
+                return
+            data = self.block_bytes(i)
+            pos = 0
+
+    def __len__(self):
+        return self.first_lines[-1]
+
+    def __getitem__(self, y):
+        if isinstance(y, slice):
+            return [self[i] for i in range(*y.indices(len(self)))]
+        if y < 0:
+            y += len(self)
+        if y < 0 or y >= len(self):
+            raise IndexError("line index out of range")
+        i = self.block_of(y)
+        return self.block(i)[y - self.first_lines[i]]
+
+    def __iter__(self):
+        for i in range(len(self.starts)-1):
+            for line in self.block(i):
+                yield line
@@ -3,6 +3,13 @@
 Line object to represent a single line in the text editor.
 """
 
+import bisect
+
+import display
+
+LONG_LINE = 32 * 1024   # Lines longer than this are stored in chunks
+CHUNK_SIZE = 4 * 1024   # Target size of the chunks of long lines
+
 class Line:
     def __init__(self, data=""):
         if isinstance(data, Line):
@@ -10,8 +17,208 @@ class Line:
         self.data = data
         self.x_scroll = 0
 
+    @property
+    def data(self):
+        if self._data == None:
+            self._data = "".join(self._chunks)
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._length = len(data)
+        if self._length > LONG_LINE:
+            self._chunks = [data[i:i+CHUNK_SIZE] for i in range(0, self._length, CHUNK_SIZE)]
+            self._offsets = list(range(0, self._length, CHUNK_SIZE))
+            self._data = None
+        else:
+            self._chunks = None
+            self._data = data
+        self._chunk_maps = None     # (has tabs, column map) of each chunk, None for unmapped chunks
+        self._maps_tab_width = None
+        self.changed()
+
+    def changed(self):
+        """Drop the display layout caches, they are computed again when needed."""
+        self._columns = False
+        self._tab_width = None
+        self._row_starts = False
+        self._wrap_width = None
+
+    def is_chunked(self):
+        """Check if the line is stored in chunks."""
+        return self._chunks != None
+
+    def columns(self, tab_width):
+        """Return the display column of each character (None if they equal the indices)."""
+        if self._columns is False or self._tab_width != tab_width:
+            if self._chunks != None:
+                self._columns = self.chunk_columns(tab_width)
+            else:
+                self._columns = display.column_map(self.data, tab_width)
+            self._tab_width = tab_width
+            self._row_starts = False
+        return self._columns
+
+    def chunk_columns(self, tab_width):
+        """Return the columns of a chunked line, mapping only the chunks that changed or moved between tab stops."""
+        if self._chunk_maps == None or self._maps_tab_width != tab_width:
+            self._chunk_maps = [None] * len(self._chunks)
+            self._maps_tab_width = tab_width
+        starts = []
+        maps = []
+        col = 0
+        simple = True
+        for c, chunk in enumerate(self._chunks):
+            entry = self._chunk_maps[c]
+            # Tabs depend on where the chunk begins, other characters don't
+            if entry == None or (entry[0] and entry[1][0] != col % tab_width):
+                tabs = "\t" in chunk
+                entry = (tabs, display.column_map(chunk, tab_width, col % tab_width if tabs else 0))
+                self._chunk_maps[c] = entry
+            cols = entry[1]
+            starts.append(col)
+            maps.append(cols)
+            if cols == None:
+                col += len(chunk)
+            else:
+                col += cols[-1] - cols[0]
+                simple = False
+        if simple:
+            return None
+        starts.append(col)
+        return ChunkColumns(self._length, list(self._offsets), starts, maps)
+
+    def row_starts(self, tab_width, width):
+        """Return the indices where wrapped rows begin (None for simple lines)."""
+        cols = self.columns(tab_width)
+        if self._row_starts is False or self._wrap_width != width:
+            self._row_starts = display.row_starts(self, cols, width)
+            self._wrap_width = width
+        return self._row_starts
+
+    def chunk_at(self, i):
+        """Return the index of the chunk that contains character i."""
+        return max(0, bisect.bisect_right(self._offsets, i) - 1)
+
+    def slice(self, start, stop):
+        """Return the characters start...stop without joining the whole line."""
+        start = max(0, min(start, self._length))
+        stop = max(start, min(stop, self._length))
+        if self._chunks == None:
+            return self._data[start:stop]
+        parts = []
+        c = self.chunk_at(start)
+        while c < len(self._chunks) and self._offsets[c] < stop:
+            offset = self._offsets[c]
+            parts.append(self._chunks[c][max(0, start-offset):stop-offset])
+            c += 1
+        return "".join(parts)
+
+    def insert(self, i, text):
+        """Insert text at index i."""
+        if self._chunks == None:
+            self.data = self._data[:i] + text + self._data[i:]
+            return
+        c = self.chunk_at(min(i, self._length))
+        chunk = self._chunks[c]
+        offset = i - self._offsets[c]
+        chunk = chunk[:offset] + text + chunk[offset:]
+        if len(chunk) > CHUNK_SIZE * 2:
+            parts = [chunk[j:j+CHUNK_SIZE] for j in range(0, len(chunk), CHUNK_SIZE)]
+            self._chunks[c:c+1] = parts
+            self.maps_changed(c, c+1, len(parts))
+        else:
+            self._chunks[c] = chunk
+            self.maps_changed(c, c+1, 1)
+        self._length += len(text)
+        self.chunks_changed(c)
+
+    def delete(self, i, n=1):
+        """Delete n characters starting at index i."""
+        if self._chunks == None:
+            self.data = self._data[:i] + self._data[i+n:]
+            return
+        end = min(i+n, self._length)
+        if end <= i:
+            return
+        first = self.chunk_at(i)
+        last = self.chunk_at(end-1)
+        start_offset = i - self._offsets[first]
+        end_offset = end - self._offsets[last]
+        chunk = self._chunks[first][:start_offset] + self._chunks[last][end_offset:]
+        self._chunks[first:last+1] = [chunk] if chunk else []
+        self.maps_changed(first, last+1, 1 if chunk else 0)
+        self._length -= end - i
+        if self._length <= LONG_LINE // 2:
+            self.data = "".join(self._chunks) # Short enough to store normally again
+            return
+        self.chunks_changed(first)
+
+    def chunks_changed(self, c):
+        """Update chunk offsets after chunk c was modified."""
+        offset = self._offsets[c] if c < len(self._offsets) else self._length
+        for j in range(c, len(self._chunks)):
+            if j < len(self._offsets):
+                self._offsets[j] = offset
+            else:
+                self._offsets.append(offset)
+            offset += len(self._chunks[j])
+        del self._offsets[len(self._chunks):]
+        self._data = None
+        self.changed()
+
+    def maps_changed(self, start, stop, count):
+        """Chunks start...stop were replaced with count chunks that need to be mapped."""
+        if self._chunk_maps != None:
+            self._chunk_maps[start:stop] = [None] * count
+
+    def search(self, regex, start=0):
+        """Return the index of the first single character match of regex at or after start, or -1."""
+        if self._chunks == None:
+            match = regex.search(self._data, start)
+            return match.start() if match else -1
+        while start < self._length:
+            match = regex.search(self.slice(start, start+CHUNK_SIZE))
+            if match:
+                return start + match.start()
+            start += CHUNK_SIZE
+        return -1
+
+    def rsearch(self, regex, end):
+        """Return the index of the last single character match of regex before end, or -1."""
+        end = min(end, self._length)
+        while end > 0:
+            begin = max(0, end-CHUNK_SIZE)
+            match = regex.search(self.slice(begin, end)[::-1])
+            if match:
+                return end - 1 - match.start()
+            end = begin
+        return -1
+
+    def highlight_sample(self):
+        """Return what to pass to line based highlighters.
+
+        Long lines only pass their beginning and end since highlighters
+        look at those anyway.
+        """
+        if self._chunks == None:
+            return self
+        return Line(self._chunks[0] + self._chunks[-1])
+
     def __getitem__(self, i):
-        return self.data[i]
+        if self._chunks == None:
+            return self._data[i]
+        if isinstance(i, slice):
+            if i.step != None:
+                return self.data[i]
+            start, stop, step = i.indices(self._length)
+            return self.slice(start, stop)
+        if i < 0:
+            i += self._length
+        if i < 0 or i >= self._length:
+            raise IndexError("line index out of range")
+        c = self.chunk_at(i)
+        return self._chunks[c][i-self._offsets[c]]
 
     def __setitem__(self, i, v):
         self.data[i] = v
@@ -26,7 +233,7 @@ class Line:
         return Line(other + self.data)
 
     def __len__(self):
-        return len(self.data)
+        return self._length
 
     def find(self, what, start=0):
         return self.data.find(what, start)
@@ -34,3 +241,31 @@ class Line:
     def strip(self, *args):
         return self.data.strip(*args)
 
+class ChunkColumns:
+    """Display columns of a line stored in chunks, see Line.columns().
+
+    Acts like the list display.column_map() returns, but is made of a
+    column map per chunk, so editing a long line only maps the chunk that
+    changed again. Simple chunks have no map.
+    """
+    def __init__(self, length, offsets, starts, maps):
+        self.length = length
+        self.offsets = offsets  # Index of the first character of each chunk
+        self.starts = starts    # Column where each chunk begins, and the end column
+        self.maps = maps        # Column map of each chunk or None
+
+    def __len__(self):
+        return self.length + 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.length + 1
+        if i < 0 or i > self.length:
+            raise IndexError("column index out of range")
+        if i == self.length:
+            return self.starts[-1]
+        c = bisect.bisect_right(self.offsets, i) - 1
+        cols = self.maps[c]
+        if cols == None:
+            return self.starts[c] + i - self.offsets[c]
+        return self.starts[c] + cols[i - self.offsets[c]] - cols[0]
@@ -0,0 +1,98 @@
+#-*- encoding: utf-8
+"""
+Process wide registry of line based highlighters.
+"""
+import os
+import importlib.util
+
+from helpers import *
+
+# Extensions that use the highlighter of another language
+ALIASES = {
+    "pyw": "py",
+    "jsx": "js",
+    "mjs": "js",
+    "cjs": "js",
+    "markdown": "md",
+    "scss": "css",
+    "less": "css",
+}
+
+class LinelightRegistry:
+    def __init__(self):
+        self.curr_path = os.path.dirname(os.path.realpath(__file__))
+        self.linelight_path = os.path.join(self.curr_path, "linelight")
+        self.aliases = dict(ALIASES)
+        self.sources = None  # Language name -> source path, discovered once
+        self.loaded = {}     # Language name -> compiled module (or False on failure)
+
+    def discover(self):
+        """Find the available highlighter sources. Only done once per process."""
+        if self.sources != None:
+            return self.sources
+        self.sources = {}
+        try:
+            dirlist = os.listdir(self.linelight_path)
+        except OSError:
+            return self.sources
+        for item in dirlist:
+            name, ext = os.path.splitext(item)
+            if ext == ".py" and name and name[0] not in "._":
+                self.sources[name] = os.path.join(self.linelight_path, item)
+        return self.sources
+
+    def add_alias(self, ext, lang):
+        """Make files with extension ext use the highlighter for lang."""
+        self.aliases[ext.lower()] = lang
+
+    def language(self, ext):
+        """Resolve a file extension to an available highlighter name."""
+        sources = self.discover()
+        ext = ext.lower()
+        ext = self.aliases.get(ext, ext)
+        if ext in sources:
+            return ext
+        return "generic"
+
+    def load_module(self, lang, logger=None):
+        """Compile and execute a highlighter module. Returns the module or False."""
+        if lang in self.loaded:
+            return self.loaded[lang]
+        mod = False
+        path = self.discover().get(lang)
+        if path:
+            try:
+                spec = importlib.util.spec_from_file_location("linelight_" + lang, path)
+                mod = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(mod)
+            except:
+                mod = False
+                if logger:
+                    logger.log(get_error_info())
+        # Cache failures too, so a broken highlighter isn't retried for every file
+        self.loaded[lang] = mod
+        return mod
+
+    def get_parser(self, ext, logger=None):
+        """Return the parse function for extension ext, or False if there is none."""
+        mod = self.load_module(self.language(ext), logger)
+        if not mod or not "parse" in dir(mod):
+            return False
+        return mod.parse
+
+    def get_symbol_parser(self, ext, logger=None):
+        """Return the symbol function for extension ext, or False if there is none."""
+        mod = self.load_module(self.language(ext), logger)
+        if not mod or not "symbol" in dir(mod):
+            return False
+        return mod.symbol
+
+registry = LinelightRegistry()
+
+def get_parser(ext, logger=None):
+    """Return the highlighter parse function for a file extension."""
+    return registry.get_parser(ext, logger)
+
+def get_symbol_parser(ext, logger=None):
+    """Return the function finding outline symbols for a file extension."""
+    return registry.get_symbol_parser(ext, logger)
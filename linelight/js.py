@@ -1,5 +1,9 @@
+import re
 from helpers import *
 
+SYMBOL = re.compile(r"\s*(?:export\s+)?(?:default\s+)?(?:async\s+)?(?:function\*?|class)\s+([\w$]+)"
+                    r"|\s*(?:export\s+)?(?:const|let|var)\s+([\w$]+)\s*=\s*(?:async\s+)?(?:function|\([^)]*\)\s*=>|[\w$]+\s*=>)")
+
 def parse(raw_line):
     color = 0
     line = raw_line.strip()
@@ -17,4 +21,11 @@ def parse(raw_line):
         color = 14    # Magenta
     elif starts(line, ["if", "else", "for ", "while ", "continue", "break"]):
         color = 17    # Yellow
-    return color
\ No newline at end of file
+    return color
+
+def symbol(raw_line):
+    """Return the name of the class or function defined on a line, or None."""
+    match = SYMBOL.match(raw_line)
+    if match:
+        return match.group(1) or match.group(2)
+    return None
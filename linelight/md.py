@@ -11,4 +11,10 @@ def parse(raw_line):
         color = 17    # Yellow
     elif starts(raw_line, "    "):  # Code
         color = 14    # Magenta
-    return color
\ No newline at end of file
+    return color
+
+def symbol(raw_line):
+    """Return the heading on a line, or None."""
+    if raw_line.startswith("#"):
+        return raw_line.strip()
+    return None
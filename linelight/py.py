@@ -1,5 +1,8 @@
+import re
 from helpers import *
 
+SYMBOL = re.compile(r"\s*(?:async\s+)?(?:class|def)\s+(\w+)")
+
 def parse(raw_line):
     color = 0
     line = raw_line.strip()
@@ -17,4 +20,11 @@ def parse(raw_line):
         color = 14    # Magenta
     elif starts(line, ["if", "elif","else", "finally", "try", "except", "for ", "while ", "continue", "pass", "break"]):
         color = 17    # Yellow
-    return color
\ No newline at end of file
+    return color
+
+def symbol(raw_line):
+    """Return the name of the class or function defined on a line, or None."""
+    match = SYMBOL.match(raw_line)
+    if match:
+        return match.group(1)
+    return None
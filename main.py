@@ -7,10 +7,13 @@ The main class that starts and runs Suplemon.
 __version__ = "0.1.0"
 
 import os
+import re
 import sys
 import time
+import curses
 
 import ui
+import search
 import modules
 
 from helpers import *
@@ -18,6 +21,11 @@ from logger import *
 from config import *
 from editor import *
 from file import *
+from session import *
+from journal import *
+from watcher import *
+from jobs import LoadJob
+from fileindex import *
 
 class App:
     def __init__(self):
@@ -30,11 +38,18 @@ class App:
         self.current_file = 0
         self.status_msg = ""
         self.last_input = None
+        self.last_follow_render = 0
+        self.follow_pending = False
+        self.jobs = []              # Background jobs that are polled in update()
+        self.path_index = None      # Index of the files below the working directory
 
         # Load core components
         self.logger = Logger()
         self.config = Config(self)
         self.config.load()
+        self.session = Session(self)
+        self.recovery = Recovery(self)
+        self.watcher = FileWatcher(self)
         self.ui = ui.UI(self) # Load user interface
 
         # Load extension modules
@@ -52,6 +67,7 @@ class App:
         """Load the app."""
         self.ui.load()
         self.load_files()
+        self.recovery.recover()
         loaded = True
 
     def exit(self):
@@ -64,10 +80,15 @@ class App:
         self.load()
         self.running = 1
         # Initial render
-        self.get_editor().resize()
+        self.refresh_views()
         self.ui.refresh()
         # Start mainloop
         self.main_loop()
+        for job in self.jobs:
+            job.cancel()
+        if self.config["app"]["remember_open_files"]:
+            self.session.store()
+        self.recovery.close()
         # Unload ui
         self.ui.unload()
 
@@ -84,8 +105,76 @@ class App:
                     # Pass the input to the editor component
                     self.get_editor().handle_input(event)
                 #TODO: why do I need resize here? (View won't update after switching files, WTF)
-                self.get_editor().resize()
+                self.refresh_views()
                 self.ui.refresh()
+            elif self.update():
+                self.refresh_views()
+                self.ui.refresh()
+
+    def refresh_views(self):
+        """Redraw the editor and the rows of other views of the file that changed."""
+        self.ui.layout_views()
+        f = self.get_file()
+        for view in f.views:
+            if view != f.editor:
+                view.render_changes()
+        f.editor.resize()
+
+    def update(self):
+        """Run background tasks. Returns True if the screen needs refreshing."""
+        refresh = False
+        for f in self.watcher.check():
+            if self.file_changed_on_disk(f):
+                refresh = True
+        if self.update_followed():
+            refresh = True
+        if self.update_jobs():
+            refresh = True
+        self.recovery.update()
+        return refresh
+
+    def add_job(self, job):
+        """Add a started background job to be polled until it's done."""
+        self.jobs.append(job)
+
+    def update_jobs(self):
+        """Update jobs and finish the ones that are done. Returns True if the screen needs refreshing."""
+        refresh = False
+        for job in self.jobs[:]:
+            if job.update():
+                refresh = True
+            if job.done():
+                self.jobs.remove(job)
+                job.finish()
+                refresh = True
+        return refresh
+
+    def update_followed(self):
+        """Read data appended to followed files. Returns True if it's time to redraw."""
+        config = self.config["app"]
+        for f in self.files:
+            if f.follow and f.update_follow(config["follow_max_read"]):
+                if f == self.get_file():
+                    self.follow_pending = True
+        # Throttle redraws so fast growing files don't saturate the terminal
+        now = time.time()
+        if self.follow_pending and now - self.last_follow_render >= config["follow_redraw_interval"]:
+            self.follow_pending = False
+            self.last_follow_render = now
+            return True
+        return False
+
+    def file_changed_on_disk(self, f):
+        """Reload a file that was changed by another program if it has no unsaved edits."""
+        if f.is_changed():
+            # Don't throw away the users work, just tell them once
+            f.disk_stat = f.stat()
+            self.set_status("'" + f.name + "' changed on disk, reload with F2")
+            return True
+        if f.reload():
+            self.set_status("Reloaded '" + f.name + "' [" + curr_time_sec() + "]")
+            return True
+        return False
 
     def set_status(self, s):
         """Set the status message."""
@@ -132,8 +221,10 @@ class App:
         elif event.key_name == "^S": self.save_file()          # Ctrl + S
         elif event.key_name == "^E": self.run_command()        # Ctrl + E
         elif event.key_name == "^F": self.find()               # Ctrl + F
+        elif event.key_name == "^R": self.replace()            # Ctrl + R
         elif event.key_name == "^G": self.go_to()              # Ctrl + G
         elif event.key_name == "^O": self.open()               # Ctrl + O
+        elif event.key_name == "^T": self.search_files()       # Ctrl + T
         elif event.key_name == "^K": self.close_file()         # Ctrl + K
         elif event.key_name == "^N": self.new_file()           # Ctrl + N
         elif event.key_name == "^X": self.ask_exit()           # Ctrl + X
@@ -142,6 +233,8 @@ class App:
         elif event.key_code == 549: self.next_file()           # Ctrl + Page Down
         elif event.key_code == 265: self.save_file()           # F1
         elif event.key_code == 266: self.reload_file()         # F2
+        elif event.key_code == 267: self.toggle_split()        # F3
+        elif event.key_code == 268: self.next_view()           # F4
         elif event.key_code == 272: self.toggle_mouse()        # F8
         elif event.key_code == 275: self.toggle_fullscreen()   # F12
         else:
@@ -165,6 +258,25 @@ class App:
     # User Interactions
     ###########################################################################
 
+    def toggle_split(self):
+        """Cycle between one view of the file, two views on top of each other and side by side."""
+        f = self.get_file()
+        if len(f.views) == 1:
+            f.add_view(self.ui.editor_win, "horizontal")
+            self.set_status("Split horizontally, switch views with F4")
+        elif f.split == "horizontal":
+            f.split = "vertical"
+            self.set_status("Split vertically")
+        else:
+            f.close_views()
+            self.set_status("Closed split")
+
+    def next_view(self):
+        """Switch to editing the next view of the file."""
+        f = self.get_file()
+        if len(f.views) > 1:
+            f.next_view()
+
     def help(self):
         """Open help file."""
         f = self.default_file()
@@ -194,8 +306,11 @@ class App:
             return True
 
     def switch_to_file(self, index):
-        """Load a default file if no files specified."""
+        """Switch to the file at index, loading it if it was restored lazily."""
         self.current_file = index
+        f = self.files[index]
+        if not f.loaded and not f.ensure_loaded():
+            self.set_status("Failed to load '" + f.name + "'")
 
     def next_file(self):
         """Switch to next file."""
@@ -216,24 +331,23 @@ class App:
         self.switch_to_file(cur)
 
     def go_to(self):
-        """Go to a line or a file (or a line in a specific file with 'name:lineno')."""
-        input_str = self.ui.query("Go to:")
-        lineno = None
-        fname = None
+        """Go to a line or a file (or a position in a specific file with 'name:lineno:col')."""
+        input_str = self.ui.query("Go to:", self.location_at_cursor())
         if input_str == False:
             return False
         if input_str.find(":") != -1:
             parts = input_str.split(":")
-            fname = parts[0]
-            lineno = parts[1]
-            file_index = self.find_file(fname)
-            if file_index != -1:
-                self.switch_to_file(file_index)
-                try:
-                    input_str = int(lineno)
-                    self.get_editor().go_to_pos(input_str)
-                except:
-                    pass
+            if not self.switch_to_name(parts[0]):
+                self.set_status("File '" + parts[0] + "' not found.")
+                return False
+            try:
+                line_no = int(parts[1])
+                col = 0
+                if len(parts) > 2 and parts[2].strip().isdigit():
+                    col = int(parts[2])-1
+                self.get_editor().go_to_pos(line_no, col)
+            except:
+                pass
         else:
             try:
                 line_no = int(input_str)
@@ -243,6 +357,30 @@ class App:
                 if file_index != -1:
                     self.switch_to_file(file_index)
 
+    def location_at_cursor(self):
+        """Return the 'name:lineno:col' location on the cursor line of search results, or ''."""
+        editor = self.get_editor()
+        line = editor.lines[editor.cursor().y]
+        match = search.RESULT_PATTERN.match(line.slice(0, search.MAX_LINE_LENGTH*2))
+        if match:
+            return match.group(1)
+        return ""
+
+    def switch_to_name(self, name):
+        """Switch to a file by path or the beginning of its name, opening it if needed."""
+        f = self.file_is_open(name)
+        if f:
+            self.switch_to_file(self.get_file_index(f))
+            return True
+        file_index = self.find_file(name)
+        if file_index != -1:
+            self.switch_to_file(file_index)
+            return True
+        if os.path.isfile(name) and self.open_file(name):
+            self.switch_to_file(self.last_file_index())
+            return True
+        return False
+
     def find(self):
         """Find in file."""
         editor = self.get_editor()
@@ -250,6 +388,59 @@ class App:
         if what:
             editor.find(what)
 
+    def replace(self):
+        """Replace text in the current file."""
+        editor = self.get_editor()
+        if editor.document.read_only:
+            self.set_status("The file is read only.")
+            return False
+        what = self.ui.query("Replace:", editor.last_find)
+        if not what:
+            return False
+        replacement = self.ui.query("Replace with:")
+        if replacement == False:
+            return False
+        try:
+            count = editor.replace(what, replacement)
+        except re.error as e:
+            self.set_status("Invalid replacement: " + str(e))
+            return False
+        self.set_status("Replaced " + str(count) + " matches.")
+        return True
+
+    def search_files(self):
+        """Search for text in all open files and the files below the working directory."""
+        editor = self.get_editor()
+        what = self.ui.query("Search files:", editor.last_find)
+        if not what:
+            return False
+        f = self.default_file()
+        self.files.append(f)
+        self.switch_to_file(self.last_file_index())
+        job = search.ProjectSearch(self, what, os.getcwd(), f.editor)
+        job.start()
+        self.add_job(job)
+        self.set_status("Searching for '" + what + "'...")
+        return True
+
+    def replace_in_files(self):
+        """Replace text in all open files and the files below the working directory."""
+        editor = self.get_editor()
+        what = self.ui.query("Replace in files:", editor.last_find)
+        if not what:
+            return False
+        replacement = self.ui.query("Replace with:")
+        if replacement == False:
+            return False
+        f = self.default_file()
+        self.files.append(f)
+        self.switch_to_file(self.last_file_index())
+        job = search.ProjectReplace(self, what, replacement, os.getcwd(), f.editor)
+        job.start()
+        self.add_job(job)
+        self.set_status("Searching for '" + what + "'...")
+        return True
+
     def find_file(self, s):
         """Return index of file matching string."""
         i = 0
@@ -269,10 +460,21 @@ class App:
         self.logger.log("Looking for command '" + cmd +"'", LOG_INFO)
         if cmd in self.modules.modules.keys():
             self.logger.log("Trying to run command '" + cmd +"'", LOG_INFO)
-            self.get_editor().store_action_state(cmd)
-            self.modules.modules[cmd].run(self, self.get_editor())
+            editor = self.get_editor()
+            command = self.modules.modules[cmd]
+            if editor.document.read_only and (command.changes_text or command.direct_edits):
+                self.set_status("The file is read only.")
+                return True
+            try:
+                with editor.transaction(cmd):
+                    command.run(self, editor)
+                    if command.direct_edits:
+                        editor.lines_reset()
+            except:
+                self.logger.log(get_error_info(), LOG_ERROR)
+                self.set_status("Command '" + cmd + "' failed.")
         else:
-            self.set_state("Command '" + cmd + "' not found.")
+            self.set_status("Command '" + cmd + "' not found.")
         return True
 
     def toggle_fullscreen(self):
@@ -321,8 +523,25 @@ class App:
     ###########################################################################
 
     def open(self):
-        """Ask for file name and try to open it."""
-        name = self.ui.query("Open file:")
+        """Ask for file name and try to open it.
+
+        Files below the working directory are fuzzy matched while typing.
+        Up and down select a match, enter opens it. A name that exists is
+        opened as is.
+        """
+        if self.path_index == None:
+            config = self.config["app"]
+            self.path_index = FileIndex(os.getcwd(), config["search_ignore"], config["index_max_files"])
+        self.path_index.refresh(self.config["app"]["watch_interval"])
+        self.open_matches = []
+        self.open_selected = 0
+        self.filter_open("", None)
+        name = self.ui.query_filter("Open file:", "", self.filter_open)
+        self.get_editor().render()
+        if name == False:
+            return False
+        if not os.path.exists(name) and self.open_matches:
+            name = os.path.join(self.path_index.root, self.open_matches[self.open_selected])
         if not name:
             return False
         exists = self.file_is_open(name)
@@ -336,6 +555,24 @@ class App:
         self.switch_to_file(self.last_file_index())
         return True
 
+    def filter_open(self, value, key):
+        """Show the files matching what's typed when opening a file."""
+        if key == curses.KEY_UP:
+            self.open_selected = max(0, self.open_selected-1)
+        elif key == curses.KEY_DOWN:
+            self.open_selected = min(len(self.open_matches)-1, self.open_selected+1)
+        elif key != None:
+            return False
+        else:
+            limit = self.ui.editor_win.getmaxyx()[0]
+            self.open_matches = self.path_index.match(value, limit)
+            self.open_selected = 0
+        if self.path_index.is_ready():
+            self.ui.show_list(self.open_matches, self.open_selected)
+        else:
+            self.ui.show_list(["Indexing files..."], -1)
+        return True
+
     def close_file(self):
         """Close current file if user confirms action."""
         if self.ui.query_bool("Close file?"):
@@ -345,6 +582,7 @@ class App:
                 return False
             if self.current_file == len(self.files):
                 self.current_file -= 1
+            self.switch_to_file(self.current_file)
 
     def save_file(self):
         """Save current file."""
@@ -385,10 +623,11 @@ class App:
         """Get index of current file."""
         return self.current_file
 
-    def open_file(self, filename):
-        """Open a file."""
+    def open_file(self, filename, read_only=False):
+        """Open a file, optionally read only."""
         file = File(self)
         file.set_path(filename)
+        file.force_read_only = read_only
         file.set_editor(self.new_editor())
         if not file.load():
             return False
@@ -398,15 +637,26 @@ class App:
     def load_files(self):
         """Try to load all files specified in arguments."""
         #TODO: Maybe use argparse for this
-        if len(sys.argv) > 1:
-            names = sys.argv[1:]
+        names = [arg for arg in sys.argv[1:] if arg != "--read-only"]
+        read_only = "--read-only" in sys.argv[1:]
+        if names:
+            files = []
             for name in names:
-                if self.file_is_open(name): continue
-                if self.open_file(name):
-                    loaded = True
-                else:
-                    self.new_file(name)
-        else:
+                path = os.path.abspath(name)
+                if self.file_is_open(name) or path in [f.path() for f in files]: continue
+                file = File(self)
+                file.set_path(name)
+                file.force_read_only = read_only
+                file.set_editor(self.new_editor())
+                files.append(file)
+            if not files:
+                return
+            # Show the first file as soon as it's read, the others are added when they're ready
+            job = LoadJob(self, files)
+            job.start()
+            job.wait(files[0])
+            self.add_job(job)
+        elif not (self.config["app"]["remember_open_files"] and self.session.restore()):
             self.load_default()
 
     def file_is_open(self, path):
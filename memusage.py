@@ -0,0 +1,190 @@
+#-*- encoding: utf-8
+"""
+Estimate how much memory the open files and the parts of the app keep.
+"""
+
+import gc
+import os
+import sys
+import json
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None     # Not available on Windows
+
+import linelight
+from line import *
+from cursor import *
+from editor import State
+from lazylines import *
+from compressed import *
+from rowindex import CountTree
+from folds import FoldList
+
+# Parts of a file that are measured, in the order they're counted
+CATEGORIES = [
+    ("text", "Text"),
+    ("history", "History"),
+    ("buffer", "Buffer"),
+    ("file_data", "File data"),
+    ("indexes", "Indexes"),
+    ("journal", "Journal"),
+]
+
+# Objects whose attributes are followed when measuring
+FOLLOWED = (Line, Cursor, State, IndexedLines, GzipIndex, CountTree, FoldList)
+
+class Sizer:
+    """Adds up the sizes of objects, counting each object only once.
+
+    Containers are followed into their items and the objects in FOLLOWED
+    into their attributes. Anything else is measured by itself, so that
+    references back to the editor or the app don't pull everything in.
+    An object shared by several parts, like a string that is both in the
+    text and in the undo history, is counted in the part measured first.
+    """
+    def __init__(self):
+        self.seen = set()
+
+    def size(self, *objects):
+        """Return the size in bytes of the objects and what they contain."""
+        total = 0
+        stack = list(objects)
+        while stack:
+            obj = stack.pop()
+            if obj is None or id(obj) in self.seen:
+                continue
+            self.seen.add(id(obj))
+            total += sys.getsizeof(obj)
+            if isinstance(obj, (list, tuple, set, frozenset)):
+                stack.extend(obj)
+            elif isinstance(obj, dict):
+                stack.extend(obj.keys())
+                stack.extend(obj.values())
+            elif isinstance(obj, FOLLOWED):
+                stack.extend(vars(obj).values())
+        return total
+
+def file_usage(sizer, f):
+    """Return the sizes of the parts of a file, see CATEGORIES."""
+    editor = f.editor
+    document = editor.document
+    views = f.views or [editor]
+    usage = {}
+    usage["text"] = sizer.size(document.lines)
+    usage["history"] = sizer.size(document.history)
+    usage["buffer"] = sizer.size(*[view.buffer for view in views])
+    usage["file_data"] = sizer.size(f.data)
+    indexes = [editor.brackets.entries, editor.word_index.line_words, editor.word_index.counts,
+               editor.word_index.words, editor.word_index.recent, editor.outline.ys, editor.outline.entries]
+    for view in views:
+        indexes += [view.row_index.rows, view.folds.folds]
+    usage["indexes"] = sizer.size(*indexes)
+    usage["journal"] = sizer.size(f.journal.records) if f.journal else 0
+    usage["total"] = sum(usage.values())
+    return usage
+
+def highlighter_usage(sizer):
+    """Return the number and size of the highlighters loaded by the process wide registry."""
+    registry = linelight.registry
+    modules = [mod for mod in registry.loaded.values() if mod]
+    # The globals of each module, like its compiled patterns, but not the builtins
+    names = [dict((key, value) for key, value in vars(mod).items() if not key.startswith("__")) for mod in modules]
+    size = sizer.size(registry.sources, registry.aliases, registry.loaded, *names)
+    return {"loaded": len(modules), "size": size}
+
+def allocator_stats():
+    """Return what the interpreter and the OS report about memory."""
+    stats = {
+        "allocated_blocks": sys.getallocatedblocks(),
+        "gc_objects": len(gc.get_objects()),
+        "gc_counts": list(gc.get_count()),
+    }
+    if tracemalloc.is_tracing():
+        stats["traced"], stats["traced_peak"] = tracemalloc.get_traced_memory()
+    try:
+        f = open("/proc/self/statm")
+        stats["rss"] = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        f.close()
+    except (OSError, ValueError):
+        pass
+    if resource:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        stats["peak_rss"] = peak if sys.platform == "darwin" else peak * 1024
+    return stats
+
+def memory_usage(app):
+    """Measure the open files, what they share and the allocator. Returns a dict that can be saved as JSON."""
+    sizer = Sizer()
+    files = []
+    totals = dict((key, 0) for key, label in CATEGORIES)
+    totals["total"] = 0
+    for f in app.get_files():
+        usage = file_usage(sizer, f)
+        for key in totals:
+            totals[key] += usage[key]
+        files.append({
+            "name": f.name or "untitled",
+            "path": f.path() if f.name else "",
+            "lines": len(f.editor.lines),
+            "loaded": f.loaded,
+            "read_only": f.read_only,
+            "usage": usage,
+        })
+    log = {
+        "entries": len(app.logger.entries),
+        "size": sizer.size(app.logger.entries),
+    }
+    return {
+        "files": files,
+        "log": log,
+        "highlighters": highlighter_usage(sizer),
+        "totals": totals,
+        "allocator": allocator_stats(),
+    }
+
+def format_size(size):
+    """Return a size in bytes in a short readable form, like '1.5M'."""
+    for unit in ["B", "K", "M", "G"]:
+        if size < 1024 or unit == "G":
+            break
+        size /= 1024.0
+    if unit == "B":
+        return str(int(size)) + unit
+    return ("%.1f" % size) + unit
+
+def format_report(report):
+    """Return a report from memory_usage() as a text table."""
+    keys = [key for key, label in CATEGORIES] + ["total"]
+    labels = [label for key, label in CATEGORIES] + ["Total"]
+    width = max([len("Total")] + [len(entry["name"]) for entry in report["files"]])
+
+    def row(name, values):
+        return name.ljust(width) + "".join(value.rjust(11) for value in values)
+
+    lines = ["Memory used by open files (estimated)", ""]
+    lines.append(row("File", labels))
+    for entry in report["files"]:
+        lines.append(row(entry["name"], [format_size(entry["usage"][key]) for key in keys]))
+    lines.append(row("Total", [format_size(report["totals"][key]) for key in keys]))
+    lines.append("")
+    log = report["log"]
+    highlighters = report["highlighters"]
+    lines.append("Log: " + str(log["entries"]) + " entries, " + format_size(log["size"]))
+    lines.append("Highlighters: " + str(highlighters["loaded"]) + " loaded, " + format_size(highlighters["size"]))
+    lines.append("Total with shared: " + format_size(report["totals"]["total"] + log["size"] + highlighters["size"]))
+    lines.append("")
+    lines.append("Allocator")
+    for key, value in sorted(report["allocator"].items()):
+        if key in ["rss", "peak_rss", "traced", "traced_peak"]:
+            value = format_size(value)
+        lines.append("  " + key.ljust(18) + str(value))
+    lines.append("")
+    return "\n".join(lines)
+
+def format_json(report):
+    """Return a report from memory_usage() as JSON."""
+    return json.dumps(report, indent=4, sort_keys=True) + "\n"
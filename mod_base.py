@@ -5,5 +5,36 @@ Base class for extension modules to inherit.
 from helpers import *
 
 class Command:
+    # Whether the command changes lines directly instead of through editor methods
+    direct_edits = True
+    # Whether the command changes the text, it's refused on read only files
+    changes_text = False
+
     def __init__(self):
         pass
+
+class LineTransform(Command):
+    """Base class for commands that transform text line by line.
+
+    Override transform_line, or transform_block to handle a list of lines
+    at once. The scope is either the lines with cursors or all lines.
+    """
+    direct_edits = False
+    changes_text = True
+    scope = "cursors"       # "cursors" or "all"
+    action = "transform"    # Undo action name
+
+    def transform_line(self, line):
+        """Return the transformed version of a line (a string)."""
+        return line
+
+    def transform_block(self, lines):
+        """Return a transformed list of lines of the same length."""
+        return [self.transform_line(line) for line in lines]
+
+    def run(self, app, editor):
+        line_nums = None
+        if self.scope == "cursors":
+            line_nums = editor.get_lines_with_cursors()
+        editor.transform_lines(self.transform_block, line_nums, self.action)
+
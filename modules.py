@@ -23,7 +23,7 @@ class ModuleLoader:
                 continue
             parts = item.split(".")
             if len(parts) < 2:
-                return False
+                continue  # Directories like __pycache__
             name = parts[0]
             ext = parts[-1]
         
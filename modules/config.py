@@ -1,6 +1,8 @@
 from mod_base import *
 
 class Config(Command):
+    direct_edits = False
+
     def __init__(self):
         pass
 
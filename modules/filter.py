@@ -0,0 +1,28 @@
+from mod_base import *
+from jobs import EditorFilter
+
+class Filter(Command):
+    direct_edits = False
+    changes_text = True
+
+    def __init__(self):
+        pass
+
+    def run(self, app, editor):
+        command = app.ui.query("Filter through:")
+        if not command:
+            return False
+        job = EditorFilter(app, editor, command)
+        try:
+            job.start()
+        except OSError as e:
+            app.set_status("Couldn't run '" + command + "': " + str(e))
+            return False
+        app.add_job(job)
+        app.set_status("Running '" + command + "'...")
+        return True
+
+module = {
+    "class": Filter,
+    "name": "filter",
+}
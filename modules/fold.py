@@ -0,0 +1,21 @@
+from mod_base import *
+
+class Fold(Command):
+    direct_edits = False
+
+    def __init__(self):
+        pass
+
+    def run(self, app, editor):
+        if editor.folds.any():
+            editor.unfold_all()
+            app.set_status("Unfolded everything")
+        else:
+            editor.fold_all()
+            app.set_status("Folded " + str(editor.folds.count()) + " blocks")
+        return True
+
+module = {
+    "class": Fold,
+    "name": "fold",
+}
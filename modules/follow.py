@@ -0,0 +1,31 @@
+from mod_base import *
+
+class Follow(Command):
+    direct_edits = False
+
+    def __init__(self):
+        pass
+
+    def run(self, app, editor):
+        f = app.get_file()
+        if not f.name or not f.disk_stat:
+            app.set_status("Only files on disk can be followed.")
+            return False
+        if f.compression or f.read_only:
+            app.set_status("Compressed and read only files can't be followed.")
+            return False
+        if f.follow:
+            f.set_follow(False)
+            app.set_status("Stopped following '" + f.name + "'")
+        else:
+            if not f.set_follow(True):
+                app.set_status("Can't follow '" + f.name + "', it changed on disk. Save or reload it first.")
+                return False
+            editor.follow_end()
+            app.set_status("Following '" + f.name + "'")
+        return True
+
+module = {
+    "class": Follow,
+    "name": "follow",
+}
@@ -1,15 +1,10 @@
 from mod_base import *
 
-class Lower(Command):
-    def __init__(self):
-        pass
+class Lower(LineTransform):
+    action = "lower"
 
-    def run(self, app, editor):
-        line_nums = []
-        for cursor in editor.cursors:
-            if not cursor.y in line_nums:
-                line_nums.append(cursor.y)
-                editor.lines[cursor.y].data = editor.lines[cursor.y].data.lower()
+    def transform_line(self, line):
+        return line.lower()
 
 module = {
     "class": Lower,
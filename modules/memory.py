@@ -0,0 +1,20 @@
+from mod_base import *
+from memusage import memory_usage, format_report
+
+class Memory(Command):
+    direct_edits = False
+
+    def __init__(self):
+        pass
+
+    def run(self, app, editor):
+        f = app.default_file()
+        f.set_data(format_report(memory_usage(app)))
+        app.files.append(f)
+        app.switch_to_file(app.last_file_index())
+        return True
+
+module = {
+    "class": Memory,
+    "name": "memory",
+}
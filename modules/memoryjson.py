@@ -0,0 +1,21 @@
+from mod_base import *
+from memusage import memory_usage, format_json
+
+class MemoryJson(Command):
+    direct_edits = False
+
+    def __init__(self):
+        pass
+
+    def run(self, app, editor):
+        f = app.default_file()
+        f.editor.set_file_extension("json")
+        f.set_data(format_json(memory_usage(app)))
+        app.files.append(f)
+        app.switch_to_file(app.last_file_index())
+        return True
+
+module = {
+    "class": MemoryJson,
+    "name": "memoryjson",
+}
@@ -0,0 +1,15 @@
+from mod_base import *
+
+class ReplaceFiles(Command):
+    direct_edits = False
+
+    def __init__(self):
+        pass
+
+    def run(self, app, editor):
+        return app.replace_in_files()
+
+module = {
+    "class": ReplaceFiles,
+    "name": "replacefiles",
+}
@@ -1,15 +1,10 @@
 from mod_base import *
 
-class Reverse(Command):
-    def __init__(self):
-        pass
+class Reverse(LineTransform):
+    action = "reverse"
 
-    def run(self, app, editor):
-        line_nums = []
-        for cursor in editor.cursors:
-            if not cursor.y in line_nums:
-                line_nums.append(cursor.y)
-                editor.lines[cursor.y].data = editor.lines[cursor.y].data[::-1] # Reverse string
+    def transform_line(self, line):
+        return line[::-1] # Reverse string
 
 module = {
     "class": Reverse,
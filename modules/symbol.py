@@ -0,0 +1,56 @@
+import curses
+
+from mod_base import *
+from fileindex import fuzzy_pattern
+
+class Symbol(Command):
+    direct_edits = False
+
+    def __init__(self):
+        self.symbols = []
+        self.matches = []
+        self.selected = 0
+
+    def run(self, app, editor):
+        self.symbols = editor.outline.symbols()
+        if self.symbols == None:
+            app.set_status("Still looking for symbols, try again in a moment.")
+            return False
+        if not self.symbols:
+            app.set_status("No symbols found.")
+            return False
+        self.app = app
+        self.filter_symbols("", None)
+        value = app.ui.query_filter("Go to symbol:", "", self.filter_symbols)
+        if value == False or not self.matches:
+            return False
+        y, indent, name = self.matches[self.selected]
+        x = max(0, editor.lines[y].find(name))
+        editor.go_to_pos(y+1, x)
+        editor.scroll_to_line(y)
+        return True
+
+    def filter_symbols(self, value, key):
+        """Show the symbols matching what's typed, in the order they're defined."""
+        limit = self.app.ui.editor_win.getmaxyx()[0]
+        if key == curses.KEY_UP:
+            self.selected = max(0, self.selected-1)
+        elif key == curses.KEY_DOWN:
+            self.selected = min(len(self.matches[:limit])-1, self.selected+1)
+        elif key != None:
+            return False
+        else:
+            value = value.strip().lower()
+            search = fuzzy_pattern(value).search
+            self.matches = [symbol for symbol in self.symbols if search(symbol[2].lower())]
+            # Names containing the text as is go first
+            self.matches.sort(key=lambda symbol: not value in symbol[2].lower())
+            self.selected = 0
+        items = [str(y+1).rjust(6) + "  " + " " * indent + name for y, indent, name in self.matches[:limit]]
+        self.app.ui.show_list(items, self.selected)
+        return True
+
+module = {
+    "class": Symbol,
+    "name": "symbol",
+}
@@ -1,17 +1,18 @@
 from mod_base import *
 
-class TabsToSpaces(Command):
-    def __init__(self):
-        pass
+class TabsToSpaces(LineTransform):
+    scope = "all"
+    action = "tabstospaces"
+    tab_width = 4
+
+    def transform_line(self, line):
+        return line.replace("\t", " "*self.tab_width)
 
     def run(self, app, editor):
-        i = 0
-        for line in editor.lines:
-            new = line.data.replace("\t", " "*editor.config["tab_width"])
-            editor.lines[i].data = new
-            i += 1
+        self.tab_width = editor.config["tab_width"]
+        LineTransform.run(self, app, editor)
 
 module = {
     "class": TabsToSpaces,
     "name": "tabstospaces",
-}
\ No newline at end of file
+}
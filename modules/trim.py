@@ -1,14 +1,13 @@
 from mod_base import *
 
-class Trim(Command):
-    def __init__(self):
-        pass
+class Trim(LineTransform):
+    scope = "all"
+    action = "trim"
 
-    def run(self, app, editor):
-        for line in editor.lines:
-            line.data = line.data.rstrip()
+    def transform_line(self, line):
+        return line.rstrip()
 
 module = {
     "class": Trim,
     "name": "trim",
-}
\ No newline at end of file
+}
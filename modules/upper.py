@@ -1,15 +1,10 @@
 from mod_base import *
 
-class Upper(Command):
-    def __init__(self):
-        pass
+class Upper(LineTransform):
+    action = "upper"
 
-    def run(self, app, editor):
-        line_nums = []
-        for cursor in editor.cursors:
-            if not cursor.y in line_nums:
-                line_nums.append(cursor.y)
-                editor.lines[cursor.y].data = editor.lines[cursor.y].data.upper()
+    def transform_line(self, line):
+        return line.upper()
 
 module = {
     "class": Upper,
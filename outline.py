@@ -0,0 +1,168 @@
+#-*- encoding: utf-8
+"""
+Outline of the symbols (classes, functions, headings) defined in a file.
+"""
+
+import bisect
+import threading
+
+import linelight
+from folds import indent_level
+
+def find_symbols(texts, parser, tab_width, start=0):
+    """Return the line numbers and (indentation, name) of the symbols in a list of strings."""
+    ys = []
+    entries = []
+    for y, text in enumerate(texts):
+        try:
+            name = parser(text)
+        except:
+            name = None
+        if name:
+            ys.append(start + y)
+            entries.append((indent_level(text, tab_width) or 0, name))
+    return ys, entries
+
+class OutlineIndex:
+    """Symbols sorted by line number, kept up to date as lines change.
+
+    Symbols are found with the symbol() function of the linelight module
+    for the file type. Edits remove the symbols on the changed lines,
+    shift the ones after them and look for symbols on the new lines.
+    Large files are scanned in a background thread. Edits made meanwhile
+    are recorded and replayed on the result, rescanning the lines they
+    touched.
+    """
+    def __init__(self, viewer):
+        self.viewer = viewer
+        self.extension = None
+        self.parser = None
+        self.ys = None          # Sorted line numbers of symbols, None until scanned
+        self.entries = []       # (indentation, name) of each symbol
+        self.thread = None      # Background scan in progress
+        self.result = None      # List that the background scan puts its result in
+        self.pending = []       # Edits made during the background scan
+
+    def check_parser(self):
+        ext = self.viewer.file_extension
+        if ext != self.extension:
+            self.extension = ext
+            self.parser = linelight.get_symbol_parser(ext, self.viewer.app.logger)
+            self.lines_reset()
+
+    def lines_reset(self):
+        """Forget everything, the lines are scanned again when needed."""
+        self.ys = None
+        self.entries = []
+        self.thread = None
+        self.pending = []
+
+    def lines_changed(self, y, removed, added):
+        """Lines y...y+removed were replaced with added new lines."""
+        if self.thread:
+            self.pending.append((y, removed, added))
+            return
+        if self.ys == None:
+            return
+        self.shift(y, removed, added)
+        self.scan(y, y+added)
+
+    def shift(self, y, removed, added):
+        """Remove the symbols on lines y...y+removed and move the ones after them."""
+        start = bisect.bisect_left(self.ys, y)
+        end = bisect.bisect_left(self.ys, y+removed)
+        delta = added - removed
+        self.ys[start:] = [line + delta for line in self.ys[end:]]
+        del self.entries[start:end]
+
+    def scan(self, start, end):
+        """Find the symbols on lines start...end."""
+        if not self.parser or start >= end:
+            return
+        texts = [line.data for line in self.viewer.lines[start:end]]
+        ys, entries = find_symbols(texts, self.parser, self.viewer.config["tab_width"], start)
+        i = bisect.bisect_left(self.ys, start)
+        j = bisect.bisect_left(self.ys, end)
+        self.ys[i:j] = ys
+        self.entries[i:j] = entries
+
+    def scan_all(self, texts, parser, tab_width, result):
+        """Scan all lines, in a background thread."""
+        result.append(find_symbols(texts, parser, tab_width))
+
+    def validate(self):
+        """Make sure the outline is up to date. Returns False while it's still being scanned."""
+        self.check_parser()
+        if self.thread:
+            if self.thread.is_alive():
+                return False
+            self.install()
+        if self.ys != None:
+            return True
+        if not self.parser or self.viewer.document.read_only:
+            # Read only files can be too big to scan
+            self.ys = []
+            return True
+        lines = self.viewer.lines
+        if len(lines) < self.viewer.config["outline_thread_lines"]:
+            self.ys = []
+            self.scan(0, len(lines))
+            return True
+        self.result = []
+        args = ([line.data for line in lines], self.parser, self.viewer.config["tab_width"], self.result)
+        self.thread = threading.Thread(target=self.scan_all, args=args)
+        self.thread.daemon = True
+        self.thread.start()
+        return False
+
+    def install(self):
+        """Take the result of the background scan and replay the edits made meanwhile."""
+        self.thread = None
+        pending = self.pending
+        self.pending = []
+        if not self.result:
+            return # The scan failed, start over
+        self.ys, self.entries = self.result[0]
+        dirty = []  # Ranges of lines to rescan
+        for y, removed, added in pending:
+            self.shift(y, removed, added)
+            delta = added - removed
+            start, end = y, y+added
+            ranges = []
+            for a, b in dirty:
+                if b < y:
+                    ranges.append((a, b))
+                elif a > y+removed:
+                    ranges.append((a+delta, b+delta))
+                else:
+                    start, end = min(start, a), max(end, b+delta)
+            ranges.append((start, end))
+            dirty = sorted(ranges)
+        for start, end in dirty:
+            self.scan(start, min(end, len(self.viewer.lines)))
+
+    def symbols(self):
+        """Return (line number, indentation, name) of all symbols, or None if they're not ready."""
+        if not self.validate():
+            return None
+        return [(y, indent, name) for y, (indent, name) in zip(self.ys, self.entries)]
+
+    def path_at(self, y):
+        """Return the names of the symbols containing line y, outermost first."""
+        if not self.validate():
+            return []
+        lines = self.viewer.lines
+        level = None
+        if y < len(lines):
+            level = indent_level(lines[y].data, self.viewer.config["tab_width"])
+        path = []
+        i = bisect.bisect_right(self.ys, y) - 1
+        while i >= 0:
+            indent, name = self.entries[i]
+            if self.ys[i] == y or level == None or indent < level:
+                path.insert(0, name)
+                level = indent
+            if indent == 0:
+                break # Nothing above contains it
+            i -= 1
+        return path
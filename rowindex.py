@@ -0,0 +1,206 @@
+#-*- encoding: utf-8
+"""
+Index of how many screen rows each line takes when lines are wrapped or folded.
+"""
+
+BLOCK_SIZE = 512    # Values kept together in a block of a CountTree
+
+def fenwick_build(values):
+    """Return a Fenwick tree of values in O(n)."""
+    tree = [0] + list(values)
+    for i in range(1, len(tree)):
+        parent = i + (i & -i)
+        if parent < len(tree):
+            tree[parent] += tree[i]
+    return tree
+
+def fenwick_add(tree, i, delta):
+    """Add delta to value i."""
+    i += 1
+    while i < len(tree):
+        tree[i] += delta
+        i += i & -i
+
+def fenwick_prefix(tree, i):
+    """Return the sum of the first i values."""
+    total = 0
+    while i > 0:
+        total += tree[i]
+        i -= i & -i
+    return total
+
+def fenwick_search(tree, value):
+    """Return the largest i whose prefix sum is at most value, and that prefix sum."""
+    i = 0
+    left = value
+    step = 1 << (len(tree)-1).bit_length() if len(tree) > 1 else 0
+    while step:
+        j = i + step
+        if j < len(tree) and tree[j] <= left:
+            i = j
+            left -= tree[j]
+        step >>= 1
+    return i, value - left
+
+class CountTree:
+    """A list of non-negative numbers with fast splicing and prefix sums.
+
+    The numbers are kept in blocks of about BLOCK_SIZE. Two Fenwick trees
+    over the blocks hold how many numbers and what sum each block has, so
+    finding the block of a position or of a prefix sum takes O(log n)
+    and the rest is done within one block. Replacing numbers within a
+    block updates the trees in O(log n). Blocks that grow too big or
+    small are split or merged, which rebuilds the trees in
+    O(n / BLOCK_SIZE).
+    """
+    def __init__(self, values=()):
+        self.build(values)
+
+    def build(self, values):
+        values = list(values)
+        self.blocks = [values[i:i+BLOCK_SIZE] for i in range(0, len(values), BLOCK_SIZE)]
+        self.block_sums = [sum(block) for block in self.blocks]
+        self.reindex()
+
+    def reindex(self):
+        """Rebuild the trees after blocks were split or merged."""
+        self.counts = fenwick_build(len(block) for block in self.blocks)
+        self.sums = fenwick_build(self.block_sums)
+        self.length = sum(len(block) for block in self.blocks)
+        self.total = sum(self.block_sums)
+
+    def __len__(self):
+        return self.length
+
+    def locate(self, y):
+        """Return the block containing position y and the offset of y in it.
+
+        The position after the last number is at the end of the last block.
+        """
+        b, before = fenwick_search(self.counts, y)
+        if b == len(self.blocks) and b:
+            b -= 1
+            before -= len(self.blocks[b])
+        return b, y - before
+
+    def __getitem__(self, y):
+        b, i = self.locate(y)
+        return self.blocks[b][i]
+
+    def __iter__(self):
+        for block in self.blocks:
+            for value in block:
+                yield value
+
+    def replace(self, y, removed, values):
+        """Replace the numbers y...y+removed with values."""
+        values = list(values)
+        if not self.blocks:
+            self.build(values)
+            return
+        b, i = self.locate(y)
+        block = self.blocks[b]
+        if i + removed <= len(block):
+            delta = sum(values) - sum(block[i:i+removed])
+            block[i:i+removed] = values
+            self.block_sums[b] += delta
+            self.length += len(values) - removed
+            self.total += delta
+            if BLOCK_SIZE // 4 <= len(block) <= BLOCK_SIZE * 2:
+                fenwick_add(self.counts, b, len(values) - removed)
+                fenwick_add(self.sums, b, delta)
+                return
+            end = b+1
+            if b+1 < len(self.blocks):
+                end += 1 # Merge a small block with the next one
+            elif b > 0:
+                b -= 1
+            merged = [value for block in self.blocks[b:end] for value in block]
+        else:
+            # Spans several blocks
+            end, j = self.locate(y+removed)
+            merged = block[:i] + values + self.blocks[end][j:]
+            end += 1
+        parts = [merged[i:i+BLOCK_SIZE] for i in range(0, len(merged), BLOCK_SIZE)]
+        self.blocks[b:end] = parts
+        self.block_sums[b:end] = [sum(part) for part in parts]
+        self.reindex()
+
+    def prefix(self, y):
+        """Return the sum of the first y numbers."""
+        if y >= self.length:
+            return self.total
+        b, i = self.locate(y)
+        return fenwick_prefix(self.sums, b) + sum(self.blocks[b][:i])
+
+    def find(self, value):
+        """Return the largest y whose prefix sum is at most value."""
+        b, before = fenwick_search(self.sums, value)
+        if b >= len(self.blocks):
+            return self.length
+        y = fenwick_prefix(self.counts, b)
+        for count in self.blocks[b]:
+            if before + count > value:
+                break
+            before += count
+            y += 1
+        return y
+
+class RowIndex:
+    """Rows per line in a CountTree for mapping between lines and screen rows.
+
+    Only lines that are edited are measured again. Editing, adding or
+    removing lines and looking up rows all take O(log n) plus the work
+    within one block of the tree.
+    """
+    def __init__(self, viewer):
+        self.viewer = viewer
+        self.width = None
+        self.rows = None      # CountTree of the screen rows of each line, None until first used
+
+    def measure(self, y):
+        """Return the number of rows line y takes."""
+        return self.viewer.line_height(y, self.width)
+
+    def rebuild(self):
+        """Measure all lines."""
+        self.width = self.viewer.row_width()
+        self.rows = CountTree(self.measure(y) for y in range(len(self.viewer.lines)))
+
+    def lines_reset(self):
+        """Forget everything, all lines are measured again when needed."""
+        self.rows = None
+
+    def lines_changed(self, y, removed, added):
+        """Lines y...y+removed were replaced with added new lines."""
+        if self.rows == None:
+            return
+        self.rows.replace(y, removed, [self.measure(i) for i in range(y, y+added)])
+
+    def remeasure(self, start, end):
+        """Measure lines start...end again, after they were folded or unfolded."""
+        if self.rows == None:
+            return
+        self.rows.replace(start, end-start, [self.measure(i) for i in range(start, end)])
+
+    def validate(self):
+        """Make sure the index matches the lines."""
+        if self.rows == None or self.width != self.viewer.row_width() \
+                or len(self.rows) != len(self.viewer.lines):
+            self.rebuild()
+
+    def row_of(self, y):
+        """Return the first screen row of line y."""
+        self.validate()
+        return self.rows.prefix(max(0, y))
+
+    def line_at(self, row):
+        """Return the line that is shown on screen row."""
+        self.validate()
+        y = self.rows.find(row)
+        return max(0, min(y, len(self.rows)-1))
+
+    def total(self):
+        """Return the total number of screen rows."""
+        self.validate()
+        return self.rows.total
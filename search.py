@@ -0,0 +1,345 @@
+#-*- encoding: utf-8
+"""
+Search for text in open files and files on disk in parallel.
+"""
+
+import os
+import re
+import queue
+import fnmatch
+import threading
+import concurrent.futures
+
+import textio
+
+BATCH_SIZE = 32             # Files searched by a worker process at a time
+SAMPLE_SIZE = 8 * 1024      # Bytes checked for null bytes to detect binary files
+MAX_LINE_LENGTH = 200       # Matching lines are cut to this length in the results
+
+# Matches the location at the beginning of a result line
+RESULT_PATTERN = re.compile(r"^([^:]+:\d+:\d+): ")
+
+def compile_pattern(what, regex=False):
+    """Compile a search pattern, falling back to a literal search if the regex is invalid."""
+    if regex:
+        try:
+            return re.compile(what)
+        except re.error:
+            pass
+    return re.compile(re.escape(what))
+
+def replace_template(replacement, regex=False):
+    """Return a replacement template for re.sub, escaping backslashes if it's literal."""
+    if regex:
+        return replacement
+    return replacement.replace("\\", "\\\\")
+
+def search_lines(lines, pattern):
+    """Return (line number, column, line) of each match in a list of strings."""
+    results = []
+    for y, line in enumerate(lines):
+        for match in pattern.finditer(line):
+            results.append((y+1, match.start()+1, line))
+    return results
+
+def search_file(path, pattern, max_size, default_encoding):
+    """Search a file on disk. Returns None for binary and too large files."""
+    try:
+        if os.path.getsize(path) > max_size:
+            return None
+        f = open(path, "rb")
+        try:
+            sample = f.read(SAMPLE_SIZE)
+        finally:
+            f.close()
+        if b"\0" in sample:
+            return None
+        text, encoding = textio.read_text(path, None, default_encoding)
+    except (OSError, UnicodeDecodeError, LookupError):
+        return None
+    if not pattern.search(text):
+        return []
+    return search_lines(text.split("\n"), pattern)
+
+def search_files(paths, pattern, max_size, default_encoding):
+    """Search a batch of files, in a worker process. Returns (path, results) pairs."""
+    found = []
+    for path in paths:
+        results = search_file(path, pattern, max_size, default_encoding)
+        if results:
+            found.append((path, results))
+    return found
+
+def replace_file(path, pattern, template, mtime, default_encoding):
+    """Replace matches in a file on disk line by line. Returns the number of replacements.
+
+    The file is left alone if it was modified after mtime. The line
+    endings are kept as they were.
+    """
+    if os.stat(path).st_mtime_ns != mtime:
+        return 0
+    text, encoding = textio.read_text(path, None, default_encoding, translate=False)
+    count = 0
+    lines = text.split("\n")
+    for i, line in enumerate(lines):
+        end = ""
+        if line.endswith("\r"):
+            line, end = line[:-1], "\r"
+        new, n = pattern.subn(template, line)
+        if n:
+            lines[i] = new + end
+            count += n
+    if count:
+        textio.write_text_atomic(path, "\n".join(lines), encoding)
+    return count
+
+def replace_files(items, pattern, template, default_encoding):
+    """Replace matches in a batch of (path, mtime) files, in a worker process.
+
+    Returns (path, replacements or error message) pairs.
+    """
+    done = []
+    for path, mtime in items:
+        try:
+            done.append((path, replace_file(path, pattern, template, mtime, default_encoding)))
+        except (OSError, UnicodeError) as e:
+            done.append((path, str(e)))
+    return done
+
+def walk_files(root, ignore):
+    """Yield the paths of files below root, skipping names matching the ignore patterns."""
+    def ignored(name):
+        return any(fnmatch.fnmatch(name, pattern) for pattern in ignore)
+    for path, dirs, files in os.walk(root):
+        dirs[:] = sorted(name for name in dirs if not ignored(name))
+        for name in sorted(files):
+            if not ignored(name):
+                yield os.path.join(path, name)
+
+class ProjectSearch:
+    """Search open buffers and a directory tree, streaming results to an editor.
+
+    A thread walks the directory and hands batches of files to a process
+    pool. Results are put in a queue that the app drains in update(), so
+    they appear in the results editor as they are found.
+    """
+    def __init__(self, app, what, root, results):
+        self.app = app
+        self.what = what
+        self.root = root
+        self.results = results      # Editor that shows the results
+        config = app.config["app"]
+        self.pattern = compile_pattern(what, app.config["editor"]["regex_find"])
+        self.ignore = config["search_ignore"]
+        self.max_size = config["search_max_size"]
+        self.encoding = app.config["editor"]["default_encoding"]
+        self.buffers = []           # (path, lines) of open files
+        self.open_paths = set()     # Real paths of open files
+        for f in app.files:
+            if f.name and f.loaded and not f.read_only:
+                # Read only files are unchanged, they're searched on disk if they're small enough
+                self.buffers.append((f.path(), [line.data for line in f.editor.lines]))
+                self.open_paths.add(os.path.realpath(f.path()))
+        self.found = queue.Queue()
+        self.matches = 0
+        self.files = 0
+        self.cancelled = False
+        self.failure = None
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        try:
+            self.search()
+        except Exception as e:
+            self.failure = e
+
+    def search(self):
+        """Search the open buffers and then the files on disk."""
+        for path, lines in self.buffers:
+            results = search_lines(lines, self.pattern)
+            if results:
+                self.found.put((path, results))
+        self.buffers = None
+        executor = concurrent.futures.ProcessPoolExecutor()
+        try:
+            futures = []
+            batch = []
+            for path in walk_files(self.root, self.ignore):
+                if self.cancelled:
+                    break
+                if os.path.realpath(path) in self.open_paths:
+                    continue
+                batch.append(path)
+                if len(batch) >= BATCH_SIZE:
+                    futures.append(executor.submit(search_files, batch, self.pattern, self.max_size, self.encoding))
+                    batch = []
+            if batch:
+                futures.append(executor.submit(search_files, batch, self.pattern, self.max_size, self.encoding))
+            for future in concurrent.futures.as_completed(futures):
+                if self.cancelled:
+                    break
+                for item in future.result():
+                    self.found.put(item)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def format(self, path, results):
+        """Format results as 'path:line:col: text' lines."""
+        path = os.path.relpath(path, self.root)
+        return [path + ":" + str(y) + ":" + str(x) + ": " + line.strip()[:MAX_LINE_LENGTH] for y, x, line in results]
+
+    def update(self):
+        """Add new results to the results editor. Returns True if there were any."""
+        lines = []
+        while True:
+            try:
+                path, results = self.found.get_nowait()
+            except queue.Empty:
+                break
+            self.files += 1
+            self.matches += len(results)
+            lines.extend(self.format(path, results))
+        if not lines:
+            return False
+        if len(self.results.lines) == 1 and not self.results.lines[0].data:
+            self.results.append_data("\n".join(lines))
+        else:
+            self.results.append_data("\n" + "\n".join(lines))
+        return True
+
+    def done(self):
+        return not self.thread.is_alive() and self.found.empty()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def finish(self):
+        ProjectSearch.update(self)
+        if self.failure:
+            self.app.set_status("Searching files failed: " + str(self.failure))
+            return False
+        self.app.set_status("Found " + str(self.matches) + " matches for '" + self.what + "' in " + \
+                            str(self.files) + " files.")
+        return True
+
+class ProjectReplace(ProjectSearch):
+    """Replace text in open buffers and files on disk.
+
+    Matches are first listed in the results editor as a preview. When the
+    search is done the user is asked to confirm. Open buffers are changed
+    in the editor, each as one undo step. Files on disk are rewritten
+    atomically by worker processes, and update() adds up their results as
+    the batches finish, so the UI keeps running meanwhile.
+    """
+    def __init__(self, app, what, replacement, root, results):
+        ProjectSearch.__init__(self, app, what, root, results)
+        self.replacement = replacement
+        self.template = replace_template(replacement, app.config["editor"]["regex_find"])
+        self.paths = []             # Paths of files with matches
+        self.mtimes = {}            # Modification times of the files on disk when searched
+        self.stage = "search"       # "search", "replace" or "done"
+        self.replaced = False       # Whether the replacement was confirmed
+        self.executor = None
+        self.futures = []           # Batches of files on disk being rewritten
+        self.count = 0              # Replacements made so far
+        self.failed = []            # Files that couldn't be rewritten
+        self.skipped = []           # Read only files that were left alone
+
+    def format(self, path, results):
+        self.paths.append(path)
+        if not os.path.realpath(path) in self.open_paths:
+            try:
+                self.mtimes[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                pass
+        return ProjectSearch.format(self, path, results)
+
+    def update(self):
+        if self.stage == "search":
+            changed = ProjectSearch.update(self)
+            if ProjectSearch.done(self):
+                self.stage = "replace" if self.start_replace() else "done"
+            return changed
+        if self.stage == "replace":
+            self.collect()
+        return False
+
+    def start_replace(self):
+        """Confirm the replacement, change the open buffers and start rewriting files on disk.
+
+        Returns False if nothing is going to be replaced.
+        """
+        if not ProjectSearch.finish(self) or not self.matches or self.cancelled:
+            return False
+        question = "Replace " + str(self.matches) + " matches in " + str(self.files) + " files?"
+        if not self.app.ui.query_bool(question):
+            self.app.set_status("Nothing replaced.")
+            return False
+        self.replaced = True
+        on_disk = []
+        for path in self.paths:
+            f = self.app.file_is_open(path)
+            if f and f.read_only:
+                # Searched on disk, but opened read only on purpose
+                self.skipped.append(os.path.relpath(path, self.root))
+            elif f and f.loaded:
+                self.count += f.editor.replace(self.what, self.replacement)
+            elif path in self.mtimes:
+                # Lazily restored files that aren't loaded yet are searched on disk too
+                on_disk.append((path, self.mtimes[path]))
+        if on_disk:
+            batches = [on_disk[i:i+BATCH_SIZE] for i in range(0, len(on_disk), BATCH_SIZE)]
+            self.executor = concurrent.futures.ProcessPoolExecutor()
+            self.futures = [self.executor.submit(replace_files, batch, self.pattern, self.template, self.encoding)
+                            for batch in batches]
+            self.app.set_status("Replacing in " + str(len(on_disk)) + " files...")
+        return True
+
+    def collect(self):
+        """Add up the results of the batches that are done."""
+        for future in [future for future in self.futures if future.done()]:
+            self.futures.remove(future)
+            try:
+                results = future.result()
+            except Exception as e:
+                self.failure = e
+                continue
+            for path, result in results:
+                if isinstance(result, str):
+                    self.failed.append(os.path.relpath(path, self.root))
+                else:
+                    self.count += result
+        if not self.futures:
+            self.stop()
+
+    def stop(self):
+        self.stage = "done"
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def done(self):
+        return self.stage == "done"
+
+    def cancel(self):
+        ProjectSearch.cancel(self)
+        self.futures = []
+        self.stop()
+
+    def finish(self):
+        if not self.replaced:
+            return False
+        status = "Replaced " + str(self.count) + " matches."
+        if self.failure:
+            status += " Replacing files failed: " + str(self.failure)
+        if self.failed:
+            status += " Failed to write " + ", ".join(self.failed)
+        if self.skipped:
+            status += " Skipped read only " + ", ".join(self.skipped)
+        self.app.set_status(status)
+        return True
@@ -0,0 +1,204 @@
+#-*- encoding: utf-8
+"""
+Store and restore the list of open files between runs.
+"""
+
+import os
+import json
+
+from helpers import *
+from cursor import *
+from line import *
+from file import *
+from editor import *
+
+class Session:
+    def __init__(self, app):
+        self.app = app
+        self.filename = ".suplemon-session.json"
+        self.fpath = os.path.expanduser("~")
+
+    def log(self, s, log_type=LOG_ERROR):
+        self.app.log(s, log_type)
+
+    def path(self):
+        return os.path.join(self.fpath, self.filename)
+
+    def store(self):
+        """Write the open files and their editor states to the session file."""
+        with_history = self.app.config["app"]["remember_undo_history"]
+        strings = StringPool()
+        entries = []
+        current = 0
+        for f in self.app.get_files():
+            if not f.name:
+                continue  # Unnamed buffers (help, scratch) can't be reopened
+            if f == self.app.get_file():
+                current = len(entries)
+            if not f.loaded:
+                # Never switched to during this run, keep what we restored
+                entry = f.session_entry
+                if with_history and "history" in entry:
+                    entry = dict(entry)
+                    entry["history"] = self.repool(entry["history"], strings)
+                elif "history" in entry:
+                    entry = dict(entry)
+                    del entry["history"]
+                entries.append(entry)
+                continue
+            entries.append(self.file_entry(f, strings, with_history))
+        data = {
+            "current": current,
+            "files": entries,
+            "strings": strings.items,
+        }
+        try:
+            f = open(self.path(), "w")
+            f.write(json.dumps(data, separators=(",", ":")))
+            f.close()
+        except:
+            self.log("Failed to store session!")
+            self.log(get_error_info())
+            return False
+        return True
+
+    def file_entry(self, f, strings, with_history):
+        """Build the session entry of a loaded file."""
+        editor = f.editor
+        entry = {
+            "path": f.path(),
+            "cursors": [cursor.tuple() for cursor in editor.cursors],
+            "y_scroll": editor.y_scroll,
+            "x_scroll": editor.x_scroll,
+        }
+        stat = file_stat(f.path())
+        if with_history and stat and not f.is_changed():
+            # Undo history only applies to the exact content it was recorded on
+            entry["stat"] = stat
+            entry["history"] = {
+                "current": editor.current_state,
+                "states": [self.state_entry(state, strings) for state in editor.history],
+            }
+        return entry
+
+    def state_entry(self, state, strings):
+        """Convert an undo State to a compact list using the shared string pool."""
+        return [
+            [strings.index(line) for line in state.lines],
+            [list(Cursor(cursor).tuple()) for cursor in state.cursors],
+            state.y_scroll,
+            state.x_scroll,
+            strings.index(state.last_find),
+        ]
+
+    def repool(self, history, strings):
+        """Move a stored history from the old string pool to a new one."""
+        states = []
+        for state in history["states"]:
+            state = list(state)
+            state[0] = [strings.index(line) for line in state[0]]
+            state[4] = strings.index(state[4])
+            states.append(state)
+        return {"current": history["current"], "states": states}
+
+    def load(self):
+        """Read the session file. Returns False if there's no usable session."""
+        path = self.path()
+        if not os.path.exists(path):
+            return False
+        try:
+            f = open(path)
+            data = json.loads(f.read())
+            f.close()
+        except:
+            self.log("Failed to load session!")
+            self.log(get_error_info())
+            return False
+        if not data.get("files"):
+            return False
+        return data
+
+    def restore(self):
+        """Reopen the files of the last session.
+
+        Only the current file is read immediately, the rest are loaded
+        when they are first switched to.
+        """
+        data = self.load()
+        if not data:
+            return False
+        strings = data.get("strings", [])
+        for entry in data["files"]:
+            if "history" in entry:
+                # Resolve the pooled strings so the entry stands on its own
+                entry["history"] = self.unpool(entry["history"], strings)
+            f = File(self.app)
+            f.set_path(entry["path"])
+            f.set_editor(self.app.new_editor())
+            f.set_lazy(entry, self.apply_entry)
+            self.app.files.append(f)
+        current = data.get("current", 0)
+        if current >= len(self.app.files):
+            current = 0
+        self.app.switch_to_file(current)
+        return True
+
+    def unpool(self, history, strings):
+        """Replace string pool indices in a stored history with the strings."""
+        states = []
+        for state in history["states"]:
+            state = list(state)
+            state[0] = [strings[i] for i in state[0]]
+            state[4] = strings[state[4]]
+            states.append(state)
+        return {"current": history["current"], "states": states}
+
+    def apply_entry(self, f, entry):
+        """Restore cursors, scroll and history of a file after it's loaded."""
+        editor = f.editor
+        if "history" in entry and entry.get("stat") == file_stat(f.path()):
+            self.apply_history(editor, entry["history"])
+        cursors = [Cursor(tuple(cursor)) for cursor in entry.get("cursors", [])]
+        if cursors:
+            editor.cursors = cursors
+        editor.y_scroll = max(0, min(entry.get("y_scroll", 0), len(editor.lines)-1))
+        editor.x_scroll = max(0, entry.get("x_scroll", 0))
+        editor.move_cursors(noupdate=True)
+
+    def apply_history(self, editor, history):
+        """Rebuild the undo history of an editor."""
+        states = []
+        for item in history["states"]:
+            state = State()
+            state.lines = item[0]
+            state.cursors = [tuple(cursor) for cursor in item[1]]
+            state.y_scroll = item[2]
+            state.x_scroll = item[3]
+            state.last_find = item[4]
+            states.append(state)
+        if not states:
+            return False
+        editor.history = states
+        editor.current_state = min(history["current"], len(states)-1)
+        return True
+
+class StringPool:
+    """Store each distinct string once and refer to it by index."""
+    def __init__(self):
+        self.items = []
+        self.indices = {}
+
+    def index(self, s):
+        if s in self.indices:
+            return self.indices[s]
+        self.indices[s] = len(self.items)
+        self.items.append(s)
+        return self.indices[s]
+
+def file_stat(path):
+    """Return (size, mtime) of a file or None if it doesn't exist."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime]
@@ -0,0 +1,209 @@
+#-*- encoding: utf-8
+"""
+Streaming text file reading and writing with encoding and compression detection.
+"""
+
+import io
+import os
+import bz2
+import gzip
+import lzma
+import codecs
+import shutil
+import tempfile
+
+CHUNK_SIZE = 256 * 1024     # Bytes (or characters when writing) handled at a time
+SAMPLE_SIZE = 64 * 1024     # Bytes checked when detecting the encoding
+
+# Byte order marks, UTF-32 first since its little endian BOM begins with the UTF-16 one
+BOMS = [
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+# Magic bytes at the start of compressed files
+COMPRESSIONS = [
+    (b"\x1f\x8b", "gzip"),
+    (b"BZh", "bz2"),
+    (b"\xfd7zXZ\x00", "xz"),
+]
+
+# Undecodable bytes are kept as lone surrogates and written back as they were
+ERRORS = "surrogateescape"
+
+def normalize_encoding(encoding):
+    """Return the canonical codec name of an encoding or None if it's unknown."""
+    try:
+        return codecs.lookup(encoding).name
+    except (LookupError, TypeError):
+        return None
+
+def detect_encoding(sample, default="utf-8"):
+    """Guess the encoding of a file from a sample of its first bytes."""
+    for bom, encoding in BOMS:
+        if sample.startswith(bom):
+            return encoding
+    try:
+        # Not final, the sample may end in the middle of a character
+        codecs.getincrementaldecoder("utf-8")().decode(sample, False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+    return normalize_encoding(default) or "utf-8"
+
+def detect_compression(path):
+    """Return the compression format of a file ("gzip", "bz2" or "xz") or None."""
+    f = open(path, "rb")
+    try:
+        magic = f.read(6)
+    finally:
+        f.close()
+    for start, compression in COMPRESSIONS:
+        if magic.startswith(start):
+            return compression
+    return None
+
+def open_binary(path, mode, compression=None):
+    """Open a file in binary mode, (de)compressing it on the fly if compression is given."""
+    if compression == "gzip":
+        return gzip.open(path, mode, compresslevel=6) # The default of the gzip command
+    if compression == "bz2":
+        return bz2.open(path, mode)
+    if compression == "xz":
+        return lzma.open(path, mode)
+    return open(path, mode)
+
+def get_decoder(encoding, translate=True):
+    """Return an incremental decoder that also translates newlines to \\n unless translate is False."""
+    decoder = codecs.getincrementaldecoder(encoding)(ERRORS)
+    if not translate:
+        return decoder
+    return io.IncrementalNewlineDecoder(decoder, True)
+
+def read_text(path, encoding=None, default="utf-8", compression=None, translate=True):
+    """Read and decode a file chunk by chunk.
+
+    The encoding is detected if it's not given. Newlines are translated
+    to \\n unless translate is False. Returns (text, encoding).
+    """
+    f = open_binary(path, "rb", compression)
+    try:
+        chunk = f.read(max(CHUNK_SIZE, SAMPLE_SIZE))
+        if not encoding:
+            encoding = detect_encoding(chunk[:SAMPLE_SIZE], default)
+        try:
+            text = decode_stream(f, chunk, encoding, translate)
+        except UnicodeDecodeError:
+            # Can happen with multibyte encodings, latin-1 is always lossless
+            f.seek(0)
+            encoding = "latin-1"
+            text = decode_stream(f, f.read(CHUNK_SIZE), encoding, translate)
+    finally:
+        f.close()
+    return text, encoding
+
+def decode_stream(f, chunk, encoding, translate=True):
+    """Decode the rest of an open binary file, beginning with chunk."""
+    decoder = get_decoder(encoding, translate)
+    parts = []
+    while chunk:
+        parts.append(decoder.decode(chunk))
+        chunk = f.read(CHUNK_SIZE)
+    parts.append(decoder.decode(b"", True))
+    return "".join(parts)
+
+def write_text(path, text, encoding="utf-8", compression=None):
+    """Encode and write text chunk by chunk."""
+    encoder = codecs.getincrementalencoder(encoding)(ERRORS)
+    f = open_binary(path, "wb", compression)
+    try:
+        for i in range(0, len(text), CHUNK_SIZE):
+            f.write(encoder.encode(text[i:i+CHUNK_SIZE]))
+        f.write(encoder.encode("", True))
+    finally:
+        f.close()
+    return True
+
+def encode_text(text, encoding="utf-8", compression=None):
+    """Encode and compress text in memory."""
+    data = codecs.encode(text, encoding, ERRORS)
+    if compression == "gzip":
+        return gzip.compress(data, compresslevel=6)
+    if compression == "bz2":
+        return bz2.compress(data)
+    if compression == "xz":
+        return lzma.compress(data)
+    return data
+
+def default_mode():
+    """Return the permissions of a new file, as open() would create it."""
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+def can_replace(path, st):
+    """Check if the file at path can be replaced by another without changing more than its contents."""
+    if st.st_nlink > 1:
+        return False # Would break hard links
+    if hasattr(os, "getuid") and st.st_uid != os.getuid():
+        return False # Would change the owner
+    return os.access(os.path.dirname(os.path.abspath(path)), os.W_OK)
+
+def write_text_atomic(path, text, encoding="utf-8", compression=None):
+    """Write text to a temporary file and move it over path.
+
+    Readers see either the old or the new contents, never a partly
+    written file. The permissions of an existing file are kept. If the
+    file can't be replaced without changing its owner or links, it's
+    written in place after encoding all of the text, so failing to encode
+    still leaves the file as it was.
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        st = None
+    if st and not can_replace(path, st):
+        data = encode_text(text, encoding, compression)
+        f = open(path, "wb")
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        return True
+    directory, name = os.path.split(os.path.abspath(path))
+    fd, temp = tempfile.mkstemp(prefix="." + name + ".", dir=directory)
+    os.close(fd)
+    try:
+        write_text(temp, text, encoding, compression)
+        if st:
+            shutil.copymode(path, temp)
+        else:
+            os.chmod(temp, default_mode()) # mkstemp creates files only the owner can read
+        os.replace(temp, path)
+    except:
+        os.remove(temp)
+        raise
+    return True
+
+if __name__ == "__main__":
+    # Measure throughput with a large non UTF-8 file
+    import time
+
+    line = "Hyvää päivää, ÅÄÖ åäö é è ç ñ ß ø æ -- 0123456789\n"
+    text = line * (64 * 1024 * 1024 // len(line))
+    path = os.path.join(tempfile.gettempdir(), "suplemon-textio-bench.txt")
+    for encoding in ["cp1252", "latin-1", "utf-16", "utf-8"]:
+        start = time.time()
+        write_text(path, text, encoding)
+        wrote = time.time() - start
+        size = os.path.getsize(path) / 1024.0 / 1024.0
+        start = time.time()
+        data, detected = read_text(path, None, encoding)
+        read = time.time() - start
+        assert data == text
+        print("%-8s %6.1f MB  write %6.1f MB/s  read %6.1f MB/s  (detected %s)" % (
+            encoding, size, size / wrote, size / read, detected))
+    os.remove(path)
@@ -7,6 +7,7 @@ import os
 
 from helpers import *
 
+MAX_SYMBOL_LENGTH = 40 # Longer names of the symbol at the cursor are cut in the status bar
 
 def wrapper(func):
     global curses
@@ -18,6 +19,7 @@ def wrapper(func):
 
     # Now import curses
     import curses
+    import curses.ascii
     import curses.textpad
     curses.wrapper(func)
 
@@ -62,6 +64,8 @@ class InputEvent:
 class UI:
     def __init__(self, app):
         self.app = app
+        self.editor_rect = None     # (height, width, y, x) of the area editors are shown in
+        self.views_layout = None    # What the views were last laid out for
        
     def load(self):
         """Load an setup curses."""
@@ -73,6 +77,8 @@ class UI:
         curses.curs_set(0)
 
         self.screen.keypad(1)
+        # Don't block forever waiting for input so the app can do background updates
+        self.screen.timeout(int(self.app.config["app"]["update_interval"]*1000))
 
         self.current_yx = self.screen.getmaxyx() # For checking resize
         self.setup_mouse()
@@ -146,14 +152,42 @@ class UI:
         if self.app.config["display"]["show_legend"]:
             y_sub += 2
         self.editor_win = curses.newwin(yx[0]-y_sub, yx[1], y_start, 0)
+        self.editor_rect = (yx[0]-y_sub, yx[1], y_start, 0)
+        self.views_layout = None
         if self.app.config["display"]["show_top_bar"]:
             self.legend_win = curses.newwin(2, yx[1], yx[0]-y_sub+1, 0)
         else:
             self.legend_win = curses.newwin(2, yx[1], yx[0]-y_sub, 0)
 
         if resize:
-            self.app.get_editor().resize( (yx[0]-y_sub, yx[1]) )
-            self.app.get_editor().move_win( (y_start, 0) )
+            self.layout_views()
+
+    def layout_views(self):
+        """Give each view of the current file its part of the editor area."""
+        f = self.app.get_file()
+        layout = (f, tuple(f.views), f.split)
+        if layout == self.views_layout:
+            return False
+        self.views_layout = layout
+        height, width, y, x = self.editor_rect
+        count = len(f.views)
+        for i, view in enumerate(f.views):
+            if count == 1:
+                view.window = self.editor_win
+            elif f.split == "vertical":
+                w = width // count
+                left = x + i*w
+                if i == count-1:
+                    w = width - i*w
+                view.window = curses.newwin(height, w, y, left)
+            else:
+                h = height // count
+                top = y + i*h
+                if i == count-1:
+                    h = height - i*h
+                view.window = curses.newwin(h, width, top, x)
+            view.resize()
+        return True
 
     def size(self):
         """Get terminal size."""
@@ -226,7 +260,7 @@ class UI:
         file_list = files[curr_file_index:] + files[:curr_file_index]
         str_list = []
         for f in file_list:
-            fname = f.name + (["", "*"][f.is_changed()])
+            fname = f.name + (["", "*"][f.is_changed()]) + (["", " (read only)"][f.read_only])
             if not str_list:
                 str_list.append("[" + fname + "]")
             else:
@@ -241,6 +275,15 @@ class UI:
         data = "@ "+str(cur[0])+","+str(cur[1])+" "+\
             "cur:"+str(len(editor.cursors))+" "+\
             "buf:"+str(len(editor.buffer))
+        f = self.app.get_file()
+        if len(f.views) > 1:
+            data += " view:"+str(f.views.index(editor)+1)+"/"+str(len(f.views))
+        path = editor.outline.path_at(cur[1])
+        if path:
+            symbol = ".".join(path)
+            if len(symbol) > MAX_SYMBOL_LENGTH:
+                symbol = "..." + symbol[-MAX_SYMBOL_LENGTH+3:]
+            data = symbol + " " + data
         if self.app.config["app"]["debug"]:
             data += " cs:"+str(editor.current_state)+" hist:"+str(len(editor.history))  # Undo / Redo debug
         #if editor.last_find:
@@ -307,15 +350,18 @@ class UI:
         self.status_win.addstr(0, 0, s, curses.A_REVERSE)
         self.status_win.addstr(0, len(s), value)
 
-    def _query(self, text, initial=""):
+    def _query(self, text, initial="", validate=None):
         """Ask for text input via the status bar."""
         self.show_capture_status(text, initial)
         self.text_input = curses.textpad.Textbox(self.status_win)
         try:
-            out = self.text_input.edit()
+            out = self.text_input.edit(validate)
         except:
             return False
+        return self.strip_query(text, out)
 
+    def strip_query(self, text, out):
+        """Remove the prompt and trailing whitespace from query input."""
         # If input begins with prompt, remove the prompt text
         if len(out) >= len(text):
            if out[:len(text)] == text:
@@ -324,6 +370,41 @@ class UI:
         out = out.rstrip("\r\n")
         return out
 
+    def query_filter(self, text, initial, on_change):
+        """Ask for text input and call on_change(value, key) as it's typed.
+
+        on_change is called with the new value after each edit, and with
+        other keys (like up and down) first. If it returns True for a key
+        the key isn't passed to the text input.
+        """
+        def validate(key):
+            if key in [curses.ascii.NL, curses.ascii.CR, curses.ascii.BEL, curses.KEY_ENTER]:
+                return curses.ascii.BEL # Finish input
+            if on_change(None, key):
+                return 0
+            self.text_input.do_command(key)
+            # Gathering moves the cursor, so put it back
+            y, x = self.status_win.getyx()
+            value = self.strip_query(text, self.text_input.gather())
+            self.status_win.move(y, x)
+            on_change(value, None)
+            return 0
+        self.status_win.keypad(1)
+        try:
+            return self._query(text, initial, validate)
+        finally:
+            self.status_win.keypad(0)
+
+    def show_list(self, items, selected=0):
+        """Show a list of items in the editor window, highlighting the selected one."""
+        win = self.editor_win
+        height, width = win.getmaxyx()
+        win.clear()
+        for y, item in enumerate(items[:height]):
+            attr = curses.A_REVERSE if y == selected else curses.A_NORMAL
+            win.addstr(y, 0, item[:width-1], attr)
+        win.refresh()
+
     def query(self, text, initial=""):
         result = self._query(text, initial)
         return result
@@ -381,10 +462,15 @@ class UI:
 
     def _translate_mouse_to_editor(self, state):
         """Translate the screen coordinates to a position in the editor view."""
-        editor = self.app.get_editor()
+        f = self.app.get_file()
+        editor = f.editor
         x,y = (state[1], state[2])
-        if self.app.config["display"]["show_top_bar"]:
-            y -= 1
-        x -= editor.line_offset()
-        y += editor.y_scroll
+        for view in f.views:
+            top, left = view.window.getbegyx()
+            height, width = view.window.getmaxyx()
+            if top <= y < top+height and left <= x < left+width:
+                f.editor = editor = view # Clicking a view switches to it
+                break
+        top, left = editor.window.getbegyx()
+        x, y = editor.screen_to_pos(x-left, y-top)
         return (state[0], x, y, state[3], state[4])
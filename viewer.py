@@ -6,10 +6,18 @@ Text Viewer component subclassed by Editor.
 import os
 import re
 import sys
-import imp
 import time
+import bisect
 import curses
 
+import display
+import linelight
+
+from document import *
+from rowindex import *
+from brackets import *
+from folds import *
+from outline import *
 from line import *
 from cursor import *
 from helpers import *
@@ -20,7 +28,8 @@ class Viewer:
         self.window = window
         self.config = []
         self.data = ""
-        self.lines = [Line()]
+        self.document = Document()
+        self.document.views.append(self)
         self.file_extension = ""
         
         self.linelighter = lambda line: 0 # Dummy linelighter returns default color
@@ -31,37 +40,58 @@ class Viewer:
         self.y_scroll = 0
         self.x_scroll = 0
         self.cursors = [Cursor()]
+        self.dirty_rows = None      # (first, last) window rows to redraw after edits in other views
+        self.drawn_offset = None    # Line number width when last rendered
+        self.row_index = RowIndex(self)
+        self.folds = FoldIndex(self)
+        # Notified when lines change, the row index before the folds that correct it
+        self.line_listeners = [self.row_index, self.folds]
+        self.brackets = BracketIndex(self)
+        self.outline = OutlineIndex(self)
+        self.document.listeners.extend([self.brackets, self.outline])
         self.setup_linelight()
 
+    @property
+    def lines(self):
+        return self.document.lines
+
+    @lines.setter
+    def lines(self, lines):
+        self.document.lines = lines
+
+    @property
+    def revision(self):
+        return self.document.revision
+
+    def use_document(self, other):
+        """Show the document of another viewer, starting from its cursors and scroll position."""
+        self.close_view()
+        self.document = other.document
+        self.document.views.append(self)
+        self.brackets = other.brackets
+        self.outline = other.outline
+        self.set_file_extension(other.file_extension)
+        self.cursors = [Cursor(cursor) for cursor in other.cursors]
+        self.y_scroll = other.y_scroll
+        self.x_scroll = other.x_scroll
+        self.folds.lines_reset()
+        self.row_index.lines_reset()
+
+    def close_view(self):
+        """Stop showing the document."""
+        if self in self.document.views:
+            self.document.views.remove(self)
+
     def set_config(self, config):
         self.config = config
         self.set_cursor(self.config["cursor"])
 
     def setup_linelight(self):
         """Setup line based highlighting."""
-        curr_path = os.path.dirname(os.path.realpath(__file__))
-
-        filename = self.file_extension + ".py"
-        path = os.path.join(curr_path, "linelight", filename)
-
-        mod = False
-        if os.path.isfile(path):
-            try:
-                mod = imp.load_source(self.file_extension, path)
-            except:
-                self.app.logger.log(get_error_info())
-        else:
-            path = os.path.join(curr_path, "linelight", "generic.py")
-            if os.path.isfile(path):
-                try:
-                    mod = imp.load_source("generic", path)
-                except:
-                    self.app.logger.log(get_error_info())
-
-        if not mod or not "parse" in dir(mod):
+        parser = linelight.get_parser(self.file_extension, self.app.logger)
+        if not parser:
             return False
-            
-        self.linelighter = mod.parse
+        self.linelighter = parser
 
     def size(self):
         """Get editor size (x,y)."""
@@ -75,22 +105,112 @@ class Viewer:
     def get_line_color(self, raw_line):
         """Return a color based on line contents."""
         try:
-            return self.linelighter(raw_line)
+            return self.linelighter(raw_line.highlight_sample())
         except:
             return 0
 
+    def lines_changed(self, y, removed=1, added=1):
+        """Tell the views and listeners that lines y...y+removed were replaced with added lines."""
+        self.document.lines_changed(y, removed, added, self)
+
+    def lines_reset(self):
+        """Tell the views and listeners that any or all lines may have changed."""
+        self.document.lines_reset(self)
+
+    def view_lines_changed(self, y, removed, added, source):
+        """Update the view after lines changed through the viewer source."""
+        for listener in self.line_listeners:
+            listener.lines_changed(y, removed, added)
+        if source != self:
+            self.follow_lines(y, removed, added)
+
+    def view_lines_reset(self, source):
+        """Update the view after any or all lines changed through the viewer source."""
+        for listener in self.line_listeners:
+            listener.lines_reset()
+        if source != self:
+            last = len(self.lines)-1
+            for cursor in self.cursors:
+                cursor.y = min(cursor.y, last)
+            self.y_scroll = min(self.y_scroll, last)
+            self.mark_dirty(0, self.size()[1])
+
+    def follow_lines(self, y, removed, added):
+        """Move cursors and scroll along with lines changed in another view and mark the rows to redraw."""
+        delta = added - removed
+        for cursor in self.cursors:
+            if cursor.y >= y+removed:
+                cursor.y += delta
+            elif cursor.y >= y+added:
+                cursor.y = y + max(0, added-1)
+        if self.y_scroll >= y+removed:
+            self.y_scroll += delta
+            if not delta or not self.config["show_line_nums"]:
+                return # Only lines above the view changed
+        elif self.y_scroll >= y+added:
+            self.y_scroll = y
+        max_y = self.size()[1]
+        top = self.line_row(self.y_scroll)
+        first = max(0, self.line_row(y) - top)
+        if removed != added or self.soft_wrap():
+            last = max_y # The rows below moved
+        else:
+            last = self.line_row(y+added) - top
+        if self.line_offset() != self.drawn_offset:
+            first, last = 0, max_y # Line numbers got wider or narrower
+        if first < max_y and last > 0:
+            self.mark_dirty(first, min(last, max_y))
+
+    def mark_dirty(self, first, last):
+        """Mark window rows first...last to be redrawn."""
+        if self.dirty_rows != None:
+            first = min(first, self.dirty_rows[0])
+            last = max(last, self.dirty_rows[1])
+        self.dirty_rows = (first, last)
+
     def log(self, s):
         """Log to the app."""
         #TODO: log types: ERROR | WARNING | NOTICE
         self.app.log(s)
 
-    def set_data(self, data):
-        """Set editor data or contents."""
+    def set_data(self, data, lines=None):
+        """Set editor data or contents. lines can be the Line objects of data if it was already split."""
         self.data = data
-        self.lines = []
-        lines = self.data.split("\n")
-        for line in lines:
-            self.lines.append(Line(line))
+        self.document.read_only = False
+        if lines == None:
+            lines = [Line(line) for line in self.data.split("\n")]
+        self.lines = lines
+        self.lines_reset()
+
+    def set_lines(self, lines):
+        """Show a read only sequence of Line objects, like the IndexedLines of a large file."""
+        self.data = ""
+        self.document.read_only = True
+        self.lines = lines
+        self.lines_reset()
+
+    def append_data(self, text):
+        """Append text to the end of the contents without resplitting the rest.
+
+        If the main cursor is on the last line it's kept at the end.
+        """
+        cur = self.cursor()
+        at_end = len(self.cursors) == 1 and cur.y == len(self.lines)-1
+        parts = text.split("\n")
+        last = self.lines[-1]
+        self.lines[-1] = Line(last.data + parts[0])
+        self.lines.extend([Line(part) for part in parts[1:]])
+        self.lines_changed(len(self.lines)-len(parts), 1, len(parts))
+        if at_end:
+            self.follow_end()
+
+    def follow_end(self):
+        """Move the main cursor to the end and scroll the last lines into view."""
+        cur = self.cursor()
+        cur.y = len(self.lines)-1
+        cur.x = 0
+        self.y_scroll = max(0, len(self.lines) - self.size()[1])
+        self.x_scroll = 0
 
     def get_data(self):
         """Get editor contents."""
@@ -131,6 +251,85 @@ class Viewer:
         """Get maximum line length that fits in the editor."""
         return self.size()[0]-self.line_offset()-1
 
+    def soft_wrap(self):
+        """Check if long lines are wrapped on multiple rows."""
+        return self.config["soft_wrap"]
+
+    def wrap_width(self):
+        """Get the number of characters shown on one row when wrapping."""
+        return max(1, self.max_line_length())
+
+    def row_width(self):
+        """Get the width the row index measures lines with, 0 if they aren't wrapped."""
+        if self.soft_wrap():
+            return self.wrap_width()
+        return 0
+
+    def line_height(self, y, width):
+        """Get the number of screen rows line y takes, 0 if it's folded away."""
+        if self.folds.hidden(y):
+            return 0
+        if not width:
+            return 1
+        return self.line_rows(y, width)
+
+    def line_row(self, y):
+        """Get the first screen row of line y, counted from the top of the file."""
+        if self.soft_wrap() or self.folds.any():
+            return self.row_index.row_of(y)
+        return y
+
+    def row_line(self, row):
+        """Get the line shown on a screen row, counted from the top of the file."""
+        if self.soft_wrap() or self.folds.any():
+            y = self.row_index.line_at(row)
+            if self.folds.hidden(y):
+                y = self.folds.fold_start(y) # Past the end of a fold on the last line
+            return y
+        return row
+
+    def line_end(self, y):
+        """Get the text shown after line y."""
+        if self.folds.is_folded(y):
+            return self.config["fold_char"]
+        if self.show_line_ends:
+            return self.config["line_end_char"]
+        return ""
+
+    def line_rows(self, y, width):
+        """Get the number of screen rows line y takes when wrapped to width."""
+        line = self.lines[y]
+        starts = line.row_starts(self.config["tab_width"], width)
+        if starts == None:
+            # The last row must leave room for the cursor at the line end
+            return len(line) // width + 1
+        return len(starts)
+
+    def line_columns(self, line):
+        """Get the display column of each character on a line (None if they equal the indices)."""
+        return line.columns(self.config["tab_width"])
+
+    def char_col(self, line, x):
+        """Get the display column of character index x on a line."""
+        cols = self.line_columns(line)
+        if cols == None:
+            return x
+        if x >= len(cols):
+            return cols[-1] + x - len(cols) + 1
+        return cols[x]
+
+    def line_width(self, line):
+        """Get the display width of a line."""
+        return self.char_col(line, len(line))
+
+    def wrapped_pos(self, line, x, width):
+        """Get the (row, column) of character x on a line wrapped to width."""
+        starts = line.row_starts(self.config["tab_width"], width)
+        if starts == None:
+            return (x // width, x % width)
+        row = max(0, bisect.bisect_right(starts, x) - 1)
+        return (row, self.char_col(line, x) - self.char_col(line, starts[row]))
+
     def line_offset(self):
         """Get the x coordinate of beginning of line."""
         if not self.config["show_line_nums"]:
@@ -149,6 +348,7 @@ class Viewer:
     def toggle_line_nums(self):
         """Toggle display of line numbers."""
         self.config["show_line_nums"] = not self.config["show_line_nums"]
+        self.redraw_views()
         self.render()
 
     def toggle_line_ends(self):
@@ -156,6 +356,19 @@ class Viewer:
         self.show_line_ends = not self.show_line_ends
         self.render()
 
+    def toggle_soft_wrap(self):
+        """Toggle wrapping long lines."""
+        self.config["soft_wrap"] = not self.config["soft_wrap"]
+        self.x_scroll = 0
+        self.redraw_views()
+        self.move_cursors()
+
+    def redraw_views(self):
+        """Mark the other views of the document to be redrawn completely."""
+        for view in self.document.views:
+            if view != self:
+                view.mark_dirty(0, view.size()[1])
+
     def toggle_highlight(self):
         """Toggle syntax highlighting."""
         return False
@@ -167,12 +380,50 @@ class Viewer:
     def render(self):
         """Render the editor curses window."""
         self.window.clear()
+        self.dirty_rows = None
+        self.drawn_offset = self.line_offset()
+        if self.soft_wrap():
+            self.render_wrapped()
+        else:
+            self.render_lines()
+        self.render_brackets()
+        self.render_cursors()
+        self.window.refresh()
+
+    def render_changes(self):
+        """Redraw only the rows changed through other views. Returns True if anything was drawn."""
+        if self.dirty_rows == None:
+            return False
+        first, last = self.dirty_rows
+        self.dirty_rows = None
         max_y = self.size()[1]
-        i = 0
-        x_offset = self.line_offset()
+        if first <= 0 and last >= max_y:
+            self.render()
+            return True
+        for i in range(first, last):
+            self.window.move(i, 0)
+            self.window.clrtoeol()
+        if self.soft_wrap():
+            self.render_wrapped(first, last)
+        else:
+            self.render_lines(first, last)
+        self.render_brackets()
+        self.render_cursors()
+        self.window.refresh()
+        return True
+
+    def render_lines(self, first=0, last=None):
+        """Render one line per row, cutting long lines at the window edge."""
+        max_y = self.size()[1]
+        if last != None:
+            max_y = min(max_y, last)
+        i = first
+        row = self.line_row(self.y_scroll) + first
+        lnum = self.row_line(row)
+        if self.line_row(lnum) != row:
+            return # Past the last line
         max_len = self.max_line_length()
         while i < max_y:
-            lnum = i + self.y_scroll
             if lnum >= len(self.lines): # Make sure we have a line to show
                 break
 
@@ -181,36 +432,117 @@ class Viewer:
                 self.window.addstr(i, 0, self.pad_lnum(lnum+1)+" ", curses.color_pair(4))
 
             # Normal rendering
-            line_part = line[min(self.x_scroll, len(line)):]
-            if self.show_line_ends:
-                line_part += self.config["line_end_char"]
-            if len(line_part) >= max_len:
-                line_part = line_part[:max_len]
-
-            if self.config["show_white_space"]:
-                line_part = line_part.replace(" ", self.config["white_space_char"])
-            line_part = line_part.encode("utf-8")
-            if self.config["show_line_colors"]:
-                self.window.addstr(i, x_offset, line_part, curses.color_pair(self.get_line_color(line)))
-            else:
-                self.window.addstr(i, x_offset, line_part)
+            cols = self.line_columns(line)
+            line_part = display.slice_columns(line, cols, self.x_scroll, max_len)
+            if self.line_width(line) - self.x_scroll < max_len:
+                line_part += self.line_end(lnum)
+            self.render_line_part(i, line, line_part)
 
             i += 1
-        self.render_cursors()
-        self.window.refresh()
+            lnum = self.folds.next_visible(lnum)
+
+    def render_wrapped(self, first=0, last=None):
+        """Render long lines on multiple rows."""
+        max_y = self.size()[1]
+        if last != None:
+            max_y = min(max_y, last)
+        width = self.wrap_width()
+        i = first
+        top = self.row_index.row_of(self.y_scroll) + first
+        lnum = self.row_line(top)
+        row = top - self.row_index.row_of(lnum) # Start partway through a line
+        while i < max_y and lnum < len(self.lines):
+            line = self.lines[lnum]
+            if self.config["show_line_nums"] and row == 0:
+                self.window.addstr(i, 0, self.pad_lnum(lnum+1)+" ", curses.color_pair(4))
+            rows = self.line_rows(lnum, width)
+            starts = line.row_starts(self.config["tab_width"], width)
+            cols = self.line_columns(line)
+            while row < rows and i < max_y:
+                if starts == None:
+                    line_part = line[row*width:(row+1)*width]
+                else:
+                    line_part = display.slice_columns(line, cols, cols[starts[row]], width)
+                if row == rows-1:
+                    line_part = (line_part + self.line_end(lnum))[:width]
+                self.render_line_part(i, line, line_part)
+                row += 1
+                i += 1
+            lnum = self.folds.next_visible(lnum)
+            row = 0
+
+    def render_line_part(self, i, line, line_part):
+        """Draw the visible part of a line on row i."""
+        x_offset = self.line_offset()
+        if self.config["show_white_space"]:
+            line_part = line_part.replace(" ", self.config["white_space_char"])
+        if self.config["show_line_colors"]:
+            self.window.addstr(i, x_offset, line_part, curses.color_pair(self.get_line_color(line)))
+        else:
+            self.window.addstr(i, x_offset, line_part)
 
     def render_cursors(self):
         """Render editor window cursors."""
-        max_x, max_y = self.size()
-        main = self.cursor()
         for cursor in self.cursors:
-            x = cursor.x - self.x_scroll + self.line_offset()
-            y = cursor.y - self.y_scroll
-            if y < 0: continue
-            if y >= max_y: break
-            if x < self.line_offset(): continue 
-            if x > max_x-1: continue 
-            self.window.chgat(y, cursor.x+self.line_offset()-self.x_scroll, 1, self.cursor_style)
+            pos = self.pos_to_screen(cursor.x, cursor.y)
+            if pos != None:
+                self.window.chgat(pos[1], pos[0], 1, self.cursor_style)
+
+    def render_brackets(self):
+        """Highlight the brackets enclosing the main cursor."""
+        if not self.config["highlight_brackets"] or len(self.cursors) > 1 or self.document.read_only:
+            return
+        cursor = self.cursor()
+        pair = self.brackets.enclosing_pair(cursor.x, cursor.y)
+        if pair == None:
+            return
+        for x, y in pair:
+            pos = self.pos_to_screen(x, y)
+            if pos != None:
+                self.window.chgat(pos[1], pos[0], 1, curses.A_BOLD | curses.A_UNDERLINE)
+
+    def pos_to_screen(self, x, y):
+        """Translate a position in the text to window coordinates, None if it's not visible."""
+        max_x, max_y = self.size()
+        if self.folds.hidden(y):
+            return None
+        if self.soft_wrap():
+            row, col = self.wrapped_pos(self.lines[y], x, self.wrap_width())
+            y = self.row_index.row_of(y) - self.row_index.row_of(self.y_scroll) + row
+            x = col + self.line_offset()
+        else:
+            x = self.char_col(self.lines[y], x) - self.x_scroll + self.line_offset()
+            y = self.line_row(y) - self.line_row(self.y_scroll)
+            if x < self.line_offset():
+                return None
+        if y < 0 or y >= max_y or x > max_x-1:
+            return None
+        return (x, y)
+
+    def screen_to_pos(self, x, y):
+        """Translate window coordinates to a position in the text."""
+        x -= self.line_offset()
+        if not self.soft_wrap():
+            line_no = self.row_line(self.line_row(self.y_scroll) + y)
+            if line_no < 0 or line_no >= len(self.lines):
+                return (x + self.x_scroll, line_no)
+            line = self.lines[line_no]
+            return (display.char_at_column(self.line_columns(line), x + self.x_scroll, len(line)), line_no)
+        index = self.row_index
+        row = index.row_of(self.y_scroll) + y
+        line_no = index.line_at(row)
+        line = self.lines[line_no]
+        row -= index.row_of(line_no)
+        width = self.wrap_width()
+        starts = line.row_starts(self.config["tab_width"], width)
+        if starts == None:
+            return (row * width + x, line_no)
+        row = min(row, len(starts)-1)
+        cols = self.line_columns(line)
+        x = display.char_at_column(cols, cols[starts[row]] + max(0, x), len(line))
+        if row+1 < len(starts):
+            x = min(x, starts[row+1]-1) # Clicked past the end of the row
+        return (x, line_no)
 
     def refresh(self):
         """Refresh the editor curses window."""
@@ -244,39 +576,61 @@ class Viewer:
                 if delta[0] != 0 and cursor.x >= 0:
                     cursor.x += delta[0]
                 if delta[1] != 0 and cursor.y >= 0:
-                    cursor.y += delta[1]
+                    cursor.y = self.folds.step(cursor.y, delta[1]) # Skip over folds
 
             if cursor.x < 0: cursor.x = 0
             if cursor.y < 0: cursor.y = 0
             if cursor.y >= len(self.lines)-1: cursor.y = len(self.lines)-1
             if cursor.x >= len(self.lines[cursor.y]): cursor.x = len(self.lines[cursor.y])
+            if self.folds.any():
+                self.folds.reveal(cursor.y) # Unfold lines cursors are moved to
 
         cur = self.cursor() # Main cursor
-        size = self.size()
-        offset = self.line_offset()
-        if len(self.cursors) == 1:
-            if cur.y - self.y_scroll >= size[1]:
-                self.y_scroll = cur.y - size[1]+1
-            elif cur.y - self.y_scroll < 0:
-                self.y_scroll = cur.y
-        if cur.x - self.x_scroll+offset > size[0] - 1:
-            # -1 to allow space for cursor at line end
-            self.x_scroll = len(self.lines[cur.y]) - size[0]+offset+1
-        if cur.x - self.x_scroll < 0:
-            self.x_scroll  -= abs(cur.x - self.x_scroll) # FIXME
-        if cur.x - self.x_scroll+offset < offset:
-            self.x_scroll -= 1
+        if self.soft_wrap():
+            self.scroll_wrapped()
+        else:
+            size = self.size()
+            offset = self.line_offset()
+            if len(self.cursors) == 1:
+                row = self.line_row(cur.y)
+                if row - self.line_row(self.y_scroll) >= size[1]:
+                    self.y_scroll = self.row_line(row - size[1]+1)
+                elif cur.y < self.y_scroll:
+                    self.y_scroll = cur.y
+            # Scroll by display columns so wide characters and tabs are accounted for
+            col = self.char_col(self.lines[cur.y], cur.x)
+            if col - self.x_scroll+offset > size[0] - 1:
+                # -1 to allow space for cursor at line end
+                self.x_scroll = col - size[0]+offset+1
+            if col - self.x_scroll < 0:
+                self.x_scroll = col
         if not noupdate:
             self.purge_cursors()
 
+    def scroll_wrapped(self):
+        """Scroll the main cursor into view when lines are wrapped."""
+        self.x_scroll = 0
+        if len(self.cursors) != 1:
+            return
+        cur = self.cursor()
+        if cur.y < self.y_scroll:
+            self.y_scroll = cur.y
+            return
+        index = self.row_index
+        row = index.row_of(cur.y) + self.wrapped_pos(self.lines[cur.y], cur.x, self.wrap_width())[0]
+        top = row - self.size()[1] + 1
+        if top > index.row_of(self.y_scroll):
+            y = index.line_at(top)
+            if index.row_of(y) < top:
+                y += 1 # Don't show partial lines at the top
+            self.y_scroll = min(y, cur.y)
+
     def scroll_to_line(self, line_no):
         """Center the viewport on line_no."""
         if line_no >= len(self.lines):
             line_no = len(self.lines)-1
-        new_y = line_no - int(self.size()[1] / 2)
-        if new_y < 0:
-            new_y = 0
-        self.y_scroll = new_y
+        row = self.line_row(line_no) - int(self.size()[1] / 2)
+        self.y_scroll = self.row_line(max(0, row))
 
     def move_x_cursors(self, line, col, delta):
         """Move all cursors starting at line and col with delta on the x axis."""
@@ -323,12 +677,7 @@ class Viewer:
 
     def get_lines_with_cursors(self):
         """Return all line indices that have cursors."""
-        line_nums = []
-        for cursor in self.cursors:
-            if not cursor.y in line_nums:
-                line_nums.append(cursor.y)
-        line_nums.sort()
-        return line_nums
+        return sorted(set(cursor.y for cursor in self.cursors))
 
     def cursor_exists(self, cursor):
         """Check if a given cursor exists."""
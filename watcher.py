@@ -0,0 +1,113 @@
+#-*- encoding: utf-8
+"""
+Detect changes made to open files by other programs.
+"""
+
+import os
+import time
+import struct
+
+from helpers import *
+
+class Inotify:
+    """Minimal inotify wrapper via ctypes. Raises OSError where unavailable."""
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+        name = ctypes.util.find_library("c")
+        if not name:
+            raise OSError("libc not found")
+        self.libc = ctypes.CDLL(name, use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError("inotify not supported")
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.mask = self.IN_MODIFY | self.IN_ATTRIB | self.IN_CLOSE_WRITE | \
+            self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE
+        self.watches = {}  # Watch descriptor -> directory
+
+    def watch(self, directory):
+        """Watch a directory (files are often replaced, so watch their parents).
+
+        Returns True if the directory wasn't watched before and None if
+        it can't be watched.
+        """
+        if directory in self.watches.values():
+            return False
+        wd = self.libc.inotify_add_watch(self.fd, directory.encode("utf-8"), self.mask)
+        if wd < 0:
+            return None
+        self.watches[wd] = directory
+        return True
+
+    def read(self):
+        """Return the set of paths that had events since the last read."""
+        paths = set()
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+            i = 0
+            while i < len(data):
+                wd, mask, cookie, length = struct.unpack_from("iIII", data, i)
+                i += 16
+                name = data[i:i+length].rstrip(b"\0").decode("utf-8", "surrogateescape")
+                i += length
+                if wd in self.watches:
+                    paths.add(os.path.join(self.watches[wd], name))
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+class FileWatcher:
+    def __init__(self, app):
+        self.app = app
+        self.last_check = 0
+        self.inotify = None
+        try:
+            self.inotify = Inotify()
+        except Exception:
+            self.app.log("inotify unavailable, polling files instead.", LOG_INFO)
+
+    def watched_files(self):
+        """Return the open files that are backed by a file on disk."""
+        return [f for f in self.app.get_files() if f.name and f.loaded and f.disk_stat and not f.follow]
+
+    def check(self):
+        """Return a list of open files that have changed on disk."""
+        config = self.app.config["app"]
+        if not config["watch_files"]:
+            return []
+        now = time.time()
+        if now - self.last_check < config["watch_interval"]:
+            return []
+        self.last_check = now
+        files = self.watched_files()
+        if self.inotify:
+            new_dirs = set()
+            for f in files:
+                if self.inotify.watch(f.fpath) != False:
+                    new_dirs.add(f.fpath)
+            events = self.inotify.read()
+            # Only stat the files inotify told us about, and ones in newly
+            # watched directories since they may have changed before that
+            files = [f for f in files if f.path() in events or f.fpath in new_dirs]
+        changed = []
+        for f in files:
+            if f.stat() != f.disk_stat:
+                changed.append(f)
+        return changed